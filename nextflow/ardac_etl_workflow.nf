@@ -5,11 +5,16 @@ include { CASE_NODE_MAPPER } from './modules/mappers.nf'
 include { DEMOGRAPHIC_NODE_MAPPER } from './modules/mappers.nf'
 include { FOLLOWUP_NODE_MAPPER } from './modules/mappers.nf'
 include { AUDIT_NODE_MAPPER } from './modules/mappers.nf'
+include { ALL_NODES_MAPPER } from './modules/mappers.nf'
+include { SCATTER_DCC } from './modules/mappers.nf'
+include { GATHER_NODES } from './modules/mappers.nf'
+include { METRICS_REPORT } from './modules/mappers.nf'
 
 workflow {
 
-   // params.subjects_type should be provided on the command line
-   subjects_type = params.subjects_type
+   // params.subjects_type selects observational, clinical, or all subjects types.  With all,
+   // the mappers of both subjects types are scheduled concurrently.
+   subjects_type = params.subjects_type ?: 'all'
    input_dir = file(params.input_directory)
    node_templates_path = input_dir.resolve(params.node_templates_directory)
    obs_input_dir = input_dir.resolve(params.obs_input_directory)
@@ -30,26 +35,20 @@ workflow {
    dcc_rct_soc_file = rct_input_dir.resolve(params.clinical_soc_csv_file)
    dcc_obs_audit_file = obs_input_dir.resolve(params.observational_audit_csv_file)
    dcc_rct_audit_file = rct_input_dir.resolve(params.clinical_audit_csv_file)
-   
-   // Make the needed output directories
+
+   // Make the needed output directories, the processes write into their work directories and their node files are published here
    node_output_path.mkdirs()
 
-   if (subjects_type == 'observational') {
-      subjects_val = 'obs'
-      dcc_subjects_file = dcc_obs_subjects_file
-      dcc_liver_scores_file = dcc_obs_liver_scores_file
-      dcc_med_info_file = dcc_obs_med_info_file
-      dcc_vitals_file = dcc_obs_vitals_file
-      dcc_soc_file = dcc_obs_soc_file
-      dcc_audit_file = dcc_obs_audit_file
-   } else if (subjects_type == 'clinical') {
-      subjects_val = 'rct'
-      dcc_subjects_file = dcc_rct_subjects_file
-      dcc_liver_scores_file = dcc_rct_liver_scores_file
-      dcc_med_info_file = dcc_rct_med_info_file
-      dcc_vitals_file = dcc_rct_vitals_file
-      dcc_soc_file = dcc_rct_soc_file
-      dcc_audit_file = dcc_rct_audit_file
+   // The filename subjects type value and the DCC subject, liver scores, med info, vitals, soc, and audit files of each subjects type
+   subjects_inputs = [
+      observational: ['obs', dcc_obs_subjects_file, dcc_obs_liver_scores_file, dcc_obs_med_info_file, dcc_obs_vitals_file, dcc_obs_soc_file, dcc_obs_audit_file],
+      clinical: ['rct', dcc_rct_subjects_file, dcc_rct_liver_scores_file, dcc_rct_med_info_file, dcc_rct_vitals_file, dcc_rct_soc_file, dcc_rct_audit_file],
+   ]
+
+   if (subjects_type == 'all') {
+      subjects_types = ['observational', 'clinical']
+   } else if (subjects_inputs.containsKey(subjects_type)) {
+      subjects_types = [subjects_type]
    } else {
       log.info "Unsupported subject type given: ${subjects_type}"
       error "Unsupported subjects type: ${subjects_type}"
@@ -58,20 +57,22 @@ workflow {
    log.info "---------------------"
    log.info "Workflow parameters: "
    log.info "---------------------"
-   log.info "subjects_type        : ${subjects_type}"
+   log.info "subjects_types       : ${subjects_types}"
    log.info "input_dir            : ${input_dir}"
    log.info "node_templates_path  : ${node_templates_path}"
    log.info "obs_input_dir        : ${obs_input_dir}"
    log.info "output_dir           : ${output_dir}"
    log.info "rct_input_dir        : ${rct_input_dir}"
    log.info "node_output_path     : ${node_output_path}"
-   log.info "dcc_subjects_file    : ${dcc_subjects_file}"
-   log.info "dcc_liver_scores_file: ${dcc_liver_scores_file}"
-   log.info "dcc_med_info_file    : ${dcc_med_info_file}"
-   log.info "dcc_vitals_file      : ${dcc_vitals_file}"
-   log.info "dcc_soc_file         : ${dcc_soc_file}"
-   log.info "dcc_audit_file       : ${dcc_audit_file}"
-   
+   subjects_types.each { type ->
+      log.info "${type} DCC files: ${subjects_inputs[type].drop(1).collect { it.name }.join(', ')}"
+   }
+   log.info "all_nodes_mapper     : ${params.all_nodes_mapper}"
+   log.info "previous_input_dir   : ${params.previous_input_directory}"
+   log.info "collect_metrics      : ${params.collect_metrics}"
+   log.info "validate             : ${params.validate}"
+   log.info "subject_shards       : ${params.subject_shards}"
+
 
    GET_MAPPER_DCC_VERSION()
    mapper_dcc_version = GET_MAPPER_DCC_VERSION.out.mapper_dcc_version
@@ -81,11 +82,92 @@ workflow {
          error "Mapper DCC version (${path.text}) does not match NextFlow DCC version (${params.dcc_release})"
    }
 
-   CASE_NODE_MAPPER(node_templates_path, dcc_subjects_file, node_output_path, subjects_type, subjects_val)
+   // One item per subjects type: the filename subjects type value, the subjects type, and the DCC files
+   subjects_channel = Channel.fromList(subjects_types).map { type ->
+      def (subjects_val, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file, audit_file) = subjects_inputs[type]
+      tuple(subjects_val, type, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file, audit_file)
+   }
 
-   DEMOGRAPHIC_NODE_MAPPER(node_templates_path, dcc_subjects_file, node_output_path, subjects_type, subjects_val, CASE_NODE_MAPPER.out.case_node_file)
-   
-   FOLLOWUP_NODE_MAPPER(node_templates_path, dcc_subjects_file, dcc_liver_scores_file, dcc_med_info_file, dcc_vitals_file, dcc_soc_file, node_output_path, subjects_type, subjects_val, CASE_NODE_MAPPER.out.case_node_file)
+   // Each item of mapper_inputs is the input of one run of the mappers: the filename subjects type value,
+   // the shard of subjects or an empty string, the subjects type, and the DCC files
+   sharded = params.subject_shards > 1
+   if (sharded) {
+      // Split the DCC files of each subjects type into shards of subjects, mapped in separate tasks
+      SCATTER_DCC(subjects_channel)
+      mapper_inputs = SCATTER_DCC.out.shard_directories.flatMap { subjects_val, type, shard_directories ->
+         def dcc_file_names = subjects_inputs[type].drop(1).collect { it.name }
+         (shard_directories instanceof List ? shard_directories : [shard_directories]).collect { shard_directory ->
+            [subjects_val, shard_directory.name, type] + dcc_file_names.collect { shard_directory.resolve(it) }
+         }
+      }
+      scatter_metrics_files = SCATTER_DCC.out.metrics_file
+   } else {
+      mapper_inputs = subjects_channel.map { item -> [item[0], ''] + item.drop(1) }
+      scatter_metrics_files = Channel.empty()
+   }
+
+   if (params.all_nodes_mapper) {
+      // Generate every node in one Python process that reads each DCC file once, in delta mode when a previous release is given
+      if (sharded && params.previous_input_directory)
+         log.warn "Delta mode is not used with subject_shards, every subject is mapped"
+      all_nodes_inputs = mapper_inputs.map { subjects_val, shard, type, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file, audit_file ->
+         // The previous release directories are staged as inputs, so a change to their files reruns the task on -resume
+         def delta_mode = params.previous_input_directory && !sharded
+         def previous_dcc_directory = []
+         def previous_nodes_directory = []
+         if (delta_mode) {
+            previous_dcc_directory = file(params.previous_input_directory).resolve(type == 'observational' ? params.obs_input_directory : params.rct_input_directory)
+            previous_nodes_directory = file(params.previous_nodes_directory)
+         }
+         tuple(subjects_val, shard, type, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file, audit_file, delta_mode, previous_dcc_directory, previous_nodes_directory)
+      }
+      ALL_NODES_MAPPER(node_templates_path, all_nodes_inputs)
+      mapper_outputs = ALL_NODES_MAPPER.out
+      metrics_files = ALL_NODES_MAPPER.out.metrics_file
+   } else {
+      // The chains of each subjects type and shard run independently, joined to their own case node on the filename
+      // subjects type value and the shard.  Each process reads the case node staged into its work directory, so the
+      // demographic, follow-up and audit mappers of a subjects type and shard run at the same time.
+      CASE_NODE_MAPPER(node_templates_path,
+         mapper_inputs.map { subjects_val, shard, type, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file, audit_file -> tuple(subjects_val, shard, type, subjects_file) })
+      case_node_files = CASE_NODE_MAPPER.out.case_node_files
 
-   AUDIT_NODE_MAPPER(node_templates_path, dcc_audit_file, node_output_path, subjects_type, subjects_val, CASE_NODE_MAPPER.out.case_node_file)
+      DEMOGRAPHIC_NODE_MAPPER(node_templates_path,
+         mapper_inputs.map { subjects_val, shard, type, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file, audit_file -> tuple(subjects_val, shard, type, subjects_file) }.join(case_node_files, by: [0, 1]))
+
+      FOLLOWUP_NODE_MAPPER(node_templates_path,
+         mapper_inputs.map { subjects_val, shard, type, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file, audit_file -> tuple(subjects_val, shard, type, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file) }.join(case_node_files, by: [0, 1]))
+
+      AUDIT_NODE_MAPPER(node_templates_path,
+         mapper_inputs.map { subjects_val, shard, type, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file, audit_file -> tuple(subjects_val, shard, type, audit_file) }.join(case_node_files, by: [0, 1]))
+
+      mapper_outputs = [
+         case_node_files: case_node_files,
+         demographic_node_file: DEMOGRAPHIC_NODE_MAPPER.out.demographic_node_file,
+         followup_node_file: FOLLOWUP_NODE_MAPPER.out.followup_node_file,
+         followup_qc_file: FOLLOWUP_NODE_MAPPER.out.followup_qc_file,
+         audit_node_file: AUDIT_NODE_MAPPER.out.audit_node_file,
+         audit_qc_file: AUDIT_NODE_MAPPER.out.audit_qc_file,
+      ]
+      metrics_files = CASE_NODE_MAPPER.out.metrics_file.mix(DEMOGRAPHIC_NODE_MAPPER.out.metrics_file, FOLLOWUP_NODE_MAPPER.out.metrics_file, AUDIT_NODE_MAPPER.out.metrics_file)
+   }
+
+   if (sharded) {
+      // Combine the six node and QC TSV files of every shard of a subjects type, once all of its shards are mapped
+      shard_case_files = mapper_outputs.case_node_files.map { subjects_val, shard, files ->
+         tuple(subjects_val, shard, (files instanceof List ? files : [files]).find { it.name.endsWith('.tsv') })
+      }
+      shard_node_files = shard_case_files.mix(mapper_outputs.demographic_node_file, mapper_outputs.followup_node_file, mapper_outputs.followup_qc_file,
+                                              mapper_outputs.audit_node_file, mapper_outputs.audit_qc_file)
+         .map { subjects_val, shard, node_file -> tuple(subjects_val, node_file) }
+         .groupTuple(size: 6 * params.subject_shards)
+      GATHER_NODES(subjects_channel.map { subjects_val, type, subjects_file, liver_scores_file, med_info_file, vitals_file, soc_file, audit_file -> tuple(subjects_val, type, subjects_file) }.join(shard_node_files))
+      metrics_files = metrics_files.mix(scatter_metrics_files, GATHER_NODES.out.metrics_file)
+   }
+
+   if (params.collect_metrics) {
+      // Combine the stage metrics of the mapper processes of each subjects type, and of its scatter and gather processes
+      // when sharded, into one report next to the node files
+      METRICS_REPORT(metrics_files.groupTuple())
+   }
 }
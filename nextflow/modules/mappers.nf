@@ -1,7 +1,8 @@
 #!/usr/bin/env nextflow
 
 /*
- * Get the DCC version that the mapping utilities support
+ * Get the DCC version that the mapping utilities support, from the batch runner which
+ * answers without importing pandas
  */
 process GET_MAPPER_DCC_VERSION {
    output:
@@ -11,7 +12,7 @@ process GET_MAPPER_DCC_VERSION {
    """
    echo "PYTHONPATH: \$PYTHONPATH"
    python --version
-   python ${params.ardac_mapper_scripts}/case_node_mapper.py --dcc_version > mapper_dcc_version.txt 
+   python -m ardac.batch_runner --dcc_version > mapper_dcc_version.txt
    """
 }
 
@@ -20,29 +21,35 @@ process GET_MAPPER_DCC_VERSION {
  * provided in CSV format files.
  */
 process CASE_NODE_MAPPER {
+    publishDir "${params.output_directory}/${params.ardac_nodes_directory}", mode: 'copy', pattern: "*_${params.dcc_release}.*", enabled: !shard
+
     input:
         // Path to directory containing node template files
         path node_templates_path
-        // Path to the DCC subject file
-        path dcc_subjects_file 
-        // Path to the output directory
-        path node_output_path
-        // The subjects type
-        val subjects_type
-        // The filename subjects type value
-        val subjects_val
+        // The filename subjects type value, the shard of subjects or an empty string, the subjects type,
+        // and the path to the DCC subject file
+        tuple val(subjects_val), val(shard), val(subjects_type), path(dcc_subjects_file)
 
     output:
-        path("${node_output_path}/case_${subjects_val}_${params.dcc_release}.tsv"), emit: case_node_file
+        // The case node file with its sidecar file when pyarrow is installed, as read by the other mappers
+        tuple val(subjects_val), val(shard), path("case_${subjects_val}_${params.dcc_release}.{tsv,arrow}"), emit: case_node_files
+        tuple val(subjects_val), val(shard), path("case_${subjects_val}_${params.dcc_release}.manifest.json"), emit: manifest_file
+        tuple val(subjects_val), path("case_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json"), optional: true, emit: metrics_file
+        tuple val(subjects_val), path("case_${subjects_val}_${params.dcc_release}.validation.tsv"), optional: true, emit: validation_report
         
     script:
     """
-    python ${params.ardac_mapper_scripts}/case_node_mapper.py \
+    python -m ardac.case_node_mapper \
        --log_level ${params.python_log_level} \
+       --io_engine ${params.io_engine} \
+       ${params.arrow_strings ? '--arrow_strings' : ''} \
+       ${params.force_mappers ? '--force' : ''} \
+       ${params.validate && !shard ? '--validate' : ''} \
+       ${params.collect_metrics ? "--metrics_file case_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json" : ''} \
        --node_templates_path ${node_templates_path} \
        --subjects_type ${subjects_type} \
        --dcc_subjects_file ${dcc_subjects_file} \
-       --node_output_path ${node_output_path}
+       --node_output_path . ${params.case_chunk_size ? "--chunk_size ${params.case_chunk_size}" : ""}
     """
 }
 
@@ -51,31 +58,37 @@ process CASE_NODE_MAPPER {
  * and the ARDaC case node files.
  */
  process DEMOGRAPHIC_NODE_MAPPER {
+   publishDir "${params.output_directory}/${params.ardac_nodes_directory}", mode: 'copy', pattern: "*_${params.dcc_release}.*", enabled: !shard
+
    input:
       // Path to directory containing node template files
       path node_templates_path
-      // Path to the DCC subject file
-      path dcc_subjects_file 
-      // Path to the output directory
-      path node_output_path
-      // The subjects type
-      val subjects_type
-      // The filename subjects type value
-      val subjects_val
-      // The ARDaC case node file generated by CASE_NODE_MAPPER
-      path case_node_file
+      // The filename subjects type value, the shard of subjects or an empty string, the subjects type, the path
+      // to the DCC subject file, and the ARDaC case node and sidecar files generated by CASE_NODE_MAPPER
+      tuple val(subjects_val), val(shard), val(subjects_type), path(dcc_subjects_file), path(case_node_files)
 
    output:
-      path("${node_output_path}/demographic_${subjects_val}_${params.dcc_release}.tsv"), emit: demographic_node_file
+      tuple val(subjects_val), val(shard), path("demographic_${subjects_val}_${params.dcc_release}.tsv"), emit: demographic_node_file
+      tuple val(subjects_val), val(shard), path("demographic_${subjects_val}_${params.dcc_release}.manifest.json"), emit: manifest_file
+      tuple val(subjects_val), path("demographic_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json"), optional: true, emit: metrics_file
+      tuple val(subjects_val), path("demographic_${subjects_val}_${params.dcc_release}.validation.tsv"), optional: true, emit: validation_report
 
    script:
+   // The staged case node TSV file, given alone or with its sidecar file
+   def case_node_file = (case_node_files instanceof java.nio.file.Path ? [case_node_files] : case_node_files).find { it.name.endsWith('.tsv') }
    """
-   python ${params.ardac_mapper_scripts}/demographic_node_mapper.py \
+   python -m ardac.demographic_node_mapper \
        --log_level ${params.python_log_level} \
+       --io_engine ${params.io_engine} \
+       ${params.arrow_strings ? '--arrow_strings' : ''} \
+       ${params.force_mappers ? '--force' : ''} \
+       ${params.validate && !shard ? '--validate' : ''} \
+       ${params.collect_metrics ? "--metrics_file demographic_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json" : ''} \
        --node_templates_path ${node_templates_path} \
        --subjects_type ${subjects_type} \
        --dcc_subjects_file ${dcc_subjects_file} \
-       --node_output_path ${node_output_path}
+       --node_output_path . \
+       --case_node_file ${case_node_file}
    """
  }
 
@@ -84,43 +97,44 @@ process CASE_NODE_MAPPER {
  * and the ARDaC case node files.
  */
  process FOLLOWUP_NODE_MAPPER {
+   cpus params.follow_up_workers
+   publishDir "${params.output_directory}/${params.ardac_nodes_directory}", mode: 'copy', pattern: "*_${params.dcc_release}.*", enabled: !shard
+
    input:
       // Path to directory containing node template files
       path node_templates_path
-      // Path to the DCC subject file
-      path dcc_subjects_file 
-      // Path to the DCC liver scores file
-      path dcc_liver_scores_file
-      // Path to the DCC med info file
-      path dcc_med_info_file
-      // Path to the DCC vitals file
-      path dcc_vitals_file
-      // Path to the DCC soc file
-      path dcc_soc_file
-      // Path to the output directory
-      path node_output_path
-      // The subjects type
-      val subjects_type
-      // The filename subjects type value
-      val subjects_val
-      // The ARDaC case node file generated by CASE_NODE_MAPPER
-      path case_node_file
+      // The filename subjects type value, the shard of subjects or an empty string, the subjects type, the paths
+      // to the DCC subject, liver scores, med info, vitals, and soc files, and the ARDaC case node and sidecar
+      // files generated by CASE_NODE_MAPPER
+      tuple val(subjects_val), val(shard), val(subjects_type), path(dcc_subjects_file), path(dcc_liver_scores_file), path(dcc_med_info_file), path(dcc_vitals_file), path(dcc_soc_file), path(case_node_files)
 
    output:
-      path("${node_output_path}/follow-up_${subjects_val}_${params.dcc_release}.tsv"), emit: followup_node_file
-      path("${node_output_path}/follow-up_qc_${subjects_val}_${params.dcc_release}.tsv"), emit: followup_qc_file
+      tuple val(subjects_val), val(shard), path("follow-up_${subjects_val}_${params.dcc_release}.tsv"), emit: followup_node_file
+      tuple val(subjects_val), val(shard), path("follow-up_qc_${subjects_val}_${params.dcc_release}.tsv"), emit: followup_qc_file
+      tuple val(subjects_val), val(shard), path("follow-up_${subjects_val}_${params.dcc_release}.manifest.json"), emit: manifest_file
+      tuple val(subjects_val), path("follow-up_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json"), optional: true, emit: metrics_file
+      tuple val(subjects_val), path("follow-up_${subjects_val}_${params.dcc_release}.validation.tsv"), optional: true, emit: validation_report
 
    script:
+   // The staged case node TSV file, given alone or with its sidecar file
+   def case_node_file = (case_node_files instanceof java.nio.file.Path ? [case_node_files] : case_node_files).find { it.name.endsWith('.tsv') }
    """
-   python ${params.ardac_mapper_scripts}/follow_up_node_mapper.py \
+   python -m ardac.follow_up_node_mapper \
        --log_level ${params.python_log_level} \
+       --io_engine ${params.io_engine} \
+       ${params.arrow_strings ? '--arrow_strings' : ''} \
+       ${params.force_mappers ? '--force' : ''} \
+       ${params.validate && !shard ? '--validate' : ''} \
+       ${params.collect_metrics ? "--metrics_file follow-up_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json" : ''} \
        --node_templates_path ${node_templates_path} \
        --subjects_type ${subjects_type} \
        --dcc_liver_scores_file ${dcc_liver_scores_file} \
        --dcc_med_info_file ${dcc_med_info_file} \
        --dcc_vitals_file ${dcc_vitals_file} \
        --dcc_soc_file ${dcc_soc_file} \
-       --node_output_path ${node_output_path}
+       --node_output_path . \
+       --case_node_file ${case_node_file} \
+       ${params.follow_up_out_of_core ? "--out_of_core --chunk_size ${params.follow_up_chunk_size}" : "--workers ${task.cpus}"}
    """
  }
 
@@ -129,31 +143,173 @@ process CASE_NODE_MAPPER {
  * and the ARDaC case node files.
  */
  process AUDIT_NODE_MAPPER {
+   publishDir "${params.output_directory}/${params.ardac_nodes_directory}", mode: 'copy', pattern: "*_${params.dcc_release}.*", enabled: !shard
+
    input:
       // Path to directory containing node template files
       path node_templates_path
-      // Path to the DCC subject file
-      path dcc_audit_file
-      // Path to the output directory
-      path node_output_path
-      // The subjects type
-      val subjects_type
-      // The filename subjects type value
-      val subjects_val
-      // The ARDaC case node file generated by CASE_NODE_MAPPER
-      path case_node_file
+      // The filename subjects type value, the shard of subjects or an empty string, the subjects type, the path
+      // to the DCC audit file, and the ARDaC case node and sidecar files generated by CASE_NODE_MAPPER
+      tuple val(subjects_val), val(shard), val(subjects_type), path(dcc_audit_file), path(case_node_files)
 
    output:
-      path("${node_output_path}/audit_${subjects_val}_${params.dcc_release}.tsv"), emit: audit_node_file
-      path("${node_output_path}/audit_qc_${subjects_val}_${params.dcc_release}.tsv"), emit: audit_qc_file
+      tuple val(subjects_val), val(shard), path("audit_${subjects_val}_${params.dcc_release}.tsv"), emit: audit_node_file
+      tuple val(subjects_val), val(shard), path("audit_qc_${subjects_val}_${params.dcc_release}.tsv"), emit: audit_qc_file
+      tuple val(subjects_val), val(shard), path("audit_${subjects_val}_${params.dcc_release}.manifest.json"), emit: manifest_file
+      tuple val(subjects_val), path("audit_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json"), optional: true, emit: metrics_file
+      tuple val(subjects_val), path("audit_${subjects_val}_${params.dcc_release}.validation.tsv"), optional: true, emit: validation_report
 
    script:
+   // The staged case node TSV file, given alone or with its sidecar file
+   def case_node_file = (case_node_files instanceof java.nio.file.Path ? [case_node_files] : case_node_files).find { it.name.endsWith('.tsv') }
    """
-   python ${params.ardac_mapper_scripts}/audit_node_mapper.py \
+   python -m ardac.audit_node_mapper \
        --log_level ${params.python_log_level} \
+       --io_engine ${params.io_engine} \
+       ${params.arrow_strings ? '--arrow_strings' : ''} \
+       ${params.force_mappers ? '--force' : ''} \
+       ${params.validate && !shard ? '--validate' : ''} \
+       ${params.collect_metrics ? "--metrics_file audit_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json" : ''} \
        --node_templates_path ${node_templates_path} \
        --subjects_type ${subjects_type} \
        --dcc_audit_file ${dcc_audit_file} \
-       --node_output_path ${node_output_path}
+       --node_output_path . \
+       --case_node_file ${case_node_file}
+   """
+ }
+
+ /*
+ * Generate the case, demographic, follow-up, and audit nodes and their quality control
+ * files from observational or clinical trial DCC data in a single Python process.
+ */
+ process ALL_NODES_MAPPER {
+   publishDir "${params.output_directory}/${params.ardac_nodes_directory}", mode: 'copy', pattern: "*_${params.dcc_release}.*", enabled: !shard
+
+   input:
+      // Path to directory containing node template files
+      path node_templates_path
+      // The filename subjects type value, the shard of subjects or an empty string, the subjects type, the paths
+      // to the DCC subject, liver scores, med info, vitals, soc, and audit files, whether to run in delta mode, and
+      // the directories of the previous release DCC files and of the node files and manifest written for it, staged
+      // for delta mode or empty lists otherwise
+      tuple val(subjects_val), val(shard), val(subjects_type), path(dcc_subjects_file), path(dcc_liver_scores_file), path(dcc_med_info_file), path(dcc_vitals_file), path(dcc_soc_file), path(dcc_audit_file), val(delta_mode), path(previous_dcc_directory, stageAs: 'previous_dcc'), path(previous_nodes_directory, stageAs: 'previous_nodes')
+
+   output:
+      tuple val(subjects_val), val(shard), path("case_${subjects_val}_${params.dcc_release}.{tsv,arrow}"), emit: case_node_files
+      tuple val(subjects_val), val(shard), path("demographic_${subjects_val}_${params.dcc_release}.tsv"), emit: demographic_node_file
+      tuple val(subjects_val), val(shard), path("follow-up_${subjects_val}_${params.dcc_release}.tsv"), emit: followup_node_file
+      tuple val(subjects_val), val(shard), path("follow-up_qc_${subjects_val}_${params.dcc_release}.tsv"), emit: followup_qc_file
+      tuple val(subjects_val), val(shard), path("audit_${subjects_val}_${params.dcc_release}.tsv"), emit: audit_node_file
+      tuple val(subjects_val), val(shard), path("audit_qc_${subjects_val}_${params.dcc_release}.tsv"), emit: audit_qc_file
+      tuple val(subjects_val), val(shard), path("all_nodes_${subjects_val}_${params.dcc_release}.manifest.json"), emit: manifest_file
+      tuple val(subjects_val), path("all_nodes_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json"), optional: true, emit: metrics_file
+      tuple val(subjects_val), path("*_${subjects_val}_${params.dcc_release}.validation.tsv"), optional: true, emit: validation_reports
+
+   script:
+   """
+   python -m ardac.all_nodes_mapper \
+       --log_level ${params.python_log_level} \
+       --io_engine ${params.io_engine} \
+       ${params.arrow_strings ? '--arrow_strings' : ''} \
+       ${params.force_mappers ? '--force' : ''} \
+       ${params.validate && !shard ? '--validate' : ''} \
+       ${params.collect_metrics ? "--metrics_file all_nodes_${subjects_val}${shard ? "_${shard}" : ''}.metrics.json" : ''} \
+       --node_templates_path ${node_templates_path} \
+       --subjects_type ${subjects_type} \
+       --dcc_subjects_file ${dcc_subjects_file} \
+       --dcc_liver_scores_file ${dcc_liver_scores_file} \
+       --dcc_med_info_file ${dcc_med_info_file} \
+       --dcc_vitals_file ${dcc_vitals_file} \
+       --dcc_soc_file ${dcc_soc_file} \
+       --dcc_audit_file ${dcc_audit_file} \
+       --node_output_path . \
+       ${delta_mode ? "--previous_dcc_path ${previous_dcc_directory} --previous_nodes_path ${previous_nodes_directory}" : ''}
+   """
+ }
+
+ /*
+ * Split the observational or clinical trial DCC files into shards of subjects, so that the
+ * node mappers run on each shard in a separate task.
+ */
+ process SCATTER_DCC {
+   input:
+      // The filename subjects type value, the subjects type, and the paths to the DCC subject, liver scores,
+      // med info, vitals, soc, and audit files
+      tuple val(subjects_val), val(subjects_type), path(dcc_subjects_file), path(dcc_liver_scores_file), path(dcc_med_info_file), path(dcc_vitals_file), path(dcc_soc_file), path(dcc_audit_file)
+
+   output:
+      // One directory per shard holding the DCC files of its subjects under their original names
+      tuple val(subjects_val), val(subjects_type), path("shard_*", type: 'dir'), emit: shard_directories
+      tuple val(subjects_val), path("scatter_${subjects_val}.metrics.json"), optional: true, emit: metrics_file
+
+   script:
+   """
+   python -m ardac.scatter_dcc \
+       --log_level ${params.python_log_level} \
+       ${params.collect_metrics ? "--metrics_file scatter_${subjects_val}.metrics.json" : ''} \
+       --subjects_type ${subjects_type} \
+       --dcc_subjects_file ${dcc_subjects_file} \
+       --dcc_liver_scores_file ${dcc_liver_scores_file} \
+       --dcc_med_info_file ${dcc_med_info_file} \
+       --dcc_vitals_file ${dcc_vitals_file} \
+       --dcc_soc_file ${dcc_soc_file} \
+       --dcc_audit_file ${dcc_audit_file} \
+       --shards ${params.subject_shards} \
+       --shard_output_path .
+   """
+ }
+
+ /*
+ * Combine the node and quality control files written for the shards of subjects into the
+ * node and quality control files of the subjects type, in the order of a run without shards.
+ */
+ process GATHER_NODES {
+   publishDir "${params.output_directory}/${params.ardac_nodes_directory}", mode: 'copy', pattern: "*_${params.dcc_release}.*"
+
+   input:
+      // The filename subjects type value, the subjects type, the path to the DCC subject file, and the
+      // node and quality control TSV files of every shard, staged in separate directories as they have the same names
+      tuple val(subjects_val), val(subjects_type), path(dcc_subjects_file), path(shard_node_files, stageAs: 'shard*/*')
+
+   output:
+      tuple val(subjects_val), path("*_${subjects_val}_${params.dcc_release}.{tsv,arrow}"), emit: node_files
+      tuple val(subjects_val), path("gather_${subjects_val}.metrics.json"), optional: true, emit: metrics_file
+      tuple val(subjects_val), path("*_${subjects_val}_${params.dcc_release}.validation.tsv"), optional: true, emit: validation_reports
+
+   script:
+   """
+   python -m ardac.gather_nodes \
+       --log_level ${params.python_log_level} \
+       --io_engine ${params.io_engine} \
+       ${params.arrow_strings ? '--arrow_strings' : ''} \
+       ${params.collect_metrics ? "--metrics_file gather_${subjects_val}.metrics.json" : ''} \
+       ${params.validate ? '--validate' : ''} \
+       --subjects_type ${subjects_type} \
+       --dcc_subjects_file ${dcc_subjects_file} \
+       --shard_node_files ${shard_node_files} \
+       --node_output_path .
+   """
+ }
+
+ /*
+ * Combine the stage metrics files written by the mapper processes into one report of the
+ * workflow run, saved next to the node files.
+ */
+ process METRICS_REPORT {
+   publishDir "${params.output_directory}/${params.ardac_nodes_directory}", mode: 'copy', pattern: "*_${params.dcc_release}.*"
+
+   input:
+      // The filename subjects type value and the JSON metrics files written by its mapper processes
+      tuple val(subjects_val), path(metrics_files)
+
+   output:
+      path("mapper_metrics_${subjects_val}_${params.dcc_release}.json"), emit: metrics_report_file
+
+   script:
+   """
+   python -m ardac.metrics_report \
+       --log_level ${params.python_log_level} \
+       --metrics_files ${metrics_files} \
+       --report_file mapper_metrics_${subjects_val}_${params.dcc_release}.json
    """
  }
@@ -0,0 +1,3 @@
+
+
+nextflow run ardac_etl_workflow.nf -config nextflow.config -profile conda,workstation -log-level DEBUG --subjects_type all
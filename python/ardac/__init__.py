@@ -0,0 +1,3 @@
+# The ARDaC node mappers.  The modules are run with python -m ardac.<module> and PYTHONPATH set
+# to the python directory, as the NextFlow workflow does, or through the ardac command defined
+# in ardac.cli.
@@ -0,0 +1,5 @@
+# Run the ardac command with python -m ardac
+import sys
+from .cli import main
+
+sys.exit(main())
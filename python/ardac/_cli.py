@@ -0,0 +1,154 @@
+# Command line handling shared by the mapper scripts and the batch runner.  Only the standard
+# library and the light private modules are imported here, so that the batch runner can answer
+# version queries without importing pandas.
+import sys
+import logging
+import argparse
+from pathlib import Path
+from typing import Callable
+from . import _constants
+from . import _metrics
+
+# Help of the --io_engine argument of the scripts that read DCC files
+io_engine_help = 'The engine used to parse the input files and write the node files, pyarrow parses with multiple threads.  Both engines write the same files'
+
+
+def log_level_names() -> list[str]:
+   """Give the standard log level names accepted by the --log_level arguments."""
+   valid_log_level_names_mapping = logging.getLevelNamesMapping()
+   valid_log_level_names_mapping.pop('NOTSET') # Remove NOTSET option value
+   return list(valid_log_level_names_mapping.keys())
+
+
+def configure_logging(log_level: str) -> None:
+   """Configure the root logger to write to standard output at the given log level."""
+   console_handler = logging.StreamHandler(sys.stdout)
+   console_handler.setLevel(log_level)
+   console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+
+   logging.basicConfig(
+      level = log_level,
+      handlers = [console_handler]
+   )
+
+
+def add_common_arguments(parser: argparse.ArgumentParser, log_level_help: str = 'A standard log level from the Python logger package',
+                         io_engines: list[str] | None = None, io_engine_help: str = io_engine_help, force: bool = False,
+                         validate_help: str | None = None, metrics_stages: str | None = None, node_templates: bool = False,
+                         subjects_type: bool = False) -> None:
+   """
+   This function adds the arguments shared by the mapper scripts to a parser, in the order of
+   their help.  The version queries and --log_level are always added, and the other arguments
+   only when the script takes them.  The choices of --io_engine are passed in, so that this
+   module does not import the I/O module and pandas.
+
+   Parameters
+   ----------
+   parser : argparse.ArgumentParser
+      The command line argument parser of the script
+   log_level_help : str
+      The help of the --log_level argument
+   io_engines : list[str] | None
+      The choices of the --io_engine argument, which is added with --arrow_strings when given
+   io_engine_help : str
+      The help of the --io_engine argument
+   force : bool
+      When true the --force argument is added
+   validate_help : str | None
+      The help of the --validate argument, which is added when given
+   metrics_stages : str | None
+      The stages listed in the help of the --metrics_file argument, which is added with
+      --metrics_summary when given
+   node_templates : bool
+      When true the --node_templates_path argument is added
+   subjects_type : bool
+      When true the --subjects_type argument is added
+   """
+   parser.add_argument('--version', action='version', version=f'DCC_VERSION={_constants.dcc_release_string},MAPPING_VERSION={_constants.mapping_version_string}')
+   parser.add_argument('--dcc_version', action='version', version=f'{_constants.dcc_release_string}')
+   parser.add_argument('--mapping_version', action='version', version=f'{_constants.mapping_version_string}')
+   parser.add_argument('--log_level', dest='logLevel', default='INFO', choices=log_level_names(), help=log_level_help)
+   if io_engines is not None:
+      parser.add_argument('--io_engine', dest='ioEngine', default='pandas', choices=io_engines, help=io_engine_help)
+      parser.add_argument('--arrow_strings', dest='arrowStrings', action='store_true', help='Keep every string column as an Arrow backed string[pyarrow] column from reading the input files to writing the node files, instead of Python str objects, to use less memory.  The node files are the same')
+   if force:
+      parser.add_argument('--force', dest='force', action='store_true', help='Regenerate the node files even when the manifest of a previous run shows that they are up to date')
+   if validate_help is not None:
+      parser.add_argument('--validate', dest='validate', action='store_true', help=validate_help)
+   if metrics_stages is not None:
+      parser.add_argument('--metrics_file', dest='metricsFile', default=None, help=f'Full path to a JSON file where the wall time, CPU time, row counts, and peak memory of the {metrics_stages} stages are saved')
+      parser.add_argument('--metrics_summary', dest='metricsSummary', action='store_true', help='Log a one line summary of the stage metrics when the run ends')
+   if node_templates:
+      parser.add_argument('--node_templates_path', dest='nodeTemplatesPath', required=True, help='Path to the directory where the ARDaC node template TSV files are located')
+   if subjects_type:
+      parser.add_argument('--subjects_type', dest='subjectsType', required=True, choices=['observational', 'clinical'], help='Value indicating if the input subject data is from clinical trial subjects or observational study subjects')
+
+
+def run_main(main: Callable[[argparse.Namespace, logging.Logger], int], command_arguments: argparse.Namespace, logger: logging.Logger,
+             mapper: str, details: dict) -> int:
+   """
+   This function runs the main function of a mapper script with its parsed command line
+   arguments and gives the exit status of the run.  The stage metrics are collected when the
+   script takes the --metrics_file and --metrics_summary arguments and one of them is given,
+   and the errors that end the run are logged rather than raised.
+
+   Parameters
+   ----------
+   main : Callable[[argparse.Namespace, logging.Logger], int]
+      The main function of the mapper script
+   command_arguments : argparse.Namespace
+      The command line arguments processed by argparse
+   logger : logging.Logger
+      The logger to be used to provide user feedback
+   mapper : str
+      The name of the mapper script
+   details : dict
+      Further fields describing the run in the metrics, such as the I/O engine
+
+   Return
+   ------
+   The exit status, 0 when the run completed and 3 when it failed
+   """
+   # Status codes greater than zero and less than three are reserved for command line processing errors
+   status = 3
+   try:
+      metrics_file = getattr(command_arguments, 'metricsFile', None)
+      with _metrics.collect(Path(metrics_file) if metrics_file else None, getattr(command_arguments, 'metricsSummary', False),
+                            mapper, getattr(command_arguments, 'subjectsType', None), details, logger):
+         status = main(command_arguments, logger)
+   except FileNotFoundError as e:
+      logger.critical(f'Input file not found: {e}')
+   except ValueError as e:
+      logger.critical(f'Command line argument or parameter had a bad value: {e}')
+   except Exception as e:
+      logger.critical('Caught an exception', exc_info=True)
+   return status
+
+
+def run_script(parser: argparse.ArgumentParser, run: Callable[[argparse.Namespace, logging.Logger], int], arguments: list[str] | None = None) -> int:
+   """
+   This function runs a script from the command line: it parses the arguments, configures
+   the logging to standard output at the --log_level, and gives the exit status of the run.
+
+   Parameters
+   ----------
+   parser : argparse.ArgumentParser
+      The command line argument parser of the script
+   run : Callable[[argparse.Namespace, logging.Logger], int]
+      The run function of the script, taking the parsed arguments and the logger
+   arguments : list[str] | None
+      The command line arguments, by default those of the process
+
+   Return
+   ------
+   The exit status of the run
+   """
+   parsed_args = parser.parse_args(arguments)
+
+   # Configure and create logger for standard output
+   configure_logging(parsed_args.logLevel)
+
+   logger = logging.getLogger(parser.prog)
+   logger.setLevel(parsed_args.logLevel)
+
+   return run(parsed_args, logger)
@@ -7,6 +7,12 @@ __mapping_version__ = '1.0.0'
 __node_file_extension__ = '.tsv'
 # Node template file extension
 __node_template_file_extension__ = '.tsv'
+# Case node Arrow IPC sidecar file extension
+__case_sidecar_file_extension__ = '.arrow'
+# Mapper run manifest file extension
+__manifest_file_extension__ = '.manifest.json'
+# Node validation report file extension, replacing the node file extension
+__validation_report_file_extension__ = '.validation.tsv'
 
 # Get the current DCC data model release and current ARDaC mapping
 # implementation versions.
@@ -16,6 +22,8 @@ mapping_version_string = f'mapping_v{__mapping_version__}'
 case_template_file_name = 'submission_case_template' + __node_template_file_extension__
 case_obs_file_name = 'case_obs_' + dcc_release_string + __node_file_extension__
 case_rct_file_name = 'case_rct_' + dcc_release_string + __node_file_extension__
+case_obs_sidecar_file_name = 'case_obs_' + dcc_release_string + __case_sidecar_file_extension__
+case_rct_sidecar_file_name = 'case_rct_' + dcc_release_string + __case_sidecar_file_extension__
 # Set the audit node template file name and the output file names
 audit_template_file_name = 'submission_audit_template' + __node_template_file_extension__
 audit_obs_file_name = 'audit_obs_' + dcc_release_string + __node_file_extension__
@@ -32,4 +40,14 @@ follow_up_obs_file_name = 'follow-up_obs_' + dcc_release_string + __node_file_ex
 follow_up_qc_obs_file_name = 'follow-up_qc_obs_' + dcc_release_string + __node_file_extension__
 follow_up_rct_file_name = 'follow-up_rct_' + dcc_release_string + __node_file_extension__
 follow_up_qc_rct_file_name = 'follow-up_qc_rct_' + dcc_release_string + __node_file_extension__
-
+# Set the mapper run manifest file names
+case_obs_manifest_file_name = 'case_obs_' + dcc_release_string + __manifest_file_extension__
+case_rct_manifest_file_name = 'case_rct_' + dcc_release_string + __manifest_file_extension__
+demographic_obs_manifest_file_name = 'demographic_obs_' + dcc_release_string + __manifest_file_extension__
+demographic_rct_manifest_file_name = 'demographic_rct_' + dcc_release_string + __manifest_file_extension__
+follow_up_obs_manifest_file_name = 'follow-up_obs_' + dcc_release_string + __manifest_file_extension__
+follow_up_rct_manifest_file_name = 'follow-up_rct_' + dcc_release_string + __manifest_file_extension__
+audit_obs_manifest_file_name = 'audit_obs_' + dcc_release_string + __manifest_file_extension__
+audit_rct_manifest_file_name = 'audit_rct_' + dcc_release_string + __manifest_file_extension__
+all_nodes_obs_manifest_file_name = 'all_nodes_obs_' + dcc_release_string + __manifest_file_extension__
+all_nodes_rct_manifest_file_name = 'all_nodes_rct_' + dcc_release_string + __manifest_file_extension__
@@ -0,0 +1,212 @@
+# Incremental regeneration of the nodes between DCC releases.  The DCC input rows of each
+# subject in the previous and current releases are reduced to a per-subject content hash, and
+# only the subjects whose hash changed, or which were added or removed, are mapped again.  Their
+# node rows replace those of the previous node files, and the rows of the unchanged subjects are
+# copied from the previous node files as they were written.
+import logging
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from . import _constants
+from . import _manifest
+from . import _node_io
+
+logger = logging.getLogger(__name__)
+
+# Multiplier mixing the position of a row within its subject into the row hash, so that the
+# subject hash changes when the rows of a subject are reordered
+row_position_multiplier = np.uint64(0x9E3779B97F4A7C15)
+
+# The module holding the DCC release name, which changes between releases without changing the mapping
+release_module = "_constants.py"
+
+
+def subject_hashes(df_input: pd.DataFrame) -> pd.Series:
+   """
+   This function reduces the rows of a DCC input to one content hash per subject.  The hash
+   covers the values of every column read from the file and the order of the rows of each
+   subject, because the node mappers keep the first or last row of a subject.  Rows without
+   a subject ID are not hashed.
+
+   Parameters
+   ----------
+   df_input : pd.DataFrame
+      The DCC input data with a "usubjid" column
+
+   Return
+   ------
+   A series of unsigned 64 bit hashes indexed by subject ID
+   """
+   df_rows = df_input[df_input["usubjid"].notna()]
+   row_hashes = pd.util.hash_pandas_object(df_rows.astype(object), index=False).to_numpy()
+   positions = df_rows.groupby("usubjid", sort=False, observed=True).cumcount().to_numpy(dtype=np.uint64)
+   mixed_hashes = pd.util.hash_array(row_hashes ^ (positions * row_position_multiplier))
+   subject_ids = df_rows["usubjid"].astype(object).to_numpy()
+   # The sum of unsigned integers wraps around, which keeps every bit of the hashes
+   return pd.Series(mixed_hashes, index=subject_ids).groupby(level=0, sort=False).sum()
+
+
+def changed_subjects(previous_inputs: dict[str, pd.DataFrame], current_inputs: dict[str, pd.DataFrame]) -> set[str]:
+   """
+   This function compares the DCC inputs of two releases subject by subject and gives the
+   subjects that have different rows in any input, or rows in only one of the releases.
+
+   Parameters
+   ----------
+   previous_inputs : dict[str, pd.DataFrame]
+      The DCC input data of the previous release keyed by description
+   current_inputs : dict[str, pd.DataFrame]
+      The DCC input data of the current release with the same keys
+
+   Return
+   ------
+   The subject IDs of the changed subjects
+   """
+   changed = set()
+   for description, df_current in current_inputs.items():
+      previous_hashes = subject_hashes(previous_inputs[description])
+      current_hashes = subject_hashes(df_current)
+      changed.update(previous_hashes.index.symmetric_difference(current_hashes.index))
+      common = previous_hashes.index.intersection(current_hashes.index)
+      differs = previous_hashes[common].to_numpy() != current_hashes[common].to_numpy()
+      changed.update(common[differs])
+   return changed
+
+
+def subject_rows(df_input: pd.DataFrame, subjects: set[str]) -> pd.DataFrame:
+   """Give the rows of a DCC input that belong to the given subjects."""
+   return df_input[df_input["usubjid"].isin(subjects)]
+
+
+def read_previous_node(node_path: Path, description: str) -> pd.DataFrame:
+   """
+   This function reads a node or QC file written by a previous run with every value as the
+   text that was written, so that copied rows are written again unchanged, see
+   _node_io.read_node_text.
+
+   Parameters
+   ----------
+   node_path : Path
+      The full path to the node or QC file
+   description : str
+      The description of the file used in the log messages
+
+   Return
+   ------
+   A pandas dataframe containing the node data
+   """
+   logger.info(f'Reading previous {description} file: {node_path.as_posix()}')
+   return _node_io.read_node_text(node_path)
+
+
+def node_subject_ids(df_node: pd.DataFrame, key_column: str) -> pd.Series:
+   """Give the subject ID of each row of a node or QC file from its key column."""
+   if df_node.columns.empty:
+      return pd.Series([], dtype=_node_io.string_dtype())
+   if key_column == "usubjid":
+      return df_node[key_column].reset_index(drop=True)
+   return _node_io.case_subject_ids(df_node[key_column]).reset_index(drop=True)
+
+
+def splice_node(df_previous: pd.DataFrame, df_changed: pd.DataFrame, key_column: str, changed: set[str], subject_order: pd.Series) -> pd.DataFrame:
+   """
+   This function replaces the rows of the changed subjects in a previous node or QC file with
+   their newly mapped rows.  The rows are ordered by the position of their subject in the
+   current subjects file, which is the order of a full run, and the rows of each subject keep
+   their order.  Rows of subjects that are no longer in the subjects file are dropped.  A QC
+   file left without rows has no columns, as when it is written by a full run.
+
+   Parameters
+   ----------
+   df_previous : pd.DataFrame
+      The node data of the previous run, read by read_previous_node
+   df_changed : pd.DataFrame
+      The node data mapped for the changed subjects only
+   key_column : str
+      The column holding the subject ID, or the case submitter ID of the subject
+   changed : set[str]
+      The subject IDs of the changed subjects
+   subject_order : pd.Series
+      The position of each subject in the current subjects file indexed by subject ID
+
+   Return
+   ------
+   A pandas dataframe containing the node data of every current subject
+   """
+   columns = df_changed.columns if not df_changed.columns.empty else df_previous.columns
+   previous_ids = node_subject_ids(df_previous, key_column)
+   kept = ~previous_ids.isin(changed).to_numpy()
+   frames = [frame for frame in [df_previous[kept], df_changed] if not frame.columns.empty]
+   if not frames:
+      return pd.DataFrame()
+   df_node = pd.concat(frames, ignore_index=True)[columns]
+
+   subject_ids = pd.concat([previous_ids[kept], node_subject_ids(df_changed, key_column)], ignore_index=True)
+   positions = subject_ids.map(subject_order)
+   df_node = df_node[positions.notna().to_numpy()]
+   positions = positions.dropna()
+   df_node = df_node.iloc[np.argsort(positions.to_numpy(), kind="stable")].reset_index(drop=True)
+   if df_node.empty and key_column == "usubjid":
+      # No rows, so the QC file is written without a header as in a full run
+      return pd.DataFrame()
+   return df_node
+
+
+def previous_run(previous_nodes_path: Path, manifest_file_name: str, manifest: dict, previous_dcc_paths: dict[str, Path]) -> dict | None:
+   """
+   This function finds the manifest of the previous run and checks that its node files can be
+   updated incrementally.  The previous run must have been made from the previous DCC files
+   given now, for the same subjects type by the same mapper code, templates, mapping version,
+   and options, and its node files must be unchanged since.  The DCC release and the module of
+   constants that names it may differ, so the nodes of one release can be updated to the next.
+
+   Parameters
+   ----------
+   previous_nodes_path : Path
+      The directory holding the node files and manifests of previous runs
+   manifest_file_name : str
+      The name of the manifest file of the current run
+   manifest : dict
+      The manifest of the current run built by _manifest.build_manifest
+   previous_dcc_paths : dict[str, Path]
+      The DCC files of the previous release keyed by description
+
+   Return
+   ------
+   The manifest of the previous run, or None with a warning logged when there is no previous
+   run whose node files can be updated
+   """
+   # The manifest of any DCC release whose recorded inputs are the previous DCC files
+   manifest_pattern = manifest_file_name.replace(_constants.dcc_release_string, '*')
+   previous_inputs = _manifest.build_manifest_inputs(previous_dcc_paths)
+   previous_manifests = [previous_manifest for previous_manifest_path in sorted(previous_nodes_path.glob(manifest_pattern))
+                         if (previous_manifest := _manifest.read_manifest(previous_manifest_path)) is not None
+                         and previous_manifest.get("inputs") == previous_inputs]
+   if not previous_manifests:
+      logger.warning(f'Cannot find a manifest {Path(previous_nodes_path, manifest_pattern).as_posix()} of a run with the previous DCC files')
+      return None
+   previous_manifest = previous_manifests[0]
+
+   for field, value in manifest.items():
+      previous_value = previous_manifest.get(field)
+      if field == "code":
+         previous_value = {name: digest for name, digest in (previous_value or {}).items() if name != release_module}
+         value = {name: digest for name, digest in value.items() if name != release_module}
+      if field not in ("inputs", "dcc_release") and previous_value != value:
+         logger.warning(f'The previous run has a different {field.replace("_", " ")}')
+         return None
+   if not _manifest.outputs_unchanged(previous_manifest, previous_nodes_path):
+      logger.warning('The previous node files are missing or were changed after the previous run')
+      return None
+   return previous_manifest
+
+
+def previous_file_name(file_name: str, previous_manifest: dict) -> str:
+   """Give the name of a node file as written for the DCC release of the previous run."""
+   return file_name.replace(_constants.dcc_release_string, previous_manifest["dcc_release"])
+
+
+def unique_subjects(df_subjects: pd.DataFrame) -> bool:
+   """Tell whether every subject row has a subject ID that appears only once."""
+   subject_ids = df_subjects["usubjid"]
+   return not (subject_ids.isna().any() or subject_ids.duplicated().any())
@@ -0,0 +1,126 @@
+# External sort of tabular data that may not fit in memory.  Each chunk of rows is sorted by a
+# key column and written to a temporary run file, and the run files are then streamed through
+# a k-way merge.  Rows with the same key keep their input order, which is recorded in the
+# row_column of every run file.
+import heapq
+import itertools
+import operator
+from pathlib import Path
+from typing import Iterable, Iterator
+import pandas as pd
+
+# The input position of each row, used to keep rows with the same key in input order
+row_column = "_row"
+
+
+def write_sorted_runs(chunks: Iterable[pd.DataFrame], key_column: str, run_directory: Path, run_name: str) -> list[Path]:
+   """
+   This function sorts each chunk of rows by the key column and writes it to a CSV run file.
+
+   Parameters
+   ----------
+   chunks : Iterable[pd.DataFrame]
+      The rows to be sorted in input order, every chunk with the same columns.  Values are
+      strings or empty, and empty strings are not expected because pandas reads them as empty.
+   key_column : str
+      The name of the column to sort by, which must not have empty values
+   run_directory : Path
+      The directory where the run files are written
+   run_name : str
+      The prefix of the run file names
+
+   Return
+   ------
+   The paths of the run files, one per chunk
+   """
+   run_paths = []
+   first_row = 0
+   for run_number, df_chunk in enumerate(chunks):
+      df_run = df_chunk.assign(**{row_column: range(first_row, first_row + len(df_chunk))})
+      first_row += len(df_chunk)
+      run_path = Path(run_directory, f'{run_name}_{run_number}.csv')
+      df_run.sort_values([key_column, row_column]).to_csv(run_path.as_posix(), index=False)
+      run_paths.append(run_path)
+   return run_paths
+
+
+def read_run(run_path: Path, chunk_size: int) -> Iterator[tuple]:
+   """
+   This function streams the rows of a run file as tuples, reading chunk_size rows at a time.
+   Empty fields are read back as empty values and every other field as a string, except for
+   the row position which is read as an integer.
+
+   Parameters
+   ----------
+   run_path : Path
+      The full path to the run file
+   chunk_size : int
+      The maximum number of rows read at a time
+
+   Return
+   ------
+   An iterator over the rows of the run file in the run file column order
+   """
+   with pd.read_csv(run_path.as_posix(), dtype=str, keep_default_na=False, na_values=[""], chunksize=chunk_size) as reader:
+      for df_chunk in reader:
+         df_chunk[row_column] = df_chunk[row_column].astype(int)
+         yield from df_chunk.itertuples(index=False, name=None)
+
+
+def merge_sorted_runs(run_paths: list[Path], key_column: str, chunk_size: int) -> tuple[list[str], Iterator[tuple]]:
+   """
+   This function merges run files written by write_sorted_runs into a single stream of rows
+   sorted by the key column and then by input position.  The chunk size is shared between the
+   run files, so about chunk_size rows are held in memory regardless of the number of runs.
+
+   Parameters
+   ----------
+   run_paths : list[Path]
+      The paths of the run files, which must have the same columns
+   key_column : str
+      The name of the column the runs are sorted by
+   chunk_size : int
+      The approximate number of rows held in memory
+
+   Return
+   ------
+   columns : list[str]
+      The column names of the merged rows, including row_column
+   rows : Iterator[tuple]
+      The merged rows
+   """
+   columns = pd.read_csv(run_paths[0].as_posix(), nrows=0).columns.tolist()
+   sort_key = operator.itemgetter(columns.index(key_column), columns.index(row_column))
+   run_chunk_size = max(1, chunk_size // len(run_paths))
+   rows = heapq.merge(*(read_run(run_path, run_chunk_size) for run_path in run_paths), key=sort_key)
+   return columns, rows
+
+
+class KeyedGroups:
+   """
+   Consumes a stream of rows sorted by key one group of equal keys at a time, so the rows of
+   several sorted streams can be matched to the same sorted keys.
+
+   Attributes
+   ----------
+   groups : Iterator[tuple[str, Iterator[tuple]]]
+      The remaining groups of rows with equal keys
+   head : tuple[str, Iterator[tuple]] | None
+      The next group, or None when the stream is exhausted
+   """
+   def __init__(self, rows: Iterator[tuple], key_index: int):
+      self.groups = itertools.groupby(rows, key=operator.itemgetter(key_index))
+      self.head = next(self.groups, None)
+
+   def take_through(self, last_key: str, keys: set[str]) -> list[tuple]:
+      """
+      Consume the groups with keys up to and including last_key, keeping the rows whose key
+      is in keys and discarding the others.
+      """
+      rows = []
+      while self.head is not None and self.head[0] <= last_key:
+         key, group = self.head
+         if key in keys:
+            rows.extend(group)
+         self.head = next(self.groups, None)
+      return rows
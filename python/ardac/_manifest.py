@@ -0,0 +1,170 @@
+# Content-hash manifests of mapper runs.  A mapper writes a manifest next to its node files
+# recording content hashes of everything that determines its output: the mapper code, the
+# input files, the node templates, the mapping version, and the options that change the
+# output.  The hashes of the node files are recorded too, so a later run can tell that the
+# node files are still the ones it would generate and skip the work.
+import json
+import hashlib
+import logging
+from pathlib import Path
+from . import _constants
+
+logger = logging.getLogger(__name__)
+
+# Bytes read at a time when hashing a file
+hash_block_size = 1 << 20
+
+
+def file_digest(file_path: Path) -> str:
+   """
+   This function computes the SHA-256 content hash of a file, reading it a block at a time.
+
+   Parameters
+   ----------
+   file_path : Path
+      The full path to the file
+
+   Return
+   ------
+   The hexadecimal SHA-256 digest of the file content
+   """
+   digest = hashlib.sha256()
+   with open(file_path.as_posix(), 'rb') as hashed_file:
+      for block in iter(lambda: hashed_file.read(hash_block_size), b''):
+         digest.update(block)
+   return digest.hexdigest()
+
+
+def build_manifest(mapper_path: Path, subjects_type: str, input_paths: dict[str, Path], template_paths: dict[str, Path], options: dict[str, str | int | bool | None]) -> dict:
+   """
+   This function describes a mapper run by the content hashes of what determines its output.
+   The mapper code is the mapper script and the private modules next to it, so editing any of
+   them changes the manifest.
+
+   Parameters
+   ----------
+   mapper_path : Path
+      The full path to the mapper script
+   subjects_type : str
+      The subjects type, observational or clinical
+   input_paths : dict[str, Path]
+      The DCC and node input files keyed by a description of their role
+   template_paths : dict[str, Path]
+      The node template files keyed by node name
+   options : dict[str, str | int | bool | None]
+      The command line options that change the content or order of the output
+
+   Return
+   ------
+   The manifest of the run, without the node file hashes
+   """
+   code_paths = [mapper_path] + sorted(mapper_path.parent.glob('_*.py'))
+   return {
+      "mapper": mapper_path.name,
+      "subjects_type": subjects_type,
+      "dcc_release": _constants.dcc_release_string,
+      "mapping_version": _constants.mapping_version_string,
+      "code": {code_path.name: file_digest(code_path) for code_path in code_paths},
+      "inputs": build_manifest_inputs(input_paths),
+      "templates": {node_name: file_digest(template_path) for node_name, template_path in template_paths.items()},
+      "options": options,
+   }
+
+
+def build_manifest_inputs(input_paths: dict[str, Path]) -> dict[str, str]:
+   """Give the content hashes of the input files of a run keyed by the role of each file."""
+   return {role: file_digest(input_path) for role, input_path in input_paths.items()}
+
+
+def read_manifest(manifest_path: Path) -> dict | None:
+   """
+   This function reads the manifest of a previous run.
+
+   Parameters
+   ----------
+   manifest_path : Path
+      The full path to the manifest file
+
+   Return
+   ------
+   The manifest, or None when the file is missing or unreadable
+   """
+   if not manifest_path.is_file():
+      return None
+   try:
+      return json.loads(manifest_path.read_text())
+   except (OSError, ValueError):
+      logger.warning(f'Ignoring unreadable manifest file: {manifest_path.as_posix()}')
+      return None
+
+
+def outputs_unchanged(previous_manifest: dict, output_directory: Path) -> bool:
+   """
+   This function checks that every node file recorded in the manifest of a previous run is
+   still present with the same content.
+
+   Parameters
+   ----------
+   previous_manifest : dict
+      The manifest of the previous run, read by read_manifest
+   output_directory : Path
+      The directory holding the node files
+
+   Return
+   ------
+   True when the manifest records node files and none of them changed
+   """
+   previous_outputs = previous_manifest.get("outputs")
+   if not previous_outputs:
+      return False
+   for file_name, digest in previous_outputs.items():
+      output_path = Path(output_directory, file_name)
+      if not output_path.is_file() or file_digest(output_path) != digest:
+         return False
+   return True
+
+
+def is_cached(manifest_path: Path, manifest: dict, output_directory: Path) -> bool:
+   """
+   This function checks whether the node files of a previous run can be reused, which is when
+   the previous run's manifest describes the same run and every node file it recorded is still
+   present with the same content.
+
+   Parameters
+   ----------
+   manifest_path : Path
+      The full path to the manifest file of the previous run
+   manifest : dict
+      The manifest of the current run built by build_manifest
+   output_directory : Path
+      The directory holding the node files
+
+   Return
+   ------
+   True when the node files are up to date
+   """
+   previous_manifest = read_manifest(manifest_path)
+   if previous_manifest is None:
+      return False
+   previous_run = {field: value for field, value in previous_manifest.items() if field != "outputs"}
+   return previous_run == manifest and outputs_unchanged(previous_manifest, output_directory)
+
+
+def write_manifest(manifest_path: Path, manifest: dict, output_paths: list[Path]) -> None:
+   """
+   This function records the manifest of a run together with the content hashes of the node
+   files it wrote.  Node files that were not written, such as an optional sidecar file, are
+   left out.
+
+   Parameters
+   ----------
+   manifest_path : Path
+      The full path to the manifest file, next to the node files
+   manifest : dict
+      The manifest of the run built by build_manifest
+   output_paths : list[Path]
+      The full paths to the node and QC files written by the run
+   """
+   outputs = {output_path.name: file_digest(output_path) for output_path in output_paths if output_path.is_file()}
+   manifest_path.write_text(json.dumps(dict(manifest, outputs=outputs), indent=3) + '\n')
+   logger.info(f'Manifest saved as: {manifest_path.as_posix()}')
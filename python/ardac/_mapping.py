@@ -0,0 +1,194 @@
+from typing import Callable, NamedTuple
+import pandas as pd
+from . import _metrics
+from . import _node_io
+
+
+class FieldMapping(NamedTuple):
+   """
+   One row of a declarative DCC to ARDaC node mapping.  A field is either given a constant
+   value or is derived from one or more source columns.  Source values are copied unchanged
+   when no transform is given, otherwise the transform is called with one pandas Series per
+   source column and must return the whole target column.  The source columns of a required
+   field must be in the source data, those of an optional field may be missing and are then
+   mapped as empty.
+
+   Attributes
+   ----------
+   target : str
+      The ARDaC node field name
+   source : str | tuple[str, ...] | None
+      The source column name, or the source column names passed to the transform
+   transform : Callable[..., pd.Series] | None
+      A vectorized function producing the target column from the source columns
+   constant : str | None
+      The value assigned to every row of the target column
+   optional : bool
+      When true the source columns may be missing from the source data
+   """
+   target: str
+   source: str | tuple[str, ...] | None = None
+   transform: Callable[..., pd.Series] | None = None
+   constant: str | None = None
+   optional: bool = False
+
+
+class MappingPlan(NamedTuple):
+   """
+   A node mapping compiled into bulk column operations by compile_mapping.
+
+   Attributes
+   ----------
+   targets : list[str]
+      The ARDaC node field names in mapping order
+   source_columns : list[str]
+      Every source column read by the mapping
+   optional_columns : list[str]
+      The source columns read only by optional fields, which may be missing from the source data
+   constants : dict[str, str]
+      The constant values keyed by target field name
+   copies : list[tuple[str, str]]
+      The (source column, target field) pairs copied unchanged
+   derivations : list[tuple[str, tuple[str, ...], Callable[..., pd.Series]]]
+      The (target field, source columns, transform) of each transformed field
+   """
+   targets: list[str]
+   source_columns: list[str]
+   optional_columns: list[str]
+   constants: dict[str, str]
+   copies: list[tuple[str, str]]
+   derivations: list[tuple[str, tuple[str, ...], Callable[..., pd.Series]]]
+
+
+def compile_mapping(field_mappings: list[FieldMapping]) -> MappingPlan:
+   """
+   This function checks a declarative node mapping and groups its fields into constant,
+   copied, and transformed columns so the mapping can be executed column by column.
+
+   Parameters
+   ----------
+   field_mappings : list[FieldMapping]
+      The node mapping
+
+   Return
+   ------
+   The compiled mapping plan
+   """
+   targets = []
+   source_columns = []
+   required_columns = set()
+   constants = {}
+   copies = []
+   derivations = []
+   for field in field_mappings:
+      if field.target in targets:
+         raise ValueError(f'Field {field.target} is mapped more than once')
+      if (field.source is None) == (field.constant is None):
+         raise ValueError(f'Field {field.target} must have either a source or a constant')
+      if field.constant is not None and field.transform is not None:
+         raise ValueError(f'Field {field.target} cannot transform a constant')
+      if field.constant is not None and field.optional:
+         raise ValueError(f'Field {field.target} cannot be an optional constant')
+      targets.append(field.target)
+
+      if field.constant is not None:
+         constants[field.target] = field.constant
+         continue
+
+      sources = (field.source,) if isinstance(field.source, str) else tuple(field.source)
+      source_columns.extend(column for column in sources if column not in source_columns)
+      if not field.optional:
+         required_columns.update(sources)
+      if field.transform is None:
+         if len(sources) != 1:
+            raise ValueError(f'Field {field.target} needs a transform to combine {len(sources)} source columns')
+         copies.append((sources[0], field.target))
+      else:
+         derivations.append((field.target, sources, field.transform))
+
+   optional_columns = [column for column in source_columns if column not in required_columns]
+   return MappingPlan(targets, source_columns, optional_columns, constants, copies, derivations)
+
+
+def apply_mapping_plan(plan: MappingPlan, df_input: pd.DataFrame, include_constants: bool = True) -> pd.DataFrame:
+   """
+   This function executes a compiled mapping plan against the source data.  Source columns
+   missing from the source data, such as the optional columns left out of a DCC file, are
+   treated as empty.
+
+   Parameters
+   ----------
+   plan : MappingPlan
+      The compiled node mapping
+   df_input : pd.DataFrame
+      The source data
+   include_constants : bool
+      When false the constant fields are left out
+
+   Return
+   ------
+   A pandas dataframe with the mapped fields in mapping order and the index of df_input
+   """
+   df_source = df_input.reindex(columns=plan.source_columns)
+   missing_columns = [column for column in plan.source_columns if column not in df_input.columns]
+   df_source[missing_columns] = df_source[missing_columns].astype(_node_io.string_dtype())
+
+   columns = dict(plan.constants) if include_constants else {}
+   for source, target in plan.copies:
+      columns[target] = df_source[source]
+   for target, sources, transform in plan.derivations:
+      columns[target] = transform(*(df_source[source] for source in sources))
+
+   return pd.DataFrame({target: columns[target] for target in plan.targets if target in columns}, index=df_input.index)
+
+
+def build_node(plan: MappingPlan, df_input: pd.DataFrame, template_headers: list[str]) -> _node_io.NodeFrame:
+   """
+   This function executes a compiled mapping plan and lays the result out in the node
+   template column order.  Template fields that are not mapped are left empty, and mapped
+   fields that are not in the template are appended after the template fields.  Only the
+   fields mapped from source columns are stored in the dataframe.  The constant and empty
+   fields are declared as virtual columns, expanded by _node_io.write_tsv when the node is
+   written, see _node_io.NodeFrame.  The mapped fields are object columns, or
+   string[pyarrow] columns with Arrow backed strings, see _node_io.set_arrow_strings.
+
+   Parameters
+   ----------
+   plan : MappingPlan
+      The compiled node mapping
+   df_input : pd.DataFrame
+      The source data, one row per node row
+   template_headers : list[str]
+      The header names extracted from the node template
+
+   Return
+   ------
+   The mapped node data with its virtual columns
+   """
+   with _metrics.stage('transform', rows_in=len(df_input)) as stage:
+      df_mapped = apply_mapping_plan(plan, df_input, include_constants=False)
+      output_columns = template_headers + [target for target in plan.targets if target not in template_headers]
+      df_output = df_mapped[[column for column in output_columns if column in df_mapped.columns]].astype(_node_io.string_dtype())
+      virtual_columns = _node_io.VirtualColumns(output_columns, dict(plan.constants), [column for column in output_columns if column not in plan.targets])
+      stage.rows_out = len(df_output)
+   return _node_io.NodeFrame(df_output, virtual_columns)
+
+
+def strip(values: pd.Series) -> pd.Series:
+   """Remove leading and trailing whitespace."""
+   return values.str.strip()
+
+
+def append(suffix: str) -> Callable[[pd.Series], pd.Series]:
+   """Return a transform that appends the given suffix to each value."""
+   def append_suffix(values: pd.Series) -> pd.Series:
+      return values + suffix
+   return append_suffix
+
+
+def lookup(mapping: dict[str, str], default: str | None = None) -> Callable[[pd.Series], pd.Series]:
+   """Return a transform that replaces each value using the mapping, values not in the mapping become the default."""
+   def lookup_values(values: pd.Series) -> pd.Series:
+      mapped = values.map(mapping)
+      return mapped if default is None else mapped.fillna(default)
+   return lookup_values
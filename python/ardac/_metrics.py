@@ -0,0 +1,390 @@
+# Per-stage run metrics of the node mappers.  While a mapper run is collected, the read,
+# template-load, transform, QC, validate, and write stages record their wall time, CPU time of the
+# process and of its finished worker processes, row counts, and how much they grew the resident
+# set size and its high-water mark.  A stage entered inside another stage is subtracted from the
+# outer stage, so the stage measurements add up to those of the instrumented run.  Nothing is
+# recorded when no run is collected.
+import sys
+import json
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+from . import _constants
+
+try:
+   import resource
+except ImportError:  # Not available on Windows
+   resource = None
+
+# The instrumented stages in report order
+stage_names = ["read", "template-load", "transform", "QC", "validate", "write"]
+
+# The run being collected, or None
+active_run = None
+
+
+def peak_rss_bytes(who: int | None = None) -> int | None:
+   """
+   Give the peak resident set size of the process in bytes, or of its largest finished child
+   process with resource.RUSAGE_CHILDREN, or None when it is not available.
+   """
+   if resource is None:
+      return None
+   peak_rss = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+   # Linux reports kilobytes and macOS bytes
+   return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def current_rss_bytes() -> int | None:
+   """Give the current resident set size of the process in bytes, or None when it is not available."""
+   try:
+      with open('/proc/self/statm') as statm:
+         return int(statm.read().split()[1]) * resource.getpagesize()
+   except (OSError, ValueError, IndexError, AttributeError):
+      return None
+
+
+def children_cpu_seconds() -> float:
+   """Give the CPU time of the finished child processes, such as the --workers processes, or 0 when it is not available."""
+   if resource is None:
+      return 0.0
+   usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+   return usage.ru_utime + usage.ru_stime
+
+
+class Usage(NamedTuple):
+   """
+   The resource use of the process at one time, or between two times.
+
+   Attributes
+   ----------
+   wall_seconds : float
+      The wall time
+   cpu_seconds : float
+      The CPU time of the process
+   children_cpu_seconds : float
+      The CPU time of the finished child processes
+   peak_rss_bytes : int
+      The peak resident set size of the process, 0 when it is not available
+   rss_bytes : int
+      The resident set size of the process, 0 when it is not available
+   """
+   wall_seconds: float
+   cpu_seconds: float
+   children_cpu_seconds: float
+   peak_rss_bytes: int
+   rss_bytes: int
+
+   def minus(self, other: 'Usage') -> 'Usage':
+      """Give the difference of two usages."""
+      return Usage(*(value - other_value for value, other_value in zip(self, other)))
+
+   def plus(self, other: 'Usage') -> 'Usage':
+      """Give the sum of two usages."""
+      return Usage(*(value + other_value for value, other_value in zip(self, other)))
+
+
+def current_usage() -> Usage:
+   """Give the resource use of the process now."""
+   return Usage(time.perf_counter(), time.process_time(), children_cpu_seconds(), peak_rss_bytes() or 0, current_rss_bytes() or 0)
+
+
+# Whether the memory of the process can be measured on this platform
+peak_rss_available = peak_rss_bytes() is not None
+rss_available = current_rss_bytes() is not None
+
+# No resource use
+no_usage = Usage(0.0, 0.0, 0.0, 0, 0)
+
+
+class StageRows:
+   """
+   The row counts of one pass through a stage, set by the instrumented code.
+
+   Attributes
+   ----------
+   rows_in : int
+      The number of rows going into the stage
+   rows_out : int
+      The number of rows coming out of the stage
+   """
+   def __init__(self, rows_in: int = 0):
+      self.rows_in = rows_in
+      self.rows_out = 0
+
+
+class StageMetrics:
+   """
+   The metrics of a stage accumulated over every pass through it.
+
+   Attributes
+   ----------
+   calls : int
+      The number of passes through the stage
+   wall_seconds : float
+      The wall time spent in the stage, excluding the stages entered within it
+   cpu_seconds : float
+      The CPU time of the process spent in the stage, excluding the stages entered within it
+   children_cpu_seconds : float
+      The CPU time of the child processes that finished in the stage, such as the --workers
+      processes, excluding the stages entered within it
+   rows_in : int
+      The number of rows going into the stage
+   rows_out : int
+      The number of rows coming out of the stage
+   peak_rss_growth_bytes : int
+      How much the stage raised the peak resident set size of the process, excluding the stages
+      entered within it.  A stage that stays below the peak reached before it adds nothing
+   rss_growth_bytes : int
+      The resident set size of the process left after the stage less that before it, excluding
+      the stages entered within it
+   """
+   def __init__(self):
+      self.calls = 0
+      self.usage = no_usage
+      self.rows_in = 0
+      self.rows_out = 0
+
+   def as_dict(self) -> dict:
+      """Give the metrics as a JSON serializable dictionary."""
+      return {
+         "calls": self.calls,
+         "wall_seconds": round(self.usage.wall_seconds, 6),
+         "cpu_seconds": round(self.usage.cpu_seconds, 6),
+         "children_cpu_seconds": round(self.usage.children_cpu_seconds, 6),
+         "rows_in": self.rows_in,
+         "rows_out": self.rows_out,
+         "peak_rss_growth_bytes": self.usage.peak_rss_bytes if peak_rss_available else None,
+         "rss_growth_bytes": self.usage.rss_bytes if rss_available else None,
+      }
+
+
+class RunMetrics:
+   """
+   The metrics of one mapper run.
+
+   Attributes
+   ----------
+   mapper : str
+      The name of the mapper script
+   subjects_type : str
+      The subjects type, observational or clinical
+   details : dict
+      Further fields describing the run, such as the I/O engine
+   stages : dict[str, StageMetrics]
+      The metrics of each stage entered during the run
+   open_stages : list[list]
+      The name and the usage of the inner stages of each stage being timed
+   cached : bool
+      True when the node files were up to date and the run did nothing
+   """
+   def __init__(self, mapper: str, subjects_type: str, details: dict):
+      self.mapper = mapper
+      self.subjects_type = subjects_type
+      self.details = details
+      self.stages = {}
+      self.open_stages = []
+      self.cached = False
+      self.started = datetime.now(timezone.utc)
+      self.start_usage = current_usage()
+
+   def report(self, status: str) -> dict:
+      """Give the metrics of the run as a JSON serializable dictionary."""
+      usage = current_usage().minus(self.start_usage)
+      ordered_names = [name for name in stage_names if name in self.stages] + [name for name in self.stages if name not in stage_names]
+      stages = {name: self.stages[name].as_dict() for name in ordered_names}
+      return dict({
+         "mapper": self.mapper,
+         "subjects_type": self.subjects_type,
+         "dcc_release": _constants.dcc_release_string,
+         "mapping_version": _constants.mapping_version_string,
+      }, **self.details, **{
+         "status": status,
+         "cached": self.cached,
+         "started": self.started.isoformat(timespec='seconds'),
+         "wall_seconds": round(usage.wall_seconds, 6),
+         "cpu_seconds": round(usage.cpu_seconds, 6),
+         "children_cpu_seconds": round(usage.children_cpu_seconds, 6),
+         "process_peak_rss_bytes": peak_rss_bytes(),
+         "children_peak_rss_bytes": peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource is not None else None,
+         "stages": stages,
+         "unstaged_wall_seconds": round(usage.wall_seconds - sum(stage.usage.wall_seconds for stage in self.stages.values()), 6),
+      })
+
+
+@contextmanager
+def stage(name: str, rows_in: int = 0) -> Iterator[StageRows]:
+   """
+   This function times a stage of the collected run, for use in a with statement.  The row
+   counts are set on the yielded StageRows.  A stage entered inside a stage of the same name
+   is part of it and is not counted separately.
+
+   Parameters
+   ----------
+   name : str
+      The stage name, one of stage_names
+   rows_in : int
+      The number of rows going into the stage
+   """
+   run = active_run
+   rows = StageRows(rows_in)
+   if run is None or any(open_stage[0] == name for open_stage in run.open_stages):
+      yield rows
+      return
+
+   open_stage = [name, no_usage]
+   run.open_stages.append(open_stage)
+   start_usage = current_usage()
+   try:
+      yield rows
+   finally:
+      usage = current_usage().minus(start_usage)
+      run.open_stages.pop()
+      if run.open_stages:
+         run.open_stages[-1][1] = run.open_stages[-1][1].plus(usage)
+      stage_metrics = run.stages.setdefault(name, StageMetrics())
+      stage_metrics.calls += 1
+      stage_metrics.usage = stage_metrics.usage.plus(usage.minus(open_stage[1]))
+      stage_metrics.rows_in += rows.rows_in
+      stage_metrics.rows_out += rows.rows_out
+
+
+def timed_chunks(name: str, chunks: Iterable) -> Iterator:
+   """
+   This function times the production of each chunk of an iterable of dataframes as a pass
+   through a stage, so that only the reading of a chunk is timed and not the work done with
+   it.  The rows of each chunk are counted as rows out of the stage.
+
+   Parameters
+   ----------
+   name : str
+      The stage name, one of stage_names
+   chunks : Iterable
+      The chunks, each with a length
+
+   Return
+   ------
+   An iterator over the chunks
+   """
+   chunk_iterator = iter(chunks)
+   while True:
+      with stage(name) as rows:
+         chunk = next(chunk_iterator, None)
+         if chunk is not None:
+            rows.rows_out = len(chunk)
+      if chunk is None:
+         return
+      yield chunk
+
+
+def record_cached() -> None:
+   """Record that the node files of the collected run were up to date."""
+   if active_run is not None:
+      active_run.cached = True
+
+
+def summary(report: dict) -> str:
+   """Give a one line summary of a run report."""
+   stage_summaries = [f'{name} {stage_metrics["wall_seconds"]:.2f} s ({stage_metrics["rows_out"] or stage_metrics["rows_in"]} rows)'
+                      for name, stage_metrics in report["stages"].items()]
+   peak_rss = f'{report["process_peak_rss_bytes"] / 2**20:.0f} MiB' if report["process_peak_rss_bytes"] is not None else 'not available'
+   children_cpu = f' (+{report["children_cpu_seconds"]:.2f} s in workers)' if report["children_cpu_seconds"] else ''
+   return (f'metrics: {report["mapper"]} {report["subjects_type"]} {report["status"]}{" (cached)" if report["cached"] else ""} '
+           f'in {report["wall_seconds"]:.2f} s wall, {report["cpu_seconds"]:.2f} s CPU{children_cpu}, process peak RSS {peak_rss}'
+           + (': ' + ', '.join(stage_summaries) if stage_summaries else ''))
+
+
+def combine_reports(reports: list[dict]) -> dict:
+   """
+   This function combines the metrics reports of the mapper runs of a workflow into one
+   report, with the runs ordered by mapper and subjects type and the totals of every stage.
+
+   Parameters
+   ----------
+   reports : list[dict]
+      The reports written by the mapper runs
+
+   Return
+   ------
+   The combined report as a JSON serializable dictionary
+   """
+   runs = sorted(reports, key=lambda report: (report["mapper"], report["subjects_type"]))
+   stage_totals = {}
+   for report in runs:
+      for name, stage_metrics in report["stages"].items():
+         totals = stage_totals.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "children_cpu_seconds": 0.0, "rows_in": 0, "rows_out": 0,
+                                                 "peak_rss_growth_bytes": None, "rss_growth_bytes": None})
+         for field in ["calls", "wall_seconds", "cpu_seconds", "children_cpu_seconds", "rows_in", "rows_out"]:
+            totals[field] += stage_metrics[field]
+         # The runs are separate processes, so the largest memory growth of a stage is kept rather than a sum
+         for field in ["peak_rss_growth_bytes", "rss_growth_bytes"]:
+            if stage_metrics[field] is not None:
+               totals[field] = stage_metrics[field] if totals[field] is None else max(totals[field], stage_metrics[field])
+   ordered_names = [name for name in stage_names if name in stage_totals] + [name for name in stage_totals if name not in stage_names]
+   peak_rss_values = [report["process_peak_rss_bytes"] for report in runs if report["process_peak_rss_bytes"] is not None]
+   children_peak_rss_values = [report["children_peak_rss_bytes"] for report in runs if report["children_peak_rss_bytes"] is not None]
+   return {
+      "dcc_release": _constants.dcc_release_string,
+      "mapping_version": _constants.mapping_version_string,
+      "created": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+      "runs": runs,
+      "totals": {
+         "runs": len(runs),
+         "failed": sum(report["status"] != "completed" for report in runs),
+         "cached": sum(report["cached"] for report in runs),
+         "wall_seconds": round(sum(report["wall_seconds"] for report in runs), 6),
+         "cpu_seconds": round(sum(report["cpu_seconds"] for report in runs), 6),
+         "children_cpu_seconds": round(sum(report["children_cpu_seconds"] for report in runs), 6),
+         "process_peak_rss_bytes": max(peak_rss_values) if peak_rss_values else None,
+         "children_peak_rss_bytes": max(children_peak_rss_values) if children_peak_rss_values else None,
+         "stages": {name: dict(stage_totals[name], **{field: round(stage_totals[name][field], 6) for field in ["wall_seconds", "cpu_seconds", "children_cpu_seconds"]})
+                    for name in ordered_names},
+      },
+   }
+
+
+@contextmanager
+def collect(metrics_path: Path | None, log_summary: bool, mapper: str, subjects_type: str, details: dict, run_logger: logging.Logger) -> Iterator[RunMetrics | None]:
+   """
+   This function collects the metrics of a mapper run, for use in a with statement around the
+   mapper main function.  When the run ends, also by an exception, the metrics are written to
+   the metrics file as JSON and a one line summary is logged, when requested.  Nothing is
+   collected when neither is requested.
+
+   Parameters
+   ----------
+   metrics_path : Path | None
+      The full path to the JSON metrics file, or None
+   log_summary : bool
+      When true a one line summary of the metrics is logged
+   mapper : str
+      The name of the mapper script
+   subjects_type : str
+      The subjects type, observational or clinical
+   details : dict
+      Further fields describing the run, such as the I/O engine
+   run_logger : logging.Logger
+      The logger of the mapper
+   """
+   global active_run
+   if metrics_path is None and not log_summary:
+      yield None
+      return
+
+   run = RunMetrics(mapper, subjects_type, details)
+   active_run = run
+   status = "failed"
+   try:
+      yield run
+      status = "completed"
+   finally:
+      active_run = None
+      report = run.report(status)
+      if metrics_path is not None:
+         metrics_path.write_text(json.dumps(report, indent=3) + '\n')
+         run_logger.info(f'Metrics saved as: {metrics_path.as_posix()}')
+      if log_summary:
+         run_logger.info(summary(report))
@@ -0,0 +1,719 @@
+import logging
+import importlib.util
+from typing import Collection, Iterator, NamedTuple
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from . import _constants
+from . import _manifest
+from . import _metrics
+
+logger = logging.getLogger(__name__)
+
+# Low-cardinality DCC columns loaded as categoricals
+categorical_columns = {"redcap_event_name", "site", "obs_arm"}
+
+# The engines available to parse and write CSV and TSV files
+io_engines = ["pandas", "pyarrow"]
+
+# The engine used by the read and write functions, see set_io_engine
+io_engine = "pandas"
+
+# When true, string columns are Arrow backed from the read to the write of the nodes, see set_arrow_strings
+arrow_strings = False
+
+# The pandas read_csv default missing value strings, so the pyarrow engine reads the same values
+pandas_na_values = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+
+# The columns of the case node Arrow IPC sidecar file
+case_sidecar_columns = ["*submitter_id", "usubjid"]
+
+# The schema metadata keys of the sidecar file holding the size and SHA-256 digest of the case node TSV file it was written for
+case_sidecar_size_key = b"case_node_size"
+case_sidecar_digest_key = b"case_node_sha256"
+
+# Characters that make the pandas TSV writer quote a value
+tsv_quoted_characters = '[\t"\n\r]'
+
+# The number of rows expanded to the full node width at a time when the node is written with pandas
+expanded_chunk_rows = 50000
+
+
+class VirtualColumns(NamedTuple):
+   """
+   The columns of a node that are not stored in its dataframe.  A node dataframe holds only
+   the columns mapped from source data, and the constant and all-null columns are expanded
+   when the node is written, so they take no memory per row.
+
+   Attributes
+   ----------
+   columns : list[str]
+      Every column of the node in output order
+   constants : dict[str, str]
+      The value of each constant column keyed by column name
+   empty : list[str]
+      The columns that are empty on every row unless the dataframe holds them
+   """
+   columns: list[str]
+   constants: dict[str, str]
+   empty: list[str]
+
+
+class NodeFrame(NamedTuple):
+   """
+   The data of a node as built by the node mappers, its mapped columns together with the
+   declaration of its virtual columns.  Row operations apply to the data, and the virtual
+   columns are filled in by write_tsv and expand_virtual_columns.
+
+   Attributes
+   ----------
+   data : pd.DataFrame
+      The mapped columns of the node
+   virtual_columns : VirtualColumns
+      Every column of the node in output order and its constant and empty columns
+   """
+   data: pd.DataFrame
+   virtual_columns: VirtualColumns
+
+
+def set_io_engine(engine: str) -> None:
+   """
+   This function selects the engine used to parse the CSV and TSV input files and to write the
+   node and QC files.  The pyarrow engine parses files with the multithreaded Arrow CSV reader
+   into Arrow string columns, and writes files with pyarrow.csv.write_csv.  Both engines read
+   the same values and write the same text.
+
+   Parameters
+   ----------
+   engine : str
+      One of io_engines
+   """
+   global io_engine
+   if engine not in io_engines:
+      raise ValueError(f'Unknown I/O engine {engine}, expected one of {", ".join(io_engines)}')
+   if engine == "pyarrow":
+      try:
+         import pyarrow  # noqa: F401
+      except ImportError:
+         raise ValueError('The pyarrow I/O engine needs the pyarrow package to be installed')
+   io_engine = engine
+
+
+def set_arrow_strings(enabled: bool) -> None:
+   """
+   This function selects the pandas dtype of the string columns.  By default the pandas engine
+   reads strings into object columns holding a Python str per value, and the node columns are
+   object columns.  With Arrow strings every string column, from the DCC and case node columns
+   read by either engine to the node and QC columns written, is a string[pyarrow] column
+   holding its values in one Arrow buffer, and the string transforms of the mappings run as
+   Arrow compute kernels.  The files written are the same.
+
+   Parameters
+   ----------
+   enabled : bool
+      When true the string columns are string[pyarrow] columns
+   """
+   global arrow_strings
+   if enabled and not pyarrow_available():
+      raise ValueError('Arrow backed strings need the pyarrow package to be installed')
+   arrow_strings = enabled
+
+
+def string_dtype() -> pd.StringDtype | type:
+   """Give the dtype of the string columns read and built by the mappers, see set_arrow_strings."""
+   return pd.StringDtype("pyarrow") if arrow_strings else object
+
+
+def read_template_headers(template_path: Path) -> list[str]:
+   """
+   This function reads the header names of an ARDaC node template TSV file.
+
+   Parameters
+   ----------
+   template_path : Path
+      The full path to the node template TSV file
+
+   Return
+   ------
+   The header names extracted from the node template
+   """
+   logger.info(f'Reading template TSV file: {template_path.as_posix()}')
+   with _metrics.stage('template-load'):
+      df_template = pd.read_csv(template_path.as_posix(), sep='\t', nrows=0)  # Read only the header
+   return df_template.columns.tolist()  # Extract the headers as a list
+
+
+def check_columns(file_path: Path, columns: list[str], sep: str, description: str, optional_columns: Collection[str] = ()) -> list[str]:
+   """
+   This function reads the header of a delimited file and rejects the file if any of the
+   given columns is missing, unless the column is optional.
+
+   Parameters
+   ----------
+   file_path : Path
+      The full path to the delimited file
+   columns : list[str]
+      The names of the columns to read
+   sep : str
+      The field delimiter
+   description : str
+      The description of the file used in the log and error messages
+   optional_columns : Collection[str]
+      The names of the columns that may be missing from the file
+
+   Return
+   ------
+   The given columns that are in the file, in the given order
+   """
+   file_columns = pd.read_csv(file_path.as_posix(), sep=sep, nrows=0).columns
+   missing_columns = [column for column in columns if column not in file_columns and column not in optional_columns]
+   if missing_columns:
+      logger.critical(f'The {description} file is missing required columns {missing_columns}: {file_path.as_posix()}')
+      raise ValueError(f'The {description} file {file_path.as_posix()} is missing required columns: {", ".join(missing_columns)}')
+   absent_columns = [column for column in columns if column not in file_columns]
+   if absent_columns:
+      logger.warning(f'The {description} file is missing optional columns {absent_columns}, mapped as empty: {file_path.as_posix()}')
+   return [column for column in columns if column in file_columns]
+
+
+def column_dtypes(columns: list[str]) -> dict[str, str | type]:
+   """Give the read dtype of each column, strings except for the low-cardinality columns."""
+   return {column: "category" if column in categorical_columns else pd.StringDtype("pyarrow") if arrow_strings else str for column in columns}
+
+
+def read_csv_columns(file_path: Path, columns: list[str], sep: str, description: str, optional_columns: Collection[str] = ()) -> pd.DataFrame:
+   """
+   This function reads only the given columns of a delimited file.  The header is checked
+   first, and a file missing any of the required columns is rejected before the data is read.
+   Optional columns missing from the file are left out of the dataframe.  Values are kept as
+   strings, except for the low-cardinality columns which are loaded as categoricals.
+
+   Parameters
+   ----------
+   file_path : Path
+      The full path to the delimited file
+   columns : list[str]
+      The names of the columns to read
+   sep : str
+      The field delimiter
+   description : str
+      The description of the file used in the log and error messages
+   optional_columns : Collection[str]
+      The names of the columns that may be missing from the file
+
+   Return
+   ------
+   A pandas dataframe containing the requested columns in the given order
+   """
+   columns = check_columns(file_path, columns, sep, description, optional_columns)
+
+   logger.info(f'Reading the {description} file: {file_path.as_posix()}')
+   with _metrics.stage('read') as stage:
+      if io_engine == "pyarrow":
+         import pyarrow.csv
+         table = pyarrow.csv.read_csv(file_path.as_posix(), read_options=arrow_read_options(),
+                                      parse_options=pyarrow.csv.ParseOptions(delimiter=sep), convert_options=arrow_convert_options(columns))
+         df_input = arrow_to_pandas(table)
+      else:
+         df_input = pd.read_csv(file_path.as_posix(), sep=sep, usecols=columns, dtype=column_dtypes(columns))[columns]
+      stage.rows_out = len(df_input)
+   logger.info(f'Done reading {description} file')
+   return df_input
+
+
+def read_dcc_file(dcc_path: Path, columns: list[str], description: str, optional_columns: Collection[str] = ()) -> pd.DataFrame:
+   """
+   This function reads the given columns of a DCC CSV file, see read_csv_columns.
+
+   Parameters
+   ----------
+   dcc_path : Path
+      The full path to the DCC CSV file
+   columns : list[str]
+      The names of the DCC columns used by the mapper
+   description : str
+      The description of the file used in the log and error messages
+   optional_columns : Collection[str]
+      The names of the DCC columns that may be missing from the file
+
+   Return
+   ------
+   A pandas dataframe containing the requested DCC columns
+   """
+   return read_csv_columns(dcc_path, columns, ',', description, optional_columns)
+
+
+def read_csv_column_chunks(file_path: Path, columns: list[str], sep: str, description: str, chunk_size: int,
+                           optional_columns: Collection[str] = ()) -> Iterator[pd.DataFrame]:
+   """
+   This function reads the given columns of a delimited file in chunks of at most chunk_size
+   rows, so only one chunk is held in memory at a time.  The header is checked before the
+   first chunk is read, see read_csv_columns.
+
+   Parameters
+   ----------
+   file_path : Path
+      The full path to the delimited file
+   columns : list[str]
+      The names of the columns to read
+   sep : str
+      The field delimiter
+   description : str
+      The description of the file used in the log and error messages
+   chunk_size : int
+      The maximum number of rows in each chunk
+   optional_columns : Collection[str]
+      The names of the columns that may be missing from the file
+
+   Return
+   ------
+   An iterator over pandas dataframes containing the requested columns, in file order
+   """
+   columns = check_columns(file_path, columns, sep, description, optional_columns)
+
+   logger.info(f'Reading the {description} file in chunks of {chunk_size} rows: {file_path.as_posix()}')
+   if io_engine == "pyarrow":
+      yield from _metrics.timed_chunks('read', read_arrow_chunks(file_path, columns, sep, chunk_size))
+   else:
+      with pd.read_csv(file_path.as_posix(), sep=sep, usecols=columns, dtype=column_dtypes(columns), chunksize=chunk_size) as reader:
+         for df_chunk in _metrics.timed_chunks('read', reader):
+            yield df_chunk[columns]
+   logger.info(f'Done reading {description} file')
+
+
+def arrow_read_options():
+   """Give the pyarrow CSV read options, parsing with multiple threads."""
+   import pyarrow.csv
+   return pyarrow.csv.ReadOptions(use_threads=True)
+
+
+def arrow_convert_options(columns: list[str]):
+   """
+   Give the pyarrow CSV convert options that read only the given columns, as Arrow strings or
+   as dictionary encoded strings for the low-cardinality columns, with the pandas missing values.
+   """
+   import pyarrow
+   import pyarrow.csv
+   column_types = {column: pyarrow.dictionary(pyarrow.int32(), pyarrow.string()) if column in categorical_columns else pyarrow.string()
+                   for column in columns}
+   return pyarrow.csv.ConvertOptions(include_columns=columns, column_types=column_types, null_values=pandas_na_values,
+                                     strings_can_be_null=True, quoted_strings_can_be_null=True)
+
+
+def arrow_to_pandas(table) -> pd.DataFrame:
+   """Convert an Arrow table read by the pyarrow engine to a pandas dataframe of Arrow backed strings and categoricals."""
+   import pyarrow
+   return table.to_pandas(types_mapper={pyarrow.string(): pd.StringDtype("pyarrow")}.get)
+
+
+def read_arrow_chunks(file_path: Path, columns: list[str], sep: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+   """
+   This function streams the given columns of a delimited file with the pyarrow CSV reader and
+   regroups the Arrow record batches into chunks of chunk_size rows, with a smaller last chunk.
+   At least one chunk is produced, like the pandas chunked reader.
+
+   Parameters
+   ----------
+   file_path : Path
+      The full path to the delimited file
+   columns : list[str]
+      The names of the columns to read
+   sep : str
+      The field delimiter
+   chunk_size : int
+      The number of rows in each chunk
+
+   Return
+   ------
+   An iterator over pandas dataframes containing the requested columns, in file order
+   """
+   import pyarrow
+   import pyarrow.csv
+   batches = []
+   batch_rows = 0
+   chunk_count = 0
+   with pyarrow.csv.open_csv(file_path.as_posix(), read_options=arrow_read_options(),
+                             parse_options=pyarrow.csv.ParseOptions(delimiter=sep), convert_options=arrow_convert_options(columns)) as reader:
+      schema = reader.schema
+      for batch in reader:
+         batches.append(batch)
+         batch_rows += batch.num_rows
+         while batch_rows >= chunk_size:
+            table = pyarrow.Table.from_batches(batches, schema=schema)
+            yield arrow_to_pandas(table.slice(0, chunk_size))
+            chunk_count += 1
+            batches = table.slice(chunk_size).to_batches()
+            batch_rows -= chunk_size
+   if batch_rows > 0 or chunk_count == 0:
+      yield arrow_to_pandas(pyarrow.Table.from_batches(batches, schema=schema))
+
+
+def read_dcc_file_chunks(dcc_path: Path, columns: list[str], description: str, chunk_size: int,
+                         optional_columns: Collection[str] = ()) -> Iterator[pd.DataFrame]:
+   """
+   This function reads the given columns of a DCC CSV file in chunks, see read_csv_column_chunks.
+
+   Parameters
+   ----------
+   dcc_path : Path
+      The full path to the DCC CSV file
+   columns : list[str]
+      The names of the DCC columns used by the mapper
+   description : str
+      The description of the file used in the log and error messages
+   chunk_size : int
+      The maximum number of rows in each chunk
+   optional_columns : Collection[str]
+      The names of the DCC columns that may be missing from the file
+
+   Return
+   ------
+   An iterator over pandas dataframes containing the requested DCC columns, in file order
+   """
+   return read_csv_column_chunks(dcc_path, columns, ',', description, chunk_size, optional_columns)
+
+
+def read_case_node(case_path: Path, description: str) -> pd.DataFrame:
+   """
+   This function reads the submitter IDs of an ARDaC case node, which is all the other node
+   mappers use from the case node.  When the Arrow IPC sidecar written by write_case_sidecar
+   is next to the case node TSV file, and the size and SHA-256 digest in its schema metadata
+   are those of the TSV file, it is memory-mapped instead of parsing the TSV file, and also
+   gives the subject IDs.
+
+   Parameters
+   ----------
+   case_path : Path
+      The full path to the ARDaC case node TSV file generated by case_node_mapper.py
+   description : str
+      The description of the file used in the log and error messages
+
+   Return
+   ------
+   A pandas dataframe containing the "*submitter_id" column of the case node, and the
+   "usubjid" column when read from the sidecar
+   """
+   sidecar_path = case_path.with_suffix(_constants.__case_sidecar_file_extension__)
+   if sidecar_path.is_file() and pyarrow_available():
+      import pyarrow
+      import pyarrow.ipc
+      with pyarrow.memory_map(sidecar_path.as_posix()) as source:
+         reader = pyarrow.ipc.open_file(source)
+         if case_sidecar_is_current(reader.schema.metadata, case_path):
+            logger.info(f'Memory-mapping the {description} sidecar file: {sidecar_path.as_posix()}')
+            with _metrics.stage('read') as stage:
+               df_case_input = arrow_to_pandas(reader.read_all().select(case_sidecar_columns))
+               stage.rows_out = len(df_case_input)
+            return df_case_input
+      logger.warning(f'Ignoring the {description} sidecar file, which was not written for the current case node file: {sidecar_path.as_posix()}')
+
+   return read_csv_columns(case_path, ["*submitter_id"], '\t', description)
+
+
+def read_node_text(node_path: Path) -> pd.DataFrame:
+   """
+   This function reads a node or QC file written by a mapper with every value as the text
+   that was written, so that its rows are written again unchanged.  Empty fields are read as
+   empty values, and a QC file written without any columns is read as an empty dataframe
+   without columns.
+
+   Parameters
+   ----------
+   node_path : Path
+      The full path to the node or QC file
+
+   Return
+   ------
+   A pandas dataframe containing the node data
+   """
+   with _metrics.stage('read') as stage:
+      try:
+         df_node = pd.read_csv(node_path.as_posix(), sep='\t', dtype=pd.StringDtype("pyarrow") if arrow_strings else str, keep_default_na=False, na_values=[""])
+      except pd.errors.EmptyDataError:
+         df_node = pd.DataFrame()
+      stage.rows_out = len(df_node)
+   return df_node
+
+
+def case_sidecar_metadata(case_path: Path) -> dict[bytes, bytes]:
+   """Give the sidecar schema metadata recording the size and SHA-256 digest of the case node TSV file."""
+   return {case_sidecar_size_key: str(case_path.stat().st_size).encode(), case_sidecar_digest_key: _manifest.file_digest(case_path).encode()}
+
+
+def case_sidecar_is_current(metadata: dict[bytes, bytes] | None, case_path: Path) -> bool:
+   """Tell whether sidecar schema metadata records the case node TSV file, which is only hashed when its size matches."""
+   metadata = metadata or {}
+   if metadata.get(case_sidecar_size_key) != str(case_path.stat().st_size).encode():
+      return False
+   return metadata.get(case_sidecar_digest_key) == _manifest.file_digest(case_path).encode()
+
+
+def case_subject_ids(case_submitter_ids: pd.Series) -> pd.Series:
+   """Give the subject ID of each case submitter ID, the text before the first '_'."""
+   return case_submitter_ids.str.replace(r"(?s)_.*", "", regex=True)
+
+
+def case_sidecar_table(df_case_output: pd.DataFrame):
+   """Give the case submitter IDs and their subject IDs as the pyarrow table written to the sidecar file."""
+   import pyarrow
+   return pyarrow.table({
+      "*submitter_id": pyarrow.array(df_case_output["*submitter_id"], type=pyarrow.string(), from_pandas=True),
+      "usubjid": pyarrow.array(case_subject_ids(df_case_output["*submitter_id"]), type=pyarrow.string(), from_pandas=True),
+   })
+
+
+def partial_case_sidecar_path(sidecar_path: Path) -> Path:
+   """Give the path of the sidecar file written a chunk at a time by append_case_sidecar, until finish_case_sidecar completes it."""
+   return sidecar_path.with_name(sidecar_path.name + '.partial')
+
+
+def write_case_sidecar(df_case_output: pd.DataFrame, sidecar_path: Path, case_path: Path) -> None:
+   """
+   This function writes the case submitter IDs and their subject IDs to an uncompressed Arrow
+   IPC (Feather v2) file, which the other node mappers memory-map instead of parsing the case
+   node TSV file.  The size and SHA-256 digest of the case node TSV file, which must already
+   be written, are saved in the schema metadata, so that read_case_node only uses the sidecar
+   file with the TSV file it was written for.  Nothing is written when pyarrow is not
+   installed.
+
+   Parameters
+   ----------
+   df_case_output : pd.DataFrame
+      The case node data
+   sidecar_path : Path
+      The full path to the sidecar file, next to the case node TSV file
+   case_path : Path
+      The full path to the case node TSV file
+   """
+   if not pyarrow_available():
+      logger.debug('pyarrow is not installed, the case node sidecar file is not written')
+      return
+
+   import pyarrow.ipc
+   table = case_sidecar_table(df_case_output)
+   with _metrics.stage('write', rows_in=len(df_case_output)) as stage:
+      table = table.replace_schema_metadata(case_sidecar_metadata(case_path))
+      with pyarrow.ipc.new_file(sidecar_path.as_posix(), table.schema) as writer:
+         writer.write_table(table)
+      stage.rows_out = table.num_rows
+
+
+def append_case_sidecar(df_case_output: pd.DataFrame, sidecar_path: Path, writer):
+   """
+   This function writes a chunk of the case node to a partial Arrow IPC sidecar file, see
+   write_case_sidecar.  The first chunk is written with no writer, which creates the file,
+   and the returned writer is passed with the following chunks and closed after the last one.
+   Once the case node TSV file is written, finish_case_sidecar turns the partial file into
+   the sidecar file.
+
+   Parameters
+   ----------
+   df_case_output : pd.DataFrame
+      A chunk of the case node data
+   sidecar_path : Path
+      The full path to the sidecar file, next to the case node TSV file
+   writer : pyarrow.ipc.RecordBatchFileWriter | None
+      The open partial sidecar file writer, or None to create the partial sidecar file
+
+   Return
+   ------
+   The open partial sidecar file writer, or None when pyarrow is not installed
+   """
+   if not pyarrow_available():
+      logger.debug('pyarrow is not installed, the case node sidecar file is not written')
+      return None
+
+   import pyarrow.ipc
+   table = case_sidecar_table(df_case_output)
+   with _metrics.stage('write', rows_in=len(df_case_output)) as stage:
+      if writer is None:
+         writer = pyarrow.ipc.new_file(partial_case_sidecar_path(sidecar_path).as_posix(), table.schema)
+      writer.write_table(table)
+      stage.rows_out = table.num_rows
+   return writer
+
+
+def finish_case_sidecar(sidecar_path: Path, case_path: Path) -> None:
+   """
+   This function copies the closed partial sidecar file written by append_case_sidecar to the
+   sidecar file, with the size and SHA-256 digest of the case node TSV file in its schema
+   metadata as write_case_sidecar saves them, and removes the partial file.
+
+   Parameters
+   ----------
+   sidecar_path : Path
+      The full path to the sidecar file, next to the case node TSV file
+   case_path : Path
+      The full path to the written case node TSV file
+   """
+   import pyarrow
+   import pyarrow.ipc
+   partial_path = partial_case_sidecar_path(sidecar_path)
+   with _metrics.stage('write') as stage:
+      with pyarrow.memory_map(partial_path.as_posix()) as source:
+         reader = pyarrow.ipc.open_file(source)
+         with pyarrow.ipc.new_file(sidecar_path.as_posix(), reader.schema.with_metadata(case_sidecar_metadata(case_path))) as writer:
+            for batch_number in range(reader.num_record_batches):
+               batch = reader.get_batch(batch_number)
+               writer.write_batch(batch)
+               stage.rows_in += batch.num_rows
+      stage.rows_out = stage.rows_in
+   partial_path.unlink()
+
+
+def node_frame(df_node: pd.DataFrame | NodeFrame) -> NodeFrame:
+   """Give node data as a NodeFrame, a dataframe holding every column of a node or QC file has no virtual columns."""
+   if isinstance(df_node, NodeFrame):
+      return df_node
+   return NodeFrame(df_node, VirtualColumns(list(df_node.columns), {}, []))
+
+
+def node_columns(node: NodeFrame) -> list[str]:
+   """Give every column of a node in output order, including its virtual columns."""
+   virtual_columns = node.virtual_columns
+   return virtual_columns.columns + [column for column in node.data.columns if column not in virtual_columns.columns]
+
+
+def check_virtual_columns(node: NodeFrame) -> None:
+   """Reject a node missing some of its columns, those neither held by the data nor declared constant or empty."""
+   virtual_columns = node.virtual_columns
+   missing_columns = [column for column in virtual_columns.columns
+                      if column not in node.data.columns and column not in virtual_columns.constants and column not in virtual_columns.empty]
+   if missing_columns:
+      raise ValueError(f'The node columns {", ".join(missing_columns)} are neither in the node data nor virtual')
+
+
+def expand_virtual_columns(df_node: pd.DataFrame | NodeFrame) -> pd.DataFrame:
+   """
+   This function gives the data of a node with its virtual columns filled in, in output
+   order, as the node is written.  A dataframe is given unchanged.
+
+   Parameters
+   ----------
+   df_node : pd.DataFrame | NodeFrame
+      The node data
+
+   Return
+   ------
+   A pandas dataframe holding every column of the node
+   """
+   if not isinstance(df_node, NodeFrame):
+      return df_node
+   check_virtual_columns(df_node)
+   columns = {}
+   for column in node_columns(df_node):
+      if column in df_node.data.columns:
+         columns[column] = df_node.data[column]
+      else:
+         columns[column] = np.full(len(df_node.data), df_node.virtual_columns.constants.get(column, np.nan), dtype=object)
+   return pd.DataFrame(columns, index=df_node.data.index)
+
+
+def expand_arrow_columns(table, node: NodeFrame):
+   """Give the Arrow table of the mapped columns of a node with its virtual columns added, in output order."""
+   import pyarrow
+   virtual_columns = node.virtual_columns
+   arrays = []
+   for column in node_columns(node):
+      if column in node.data.columns:
+         arrays.append(table.column(column))
+      elif column in virtual_columns.constants:
+         arrays.append(pyarrow.repeat(virtual_columns.constants[column], table.num_rows))
+      else:
+         arrays.append(pyarrow.nulls(table.num_rows))
+   return pyarrow.Table.from_arrays(arrays, names=node_columns(node))
+
+
+def pyarrow_available() -> bool:
+   """Check whether the optional pyarrow package is installed."""
+   return importlib.util.find_spec("pyarrow") is not None
+
+
+def write_tsv(df_output: pd.DataFrame | NodeFrame, file_path: Path, append: bool = False) -> None:
+   """
+   This function writes a dataframe to a TSV file with the header, or appends its rows
+   without the header, using the selected I/O engine.  The pyarrow engine writes the header
+   and any data that needs quoting or is not string or integer valued with pandas, so both
+   engines write the same text: values containing a tab, quote, or line break are quoted and
+   empty values are written as empty fields.  The virtual columns of a node are expanded in
+   output order as the rows are written, and a node missing any of its columns is rejected,
+   see NodeFrame.
+
+   Parameters
+   ----------
+   df_output : pd.DataFrame | NodeFrame
+      The node or QC data
+   file_path : Path
+      The full path to the TSV file to be written
+   append : bool
+      When true the rows are appended to the file without the header
+   """
+   node = node_frame(df_output)
+   check_virtual_columns(node)
+   with _metrics.stage('write', rows_in=len(node.data)) as stage:
+      write_tsv_rows(node, file_path, append)
+      stage.rows_out = len(node.data)
+
+
+def write_tsv_rows(node: NodeFrame, file_path: Path, append: bool) -> None:
+   """Write or append node data to a TSV file with the selected I/O engine, see write_tsv."""
+   if io_engine != "pyarrow" or not node_columns(node):
+      write_expanded_rows(node, file_path, append)
+      return
+
+   import pyarrow
+   import pyarrow.csv
+   try:
+      table = expand_arrow_columns(pyarrow.Table.from_pandas(node.data, preserve_index=False), node)
+   except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+      table = None
+   if table is None or not all(arrow_writes_like_pandas(column) for column in table.columns):
+      write_expanded_rows(node, file_path, append)
+      return
+
+   if not append:
+      expand_virtual_columns(NodeFrame(node.data.head(0), node.virtual_columns)).to_csv(file_path.as_posix(), sep='\t', index=False, header=True)
+   with open(file_path.as_posix(), 'ab') as tsv_file:
+      pyarrow.csv.write_csv(table, tsv_file, pyarrow.csv.WriteOptions(include_header=False, delimiter='\t', quoting_style='none'))
+
+
+def write_expanded_rows(node: NodeFrame, file_path: Path, append: bool) -> None:
+   """Write or append node data to a TSV file with pandas, expanding the virtual columns of a node a chunk of rows at a time."""
+   if node_columns(node) == list(node.data.columns):
+      node.data.to_csv(file_path.as_posix(), sep='\t', index=False, header=not append, mode='a' if append else 'w')
+      return
+   for start in range(0, max(len(node.data), 1), expanded_chunk_rows):
+      # Only the first chunk of a new file writes the header
+      expand_virtual_columns(NodeFrame(node.data.iloc[start:start + expanded_chunk_rows], node.virtual_columns)).to_csv(
+         file_path.as_posix(), sep='\t', index=False, header=not append and start == 0, mode='a' if append or start > 0 else 'w')
+
+
+def arrow_writes_like_pandas(column) -> bool:
+   """Check that pyarrow.csv.write_csv writes an Arrow column without quotes as the pandas TSV writer does."""
+   import pyarrow
+   import pyarrow.compute
+   if pyarrow.types.is_null(column.type) or pyarrow.types.is_integer(column.type):
+      return True
+   if pyarrow.types.is_dictionary(column.type):
+      column = column.cast(column.type.value_type)
+   if not (pyarrow.types.is_string(column.type) or pyarrow.types.is_large_string(column.type)):
+      return False
+   return not pyarrow.compute.any(pyarrow.compute.match_substring_regex(column, tsv_quoted_characters)).as_py()
+
+
+def write_node_file(df_output: pd.DataFrame | NodeFrame, node_file_path: Path, description: str) -> None:
+   """
+   This function writes node or QC data to a TSV file.
+
+   Parameters
+   ----------
+   df_output : pd.DataFrame | NodeFrame
+      The node or QC data
+   node_file_path : Path
+      The full path to the TSV file to be written
+   description : str
+      The description of the file used in the log messages
+   """
+   write_tsv(df_output, node_file_path)
+   logger.info(f'{description} saved as: {node_file_path.as_posix()}')
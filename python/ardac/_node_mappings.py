@@ -0,0 +1,237 @@
+# Declarative DCC to ARDaC node mappings.  Each mapping is a table of FieldMapping rows giving
+# the ARDaC target field, the DCC source column(s), an optional vectorized transform, or a
+# constant value.  The DCC source columns of the fields marked optional may be missing from a
+# DCC file and are then mapped as empty, only the key columns and the case node source columns
+# are required.  The tables are compiled once into mapping plans which the node mappers
+# execute with whole-column operations.
+import pandas as pd
+from ._mapping import FieldMapping, compile_mapping, strip, append, lookup
+
+project_id = "ARDaC-AlcHepNet"
+
+# Follow-up visit submitter ID extensions keyed by the DCC redcap_event_name
+obs_visit_extensions = {"Week 0": "_0", "Week 4": "_28", "Week 12": "_84", "Week 24": "_168"}
+rct_visit_extensions = {"Day 0": "_0", "Day 3": "_3", "Day 7": "_7", "Day 14": "_14", "Day 28": "_28", "Day 60": "_60", "Day 90": "_90", "Day 180": "_180"}
+
+
+def last_colon_part(values: pd.Series) -> pd.Series:
+   """Keep the text after the last ':' with surrounding whitespace removed."""
+   # A regular expression replacement runs as an Arrow kernel on Arrow backed strings, where split builds Python lists
+   return values.str.replace(r"(?s)^.*:", "", regex=True).str.strip()
+
+
+def year(values: pd.Series) -> pd.Series:
+   """Keep the year of a YYYY-MM-DD date."""
+   return values.str.replace(r"(?s)-.*", "", regex=True)
+
+
+def days_between(end_dates: pd.Series, start_dates: pd.Series) -> pd.Series:
+   """Count the days between two YYYY-MM-DD dates, dates that cannot be parsed give no value."""
+   end = pd.to_datetime(end_dates, format="%Y-%m-%d", errors="coerce")
+   start = pd.to_datetime(start_dates, format="%Y-%m-%d", errors="coerce")
+   days = (end - start).dt.days
+   return days.astype("Int64").astype(object).where(days.notna(), None)
+
+
+def demographic_vital_status(values: pd.Series) -> pd.Series:
+   """Map the DCC ALIVE flag to the demographic vital status."""
+   return values.str.strip().map({"Y": "Alive", "N": "Dead"}).fillna("Not Reported")
+
+
+def concatenate(*values: pd.Series) -> pd.Series:
+   """Join the values of each row into one string."""
+   result = values[0]
+   for more_values in values[1:]:
+      result = result + more_values
+   return result
+
+
+def visit_day(extensions: pd.Series) -> pd.Series:
+   """Convert a visit submitter ID extension to the visit day."""
+   return extensions.str.lstrip("_")
+
+
+case_vital_status = lookup({"Y": "alive", "N": "dead"})
+
+# Case node, mapped from the DCC subjects data
+case_obs_mapping = [
+   FieldMapping("*type", constant="case"),
+   FieldMapping("project_id", constant=project_id),
+   FieldMapping("*studies.submitter_id", constant="obs"),
+   FieldMapping("index_date", constant="Study Enrollment"),
+   FieldMapping("*submitter_id", "usubjid", append("_obs")),
+   FieldMapping("cohort", "obs_arm", last_colon_part),
+   FieldMapping("study_site", "site", strip),
+   FieldMapping("vital_status", "ALIVE", case_vital_status),
+]
+
+case_rct_mapping = [
+   FieldMapping("*type", constant="case"),
+   FieldMapping("project_id", constant=project_id),
+   FieldMapping("*studies.submitter_id", constant="clinical"),
+   FieldMapping("index_date", constant="Study Enrollment"),
+   FieldMapping("*submitter_id", "usubjid", append("_clinical")),
+   FieldMapping("actarm", "rct_arm", strip),
+   FieldMapping("rct_meld_strata", "rct_meld_strata", strip),
+   FieldMapping("study_site", "site", strip),
+   FieldMapping("vital_status", "ALIVE", case_vital_status),
+]
+
+# Demographic node, mapped from the case node "*submitter_id" joined to the DCC subjects data
+demographic_mapping = [
+   FieldMapping("*type", constant="demographic"),
+   FieldMapping("project_id", constant=project_id),
+   FieldMapping("*submitter_id", "*submitter_id", append("_demographic")),
+   FieldMapping("*cases.submitter_id", "*submitter_id"),
+   FieldMapping("age_at_index", "calc_age", optional=True),
+   FieldMapping("cause_of_death_primary", "codp", optional=True),
+   FieldMapping("cause_of_death_secondary", "cods", optional=True),
+   FieldMapping("cur_employ_stat", "employed", optional=True),
+   FieldMapping("education", "edu", optional=True),
+   FieldMapping("ethnicity", "ethnic", optional=True),
+   FieldMapping("gender", "gender", optional=True),
+   FieldMapping("marital", "maristat", optional=True),
+   FieldMapping("race", "race", optional=True),
+   FieldMapping("sex", "sex", optional=True),
+   FieldMapping("vital_status", "ALIVE", demographic_vital_status, optional=True),
+   FieldMapping("year_of_birth", "brthdtc", year, optional=True),
+   FieldMapping("year_of_death", "dthdtc", year, optional=True),
+   FieldMapping("days_to_death", ("dthdtc", "scdat"), days_between, optional=True),
+]
+
+# Audit node, mapped from the case node "*submitter_id" joined to the DCC audit data
+audit_mapping = [
+   FieldMapping("*type", constant="audit"),
+   FieldMapping("project_id", constant=project_id),
+   FieldMapping("*submitter_id", "*submitter_id", append("_audit")),
+   FieldMapping("cases.submitter_id", "*submitter_id"),
+   FieldMapping("auditnd", "auditnd", optional=True),
+   FieldMapping("adt0101", "adt0101", optional=True),
+   FieldMapping("adt0102", "adt0102", optional=True),
+   FieldMapping("adt0103", "adt0103", optional=True),
+   FieldMapping("adt0104", "adt0104", optional=True),
+   FieldMapping("adt0105", "adt0105", optional=True),
+   FieldMapping("adt0106", "adt0106", optional=True),
+   FieldMapping("adt0107", "adt0107", optional=True),
+   FieldMapping("adt0108", "adt0108", optional=True),
+   FieldMapping("adt0109", "adt0109", optional=True),
+   FieldMapping("adt0110", "adt0110", optional=True),
+]
+
+# Fixed follow-up fields, mapped from the case node "*submitter_id" crossed with the visit "extension"
+follow_up_visit_mapping = [
+   FieldMapping("*type", constant="follow_up"),
+   FieldMapping("project_id", constant=project_id),
+   FieldMapping("*submitter_id", ("*submitter_id", "extension"), concatenate),
+   FieldMapping("cases.submitter_id", "*submitter_id"),
+   FieldMapping("demographics.submitter_id", "*submitter_id", append("_demographic")),
+   FieldMapping("*days_to_follow_up", "extension", visit_day),
+   FieldMapping("visit_day", "extension", visit_day),
+]
+
+# Follow-up fields mapped from the DCC liver scores data
+liver_scores_mapping = [
+   FieldMapping("meld_score", "meld", optional=True),
+   FieldMapping("child_pugh_score", "cps", optional=True),
+   FieldMapping("tlfb_drinking_days", "tlfbnumdd", optional=True),
+   FieldMapping("tlfb_number_drinks", "tlfbnumd", optional=True),
+   FieldMapping("liver_score_date", "liverdat", optional=True),
+]
+
+# Follow-up fields mapped from the DCC medical information data
+med_info_mapping = [
+   FieldMapping("ascites_culture", "ascyn", optional=True),
+   FieldMapping("hep_enceph", "hepenyn", optional=True),
+   FieldMapping("varices", "varyn", optional=True),
+   FieldMapping("hep_carcinoma", "hepcaryn", optional=True),
+   FieldMapping("liver_transplant", "livtnsplyn", optional=True),
+   FieldMapping("ascites_date", "ascdat", optional=True),
+   FieldMapping("hep_enceph_diagnosis_date", "hependat", optional=True),
+   FieldMapping("varices_diagnosis_date", "vardat", optional=True),
+   FieldMapping("hepcar_diagnosis_date", "hepcardat", optional=True),
+   FieldMapping("liver_transplant_date", "livtnspldat", optional=True),
+]
+
+# Follow-up fields mapped from the DCC vitals data
+vitals_mapping = [
+   FieldMapping("weight", "weight", optional=True),
+   FieldMapping("bmi", "bmi", optional=True),
+]
+
+# Follow-up fields mapped from the DCC SOC data
+soc_mapping = [
+   FieldMapping("infection_screen_done", "infscreennd", optional=True),
+   FieldMapping("infection_screen_date", "infscreen_date", optional=True),
+   FieldMapping("blood_culture", "socisbcnd___999", optional=True),
+   FieldMapping("blood_culture_result", "socisbc", optional=True),
+   FieldMapping("blood_organism", "socisbc_pos", optional=True),
+   FieldMapping("blood_culture_date", "socisbcdat", optional=True),
+   FieldMapping("urine_culture", "socisucnd___999", optional=True),
+   FieldMapping("urine_culture_result", "socisuc", optional=True),
+   FieldMapping("urine_culture_organism", "socisuc_pos", optional=True),
+   FieldMapping("urine_culture_date", "socisucdat", optional=True),
+   FieldMapping("urine_culture_fungal_result", "soicuc_fung", optional=True),
+   FieldMapping("ascites_culture", "socisacnd___999", optional=True),
+   FieldMapping("ascites_culture_result", "socisac", optional=True),
+   FieldMapping("ascites_organism", "socisac_pos", optional=True),
+   FieldMapping("ascites_date", "socisacdat", optional=True),
+   FieldMapping("endoscopy", "endond", optional=True),
+   FieldMapping("endoscopy_date", "endodat", optional=True),
+   FieldMapping("esophageal_varices_size", "endovarsiz_esoph", optional=True),
+   FieldMapping("esophageal_varices_bleed", "endobled_esoph", optional=True),
+   FieldMapping("gastric_varices_size", "endovarsiz_gast", optional=True),
+   FieldMapping("gastric_varices_bleed", "endobled_gast", optional=True),
+   FieldMapping("portal_hypertensive_gastropathy", "porthypsev", optional=True),
+   FieldMapping("esophageal_ulcer_size", "endoulcsiz_esoph", optional=True),
+   FieldMapping("esophageal_ulcer_bleed", "endoulcbled_esoph", optional=True),
+   FieldMapping("gastric_ulcer_size", "endoulcsiz_gast", optional=True),
+   FieldMapping("gastric_ulcer_bleed", "endoulcbled_gast", optional=True),
+   FieldMapping("duodenum_ulcer_size", "endoulcsiz_duod", optional=True),
+   FieldMapping("duodenum_ulcer_bleed", "endoulcbled_duod", optional=True),
+]
+
+# The compiled mapping plans
+case_obs_plan = compile_mapping(case_obs_mapping)
+case_rct_plan = compile_mapping(case_rct_mapping)
+demographic_plan = compile_mapping(demographic_mapping)
+audit_plan = compile_mapping(audit_mapping)
+follow_up_visit_plan = compile_mapping(follow_up_visit_mapping)
+liver_scores_plan = compile_mapping(liver_scores_mapping)
+med_info_plan = compile_mapping(med_info_mapping)
+vitals_plan = compile_mapping(vitals_mapping)
+soc_plan = compile_mapping(soc_mapping)
+
+
+def dcc_columns(key_columns: list[str], *plans) -> list[str]:
+   """List the key columns followed by the DCC source columns of the mapping plans, skipping case node columns."""
+   columns = list(key_columns)
+   for plan in plans:
+      columns.extend(column for column in plan.source_columns if column not in columns and column != "*submitter_id")
+   return columns
+
+
+def optional_dcc_columns(*plans) -> list[str]:
+   """List the DCC source columns of the mapping plans that are optional in every plan reading them."""
+   required_columns = {column for plan in plans for column in plan.source_columns if column not in plan.optional_columns}
+   return [column for column in dcc_columns([], *plans) if column not in required_columns]
+
+
+# The DCC columns read by the mappers, and those of them that may be missing from the DCC files
+case_obs_subjects_columns = dcc_columns(["usubjid"], case_obs_plan)
+case_rct_subjects_columns = dcc_columns(["usubjid"], case_rct_plan)
+demographic_subjects_columns = dcc_columns(["usubjid"], demographic_plan)
+demographic_subjects_optional_columns = optional_dcc_columns(demographic_plan)
+audit_columns = dcc_columns(["usubjid"], audit_plan)
+audit_optional_columns = optional_dcc_columns(audit_plan)
+liver_scores_columns = dcc_columns(["usubjid", "redcap_event_name"], liver_scores_plan)
+liver_scores_optional_columns = optional_dcc_columns(liver_scores_plan)
+med_info_columns = dcc_columns(["usubjid", "redcap_event_name"], med_info_plan)
+med_info_optional_columns = optional_dcc_columns(med_info_plan)
+vitals_columns = dcc_columns(["usubjid", "redcap_event_name"], vitals_plan)
+vitals_optional_columns = optional_dcc_columns(vitals_plan)
+soc_columns = dcc_columns(["usubjid", "redcap_event_name"], soc_plan)
+soc_optional_columns = optional_dcc_columns(soc_plan)
+all_nodes_obs_subjects_columns = dcc_columns(["usubjid"], case_obs_plan, demographic_plan)
+all_nodes_obs_subjects_optional_columns = optional_dcc_columns(case_obs_plan, demographic_plan)
+all_nodes_rct_subjects_columns = dcc_columns(["usubjid"], case_rct_plan, demographic_plan)
+all_nodes_rct_subjects_optional_columns = optional_dcc_columns(case_rct_plan, demographic_plan)
@@ -0,0 +1,61 @@
+# Type and enum rules of the ARDaC node schemas, checked by the --validate stage of the node
+# mappers.  Each schema is a table of ColumnRule rows giving the ARDaC field and the rule its
+# values must follow.  Fields marked with a leading * in the node templates are required, and
+# the other rules only check non-empty values.  Rules for fields missing from a node template
+# are skipped.
+from ._validation import ColumnRule, check_rules
+from ._node_mappings import project_id
+
+# Date fields hold YYYY-MM-DD dates
+follow_up_date_fields = ["liver_score_date", "ascites_date", "hep_enceph_diagnosis_date", "varices_diagnosis_date", "hepcar_diagnosis_date",
+                         "liver_transplant_date", "infection_screen_date", "blood_culture_date", "urine_culture_date", "endoscopy_date"]
+
+# The audit item scores
+audit_score_fields = ["adt0101", "adt0102", "adt0103", "adt0104", "adt0105", "adt0106", "adt0107", "adt0108", "adt0109", "adt0110"]
+
+case_rules = check_rules([
+   ColumnRule("*type", "enum", ("case",)),
+   ColumnRule("project_id", "enum", (project_id,)),
+   ColumnRule("*submitter_id", "required"),
+   ColumnRule("*studies.submitter_id", "required"),
+   ColumnRule("*studies.submitter_id", "enum", ("obs", "clinical")),
+   ColumnRule("index_date", "enum", ("Study Enrollment",)),
+   ColumnRule("vital_status", "enum", ("alive", "dead")),
+])
+
+demographic_rules = check_rules([
+   ColumnRule("*type", "enum", ("demographic",)),
+   ColumnRule("project_id", "enum", (project_id,)),
+   ColumnRule("*submitter_id", "required"),
+   ColumnRule("*cases.submitter_id", "required"),
+   ColumnRule("age_at_index", "integer"),
+   ColumnRule("days_to_death", "integer"),
+   ColumnRule("year_of_birth", "integer"),
+   ColumnRule("year_of_death", "integer"),
+   ColumnRule("vital_status", "enum", ("Alive", "Dead", "Not Reported")),
+])
+
+follow_up_rules = check_rules([
+   ColumnRule("*type", "enum", ("follow_up",)),
+   ColumnRule("project_id", "enum", (project_id,)),
+   ColumnRule("*submitter_id", "required"),
+   ColumnRule("cases.submitter_id", "required"),
+   ColumnRule("*days_to_follow_up", "required"),
+   ColumnRule("*days_to_follow_up", "integer"),
+   ColumnRule("visit_day", "integer"),
+   ColumnRule("meld_score", "number"),
+   ColumnRule("child_pugh_score", "number"),
+   ColumnRule("tlfb_drinking_days", "integer"),
+   ColumnRule("tlfb_number_drinks", "number"),
+   ColumnRule("weight", "number"),
+   ColumnRule("height", "number"),
+   ColumnRule("bmi", "number"),
+] + [ColumnRule(field, "date") for field in follow_up_date_fields])
+
+audit_rules = check_rules([
+   ColumnRule("*type", "enum", ("audit",)),
+   ColumnRule("project_id", "enum", (project_id,)),
+   ColumnRule("*submitter_id", "required"),
+   ColumnRule("cases.submitter_id", "required"),
+   ColumnRule("audit_total", "integer"),
+] + [ColumnRule(field, "integer") for field in audit_score_fields])
@@ -0,0 +1,26 @@
+# Assignment of subjects to shards, shared by the follow-up mapper --workers processes and by
+# scatter_dcc.py.  A subject ID is hashed as a plain string, so every row of a subject lands in
+# the same shard whatever the dtype of the column.
+import numpy as np
+import pandas as pd
+
+
+def shard_numbers(subject_keys: pd.Series, shards: int) -> np.ndarray:
+   """
+   This function assigns each subject key to one of shards shards by a hash of its value, so
+   that a subject's rows land in the same shard.
+
+   Parameters
+   ----------
+   subject_keys : pd.Series
+      The subject IDs, or the case submitter IDs, the subject ID followed by the case suffix
+   shards : int
+      The number of shards
+
+   Return
+   ------
+   A numpy array with the shard number of each row
+   """
+   # Hash the values as plain strings, so the same ID is in the same shard whatever its dtype
+   keys = subject_keys.astype(object).where(subject_keys.notna(), "")
+   return (pd.util.hash_pandas_object(keys, index=False).to_numpy() % np.uint64(shards)).astype(np.int64)
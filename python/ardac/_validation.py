@@ -0,0 +1,213 @@
+import logging
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from . import _constants
+from . import _metrics
+from . import _node_io
+
+logger = logging.getLogger(__name__)
+
+# The rules a node column can be checked against.  Except for required, empty values pass every rule.
+rule_types = ["required", "integer", "number", "date", "enum"]
+
+# The patterns the text of a value must match under the type rules
+type_patterns = {
+   "integer": r'[-+]?\d+',
+   "number": r'[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?',
+   "date": r'\d{4}-\d{2}-\d{2}',
+}
+
+# The columns of the violations report
+report_columns = ["column", "rule", "count", "sample_submitter_ids"]
+
+# The largest number of submitter IDs listed for a rule in the violations report
+sample_size = 5
+
+
+class ColumnRule(NamedTuple):
+   """
+   One type or enum rule of an ARDaC node schema.
+
+   Attributes
+   ----------
+   column : str
+      The ARDaC node field name
+   rule : str
+      One of rule_types
+   values : tuple[str, ...]
+      The allowed values of an enum rule
+   """
+   column: str
+   rule: str
+   values: tuple[str, ...] = ()
+
+   def description(self) -> str:
+      """Give the rule as written in the violations report, for example integer or enum: alive|dead."""
+      return f'{self.rule}: {"|".join(self.values)}' if self.values else self.rule
+
+
+def check_rules(rules: list[ColumnRule]) -> list[ColumnRule]:
+   """
+   This function checks the rules of a node schema and gives them back, so that a schema with
+   an unknown rule or an enum rule without values is rejected when it is declared.
+
+   Parameters
+   ----------
+   rules : list[ColumnRule]
+      The rules of the node schema
+
+   Return
+   ------
+   The checked rules
+   """
+   for rule in rules:
+      if rule.rule not in rule_types:
+         raise ValueError(f'Unknown rule {rule.rule} for field {rule.column}, expected one of {", ".join(rule_types)}')
+      if (rule.rule == "enum") != bool(rule.values):
+         raise ValueError(f'Field {rule.column} must give values for an enum rule and only for an enum rule')
+   return rules
+
+
+def invalid_values(values: pd.Series, rule: ColumnRule) -> np.ndarray:
+   """Flag the values breaking a type or enum rule, given the text of each distinct non-empty value."""
+   if rule.rule == "enum":
+      return ~values.isin(rule.values).to_numpy()
+   valid = values.str.fullmatch(type_patterns[rule.rule])
+   if rule.rule == "date":
+      valid &= pd.to_datetime(values.where(valid), format="%Y-%m-%d", errors="coerce").notna()
+   return ~valid.to_numpy(dtype=bool)
+
+
+def violating_rows(node: _node_io.NodeFrame, rule: ColumnRule) -> np.ndarray | None:
+   """
+   This function flags the rows of a node breaking a rule.  Each distinct value of the column is
+   checked once and the result is spread to the rows through the codes of pd.factorize, so the
+   cost of the checks depends on the number of distinct values rather than on the number of rows.
+   A virtual constant column is checked through its value, and a virtual empty column is empty on
+   every row.
+
+   Parameters
+   ----------
+   node : _node_io.NodeFrame
+      The node data, with the values of every row or read as text
+   rule : ColumnRule
+      The rule to check
+
+   Return
+   ------
+   The boolean flag of each row, or None when the node has no such column
+   """
+   if rule.column in node.data.columns:
+      codes, uniques = pd.factorize(node.data[rule.column])
+      values = pd.Series(uniques, dtype=object).astype(str)
+   elif rule.column in node.virtual_columns.columns:
+      constants = node.virtual_columns.constants
+      codes = np.full(len(node.data), 0 if rule.column in constants else -1)
+      values = pd.Series([constants.get(rule.column, '')], dtype=object)
+   else:
+      return None
+
+   empty = (values == '').to_numpy()
+   if rule.rule == "required":
+      return (codes == -1) | np.isin(codes, np.flatnonzero(empty))
+   return np.isin(codes, np.flatnonzero(invalid_values(values, rule) & ~empty))
+
+
+def validate_node(df_node: pd.DataFrame | _node_io.NodeFrame, rules: list[ColumnRule], description: str, key_column: str = "*submitter_id") -> pd.DataFrame:
+   """
+   This function checks node data against the rules of its node schema, a whole column at a
+   time, and gives a report with one row per broken rule: the column, the rule, the number of
+   rows breaking it, and a sample of their submitter IDs.
+
+   Parameters
+   ----------
+   df_node : pd.DataFrame | _node_io.NodeFrame
+      The node data, as built by the node mappers or read as text
+   rules : list[ColumnRule]
+      The rules of the node schema, see _node_schemas
+   description : str
+      The description of the node used in the log messages
+   key_column : str
+      The column holding the submitter ID of each row
+
+   Return
+   ------
+   A pandas dataframe containing the violations report
+   """
+   node = _node_io.node_frame(df_node)
+   with _metrics.stage('validate', rows_in=len(node.data)) as stage:
+      violations = []
+      if key_column in node.data.columns:
+         submitter_ids = node.data[key_column].to_numpy()
+         for rule in rules:
+            flags = violating_rows(node, rule)
+            if flags is None or not flags.any():
+               continue
+            samples = submitter_ids[np.flatnonzero(flags)[:sample_size]]
+            violations.append((rule.column, rule.description(), int(flags.sum()), ','.join(str(sample) for sample in samples)))
+      df_report = pd.DataFrame(violations, columns=report_columns)
+      stage.rows_out = len(df_report)
+
+   if df_report.empty:
+      logger.info(f'The {description} passes the node schema rules')
+   else:
+      logger.warning(f'The {description} breaks {len(df_report)} node schema rules in {df_report["count"].sum()} values')
+   return df_report
+
+
+def combine_reports(df_reports: list[pd.DataFrame], rules: list[ColumnRule]) -> pd.DataFrame:
+   """
+   This function combines the violations reports of the batches of a node written one batch at
+   a time into the report of the whole node.  The counts are added up and the submitter ID
+   samples are taken from the first batches, so the report is the same as for the whole node.
+
+   Parameters
+   ----------
+   df_reports : list[pd.DataFrame]
+      The reports of the batches in the order they were written
+   rules : list[ColumnRule]
+      The rules of the node schema, which give the order of the report rows
+
+   Return
+   ------
+   A pandas dataframe containing the violations report of the node
+   """
+   df_violations = pd.concat([pd.DataFrame(columns=report_columns)] + df_reports, ignore_index=True)
+   violations = []
+   for rule in rules:
+      df_rule = df_violations[(df_violations["column"] == rule.column) & (df_violations["rule"] == rule.description())]
+      if df_rule.empty:
+         continue
+      samples = ','.join(df_rule["sample_submitter_ids"]).split(',')[:sample_size]
+      violations.append((rule.column, rule.description(), int(df_rule["count"].sum()), ','.join(samples)))
+   return pd.DataFrame(violations, columns=report_columns)
+
+
+def report_file_path(node_file_path: Path) -> Path:
+   """Give the full path to the violations report of a node file, for example case_obs_DCC_data_release_v2.0.0.validation.tsv."""
+   return Path(node_file_path.parent, node_file_path.name.removesuffix(_constants.__node_file_extension__) + _constants.__validation_report_file_extension__)
+
+
+def write_report(df_report: pd.DataFrame, node_file_path: Path, description: str) -> Path:
+   """
+   This function writes the violations report of a node file next to it.  A node without
+   violations gives a report with only the header.
+
+   Parameters
+   ----------
+   df_report : pd.DataFrame
+      The violations report, from validate_node or combine_reports
+   node_file_path : Path
+      The full path to the node TSV file
+   description : str
+      The description of the node used in the log messages
+
+   Return
+   ------
+   The full path to the report file
+   """
+   report_path = report_file_path(node_file_path)
+   _node_io.write_node_file(df_report, report_path, f'{description} validation report')
+   return report_path
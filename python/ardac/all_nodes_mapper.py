@@ -0,0 +1,279 @@
+import os
+import errno
+import argparse
+import logging
+import pandas as pd
+from pathlib import Path
+from . import _cli
+from . import _constants
+from . import _delta
+from . import _manifest
+from . import _mapping
+from . import _metrics
+from . import _node_io
+from . import _node_mappings
+from . import _node_schemas
+from . import _validation
+from . import audit_node_mapper
+from . import demographic_node_mapper
+from . import follow_up_node_mapper
+
+logger = logging.getLogger(__name__)
+
+
+def previous_release_run(command_arguments: argparse.Namespace, manifest: dict, manifest_file_name: str, dcc_paths: dict[str, Path], dcc_inputs: dict[str, pd.DataFrame]) -> dict | None:
+   """
+   This function checks that the node files of the previous release can be updated in delta
+   mode.  The previous DCC files must have the same names as the current ones, and the
+   previous node files must have been written by a run that differs from the current one only
+   by its DCC inputs and DCC release.  Subject IDs must be present and unique in the current
+   subjects file so that every node row belongs to exactly one subject, while subjects
+   repeated in the previous subjects file differ from their current rows and are mapped again.
+   Otherwise a warning is logged and the nodes are generated for every subject.
+
+   Parameters
+   ----------
+   command_arguments : argparse.Namespace
+      The command line arguments processed by argparse
+   manifest : dict
+      The manifest of the current run
+   manifest_file_name : str
+      The name of the manifest file of the current run
+   dcc_paths : dict[str, Path]
+      The current DCC files keyed by description
+   dcc_inputs : dict[str, pd.DataFrame]
+      The current DCC input data keyed by description
+
+   Return
+   ------
+   The manifest of the previous run when only the changed subjects need to be mapped,
+   otherwise None
+   """
+   previous_dcc_path = Path(command_arguments.previousDccPath)
+   previous_nodes_path = Path(command_arguments.previousNodesPath)
+   previous_dcc_paths = {description: Path(previous_dcc_path, dcc_path.name) for description, dcc_path in dcc_paths.items()}
+   for description, dcc_path in previous_dcc_paths.items():
+      if not dcc_path.is_file():
+         logger.critical(f'Cannot find previous DCC {description} file: ' + dcc_path.as_posix())
+         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), dcc_path.as_posix())
+
+   previous_manifest = None
+   if _delta.unique_subjects(dcc_inputs['subjects']):
+      previous_manifest = _delta.previous_run(previous_nodes_path, manifest_file_name, manifest, previous_dcc_paths)
+   else:
+      logger.warning('The current subjects file has missing or repeated subject IDs')
+   if previous_manifest is None:
+      logger.warning('Delta mode is not possible, generating the nodes for every subject')
+   return previous_manifest
+
+
+def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """
+   This function generates the ARDaC case, demographic, follow-up, and audit nodes and their
+   quality control files for the observational or clinical subjects in a single process.  Each
+   DCC CSV file and node template is read once, and the case node data is passed to the
+   demographic, follow-up, and audit node builders in memory.
+
+   Parameters
+   ----------
+   command_arguments : argparse.Namespace
+      The command line arguments processed by argparse
+   logger : logging.Logger
+      The logger to be used to provide user feedback
+   """
+   _node_io.set_io_engine(command_arguments.ioEngine)
+   _node_io.set_arrow_strings(command_arguments.arrowStrings)
+
+   templates_path = Path(command_arguments.nodeTemplatesPath)
+   node_output_path = Path(command_arguments.nodeOutputPath)
+   template_paths = {
+      'case': Path(templates_path, _constants.case_template_file_name),
+      'demographic': Path(templates_path, _constants.demographic_template_file_name),
+      'follow-up': Path(templates_path, _constants.follow_up_template_file_name),
+      'audit': Path(templates_path, _constants.audit_template_file_name),
+   }
+   dcc_paths = {
+      'subjects': Path(command_arguments.dccSubjectsFile),
+      'liver scores': Path(command_arguments.dccLiverScoresFile),
+      'vitals': Path(command_arguments.dccVitalsFile),
+      'SOC': Path(command_arguments.dccSOCFile),
+      'audit': Path(command_arguments.dccAuditFile),
+   }
+   # The clinical medical information is not mapped yet
+   if command_arguments.subjectsType == 'observational':
+      dcc_paths['medical information'] = Path(command_arguments.dccMedInfoFile)
+   dcc_columns = {
+      'subjects': _node_mappings.all_nodes_obs_subjects_columns if command_arguments.subjectsType == 'observational' else _node_mappings.all_nodes_rct_subjects_columns,
+      'liver scores': _node_mappings.liver_scores_columns,
+      'vitals': _node_mappings.vitals_columns,
+      'SOC': _node_mappings.soc_columns,
+      'audit': _node_mappings.audit_columns,
+      'medical information': _node_mappings.med_info_columns,
+   }
+   dcc_optional_columns = {
+      'subjects': _node_mappings.all_nodes_obs_subjects_optional_columns if command_arguments.subjectsType == 'observational' else _node_mappings.all_nodes_rct_subjects_optional_columns,
+      'liver scores': _node_mappings.liver_scores_optional_columns,
+      'vitals': _node_mappings.vitals_optional_columns,
+      'SOC': _node_mappings.soc_optional_columns,
+      'audit': _node_mappings.audit_optional_columns,
+      'medical information': _node_mappings.med_info_optional_columns,
+   }
+
+   for node_name, template_path in template_paths.items():
+      if not template_path.is_file():
+         logger.critical(f'Cannot find {node_name} template file: ' + template_path.as_posix())
+         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), template_path.as_posix())
+
+   for description, dcc_path in dcc_paths.items():
+      if not dcc_path.is_file():
+         logger.critical(f'Cannot find DCC {description} file: ' + dcc_path.as_posix())
+         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), dcc_path.as_posix())
+
+   if not node_output_path.is_dir():
+      logger.critical('Cannot find node output directory: ' + node_output_path.as_posix())
+      raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), node_output_path.as_posix())
+
+   if (command_arguments.previousDccPath is None) != (command_arguments.previousNodesPath is None):
+      raise ValueError('The previous DCC path and the previous nodes path must be given together')
+
+   if command_arguments.subjectsType == 'observational':
+      subjects_label = 'Observational'
+      case_plan = _node_mappings.case_obs_plan
+      case_file_name = _constants.case_obs_file_name
+      case_sidecar_file_name = _constants.case_obs_sidecar_file_name
+      manifest_file_name = _constants.all_nodes_obs_manifest_file_name
+      demographic_file_name = _constants.demographic_obs_file_name
+      follow_up_file_name = _constants.follow_up_obs_file_name
+      follow_up_qc_file_name = _constants.follow_up_qc_obs_file_name
+      audit_file_name = _constants.audit_obs_file_name
+      audit_qc_file_name = _constants.audit_obs_unmatched_file_name
+   elif command_arguments.subjectsType == 'clinical':
+      subjects_label = 'Clinical'
+      case_plan = _node_mappings.case_rct_plan
+      case_file_name = _constants.case_rct_file_name
+      case_sidecar_file_name = _constants.case_rct_sidecar_file_name
+      manifest_file_name = _constants.all_nodes_rct_manifest_file_name
+      demographic_file_name = _constants.demographic_rct_file_name
+      follow_up_file_name = _constants.follow_up_rct_file_name
+      follow_up_qc_file_name = _constants.follow_up_qc_rct_file_name
+      audit_file_name = _constants.audit_rct_file_name
+      audit_qc_file_name = _constants.audit_rct_unmatched_file_name
+   else:
+      raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
+
+   # Skip the run when the node files of a previous run with the same inputs are up to date
+   manifest_path = Path(node_output_path, manifest_file_name)
+   manifest = _manifest.build_manifest(Path(__file__), command_arguments.subjectsType, dcc_paths, template_paths, {'validate': command_arguments.validate})
+   if not command_arguments.force and _manifest.is_cached(manifest_path, manifest, node_output_path):
+      logger.info(f'cached: the {subjects_label.lower()} nodes are up to date, use --force to regenerate them')
+      _metrics.record_cached()
+      return 0
+
+   # Read the node templates and the mapped columns of every DCC file once
+   template_headers = {node_name: _node_io.read_template_headers(template_path) for node_name, template_path in template_paths.items()}
+   dcc_inputs = {description: _node_io.read_dcc_file(dcc_path, dcc_columns[description], f'{subjects_label.lower()} {description}',
+                                                     dcc_optional_columns[description])
+                 for description, dcc_path in dcc_paths.items()}
+
+   # In delta mode only the subjects that changed since the previous release are mapped
+   node_inputs = dcc_inputs
+   previous_manifest = None
+   if command_arguments.previousDccPath is not None:
+      previous_manifest = previous_release_run(command_arguments, manifest, manifest_file_name, dcc_paths, dcc_inputs)
+   if previous_manifest is not None:
+      previous_dcc_paths = {description: Path(command_arguments.previousDccPath, dcc_path.name) for description, dcc_path in dcc_paths.items()}
+      previous_inputs = {description: _node_io.read_dcc_file(previous_dcc_path, dcc_columns[description], f'previous {subjects_label.lower()} {description}',
+                                                             dcc_optional_columns[description])
+                         for description, previous_dcc_path in previous_dcc_paths.items()}
+      changed = _delta.changed_subjects(previous_inputs, dcc_inputs)
+      logger.info(f'Delta mode: {len(changed)} subjects changed since the previous release')
+      node_inputs = {description: _delta.subject_rows(df_input, changed) for description, df_input in dcc_inputs.items()}
+
+   logger.info(f'Transforming DCC {subjects_label.lower()} subject data to ARDaC case node')
+   case_node = _mapping.build_node(case_plan, node_inputs['subjects'], template_headers['case'])
+
+   logger.info(f'Transforming {subjects_label.lower()} subject data to ARDaC demographic node')
+   demographic_node = demographic_node_mapper.build_demographic_node(node_inputs['subjects'], case_node.data, template_headers['demographic'])
+
+   logger.info(f'Extracting {subjects_label.lower()} follow-up data and creating ARDaC follow-up node')
+   if command_arguments.subjectsType == 'observational':
+      follow_up_node, df_follow_up_qc = follow_up_node_mapper.build_observational_follow_up_node(
+         node_inputs['liver scores'], node_inputs['medical information'], node_inputs['vitals'], node_inputs['SOC'],
+         case_node.data, template_headers['follow-up'])
+   else:
+      follow_up_node, df_follow_up_qc = follow_up_node_mapper.build_clinical_follow_up_node(
+         node_inputs['liver scores'], node_inputs['vitals'], node_inputs['SOC'], case_node.data, template_headers['follow-up'])
+
+   logger.info(f'Transforming {subjects_label.lower()} audit data')
+   audit_node, df_audit_unmatched = audit_node_mapper.build_audit_node(node_inputs['audit'], case_node.data, template_headers['audit'])
+
+   # The node and QC files with their description and the column identifying the subject of each row
+   outputs = {
+      case_file_name: (case_node, f'{subjects_label} case node', "*submitter_id"),
+      demographic_file_name: (demographic_node, f'{subjects_label} demographic node', "*cases.submitter_id"),
+      follow_up_file_name: (follow_up_node, f'{subjects_label} follow-up node', "cases.submitter_id"),
+      follow_up_qc_file_name: (df_follow_up_qc, f'{subjects_label} follow-up QC file', "usubjid"),
+      audit_file_name: (audit_node, f'{subjects_label} audit node', "cases.submitter_id"),
+      audit_qc_file_name: (df_audit_unmatched, f'{subjects_label} audit QC file', "usubjid"),
+   }
+   if previous_manifest is not None:
+      # Every previous file is read before any file is written, so the previous and current node directories may be the same
+      subject_ids = dcc_inputs['subjects']["usubjid"].astype(object)
+      subject_order = pd.Series(range(len(subject_ids)), index=subject_ids.to_numpy())
+      for file_name, (df_output, description, key_column) in outputs.items():
+         df_previous = _delta.read_previous_node(Path(command_arguments.previousNodesPath, _delta.previous_file_name(file_name, previous_manifest)), description)
+         df_changed = _node_io.expand_virtual_columns(df_output)
+         outputs[file_name] = (_delta.splice_node(df_previous, df_changed, key_column, changed, subject_order), description, key_column)
+
+   for file_name, (df_output, description, _) in outputs.items():
+      _node_io.write_node_file(df_output, Path(node_output_path, file_name), description)
+   _node_io.write_case_sidecar(_node_io.node_frame(outputs[case_file_name][0]).data, Path(node_output_path, case_sidecar_file_name), Path(node_output_path, case_file_name))
+
+   output_file_names = [case_file_name, case_sidecar_file_name, demographic_file_name, follow_up_file_name, follow_up_qc_file_name, audit_file_name, audit_qc_file_name]
+   output_paths = [Path(node_output_path, file_name) for file_name in output_file_names]
+   if command_arguments.validate:
+      node_rules = {case_file_name: _node_schemas.case_rules, demographic_file_name: _node_schemas.demographic_rules,
+                    follow_up_file_name: _node_schemas.follow_up_rules, audit_file_name: _node_schemas.audit_rules}
+      for file_name, rules in node_rules.items():
+         df_output, description, _ = outputs[file_name]
+         df_report = _validation.validate_node(df_output, rules, description.lower())
+         output_paths.append(_validation.write_report(df_report, Path(node_output_path, file_name), description))
+   _manifest.write_manifest(manifest_path, manifest, output_paths)
+
+   return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of this utility."""
+   parser = argparse.ArgumentParser(
+      prog=Path(__file__).name,
+      description='''This utility generates the ARDaC case, demographic, follow-up, and audit nodes and their quality control files from observational
+         or clinical trial DCC data provided in CSV format files, in a single process.  Each DCC file is read once, and the case node is passed to the
+         other node mappers in memory.  The user must provide the location of the ARDaC node template files, the CSV files containing the DCC data,
+         and the path to where the ARDaC node and quality control files are to be written.''',
+      epilog=f'''The node and quality control files have the same names as those written by case_node_mapper.py, demographic_node_mapper.py,
+         follow_up_node_mapper.py, and audit_node_mapper.py, for example \'{_constants.case_obs_file_name}\' and \'{_constants.case_rct_file_name}\'.
+         All files are written to the directory given by the --node_output_path argument.''')
+   _cli.add_common_arguments(parser, io_engines=_node_io.io_engines, force=True,
+                             validate_help=f'Check the case, demographic, follow-up, and audit nodes against the type and enum rules of their ARDaC node schemas, and save a report of the violations next to each node file, named for example {_validation.report_file_path(Path(_constants.case_obs_file_name)).name}',
+                             metrics_stages='read, template-load, transform, QC, validate, and write', node_templates=True, subjects_type=True)
+   parser.add_argument('--dcc_subjects_file', dest='dccSubjectsFile', required=True, help='Full path to the DCC input subjects file in CSV format')
+   parser.add_argument('--dcc_liver_scores_file', dest='dccLiverScoresFile', required=True, help='Full path to the DCC input liver scores file in CSV format')
+   parser.add_argument('--dcc_med_info_file', dest='dccMedInfoFile', required=True, help='Full path to the DCC input medical information file in CSV format, only read for observational subjects')
+   parser.add_argument('--dcc_vitals_file', dest='dccVitalsFile', required=True, help='Full path to the DCC input vitals file in CSV format')
+   parser.add_argument('--dcc_soc_file', dest='dccSOCFile', required=True, help='Full path to the DCC input SOC file in CSV format')
+   parser.add_argument('--dcc_audit_file', dest='dccAuditFile', required=True, help='Full path to the DCC input audit file in CSV format')
+   parser.add_argument('--node_output_path', dest='nodeOutputPath', required=True, help='Path to the directory where the TSV node and quality control files are to be saved')
+   parser.add_argument('--previous_dcc_path', dest='previousDccPath', help='Path to the directory holding the DCC files of the previous release, with the same names as the current DCC files.  Enables delta mode, where only the subjects whose DCC data changed are mapped again')
+   parser.add_argument('--previous_nodes_path', dest='previousNodesPath', help='Path to the directory holding the node files and manifest written by this utility for the previous release, required with --previous_dcc_path.  May be the same as --node_output_path')
+
+   return parser
+
+
+def run(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """Run this utility with its parsed command line arguments and give the exit status, see _cli.run_main."""
+   return _cli.run_main(main, command_arguments, logger, Path(__file__).name, {'io_engine': command_arguments.ioEngine, 'arrow_strings': command_arguments.arrowStrings})
+
+
+if __name__ == '__main__':
+   exit(_cli.run_script(build_parser(), run))
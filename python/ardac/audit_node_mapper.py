@@ -1,13 +1,80 @@
 import os
-import sys
 import errno
 import argparse
 import logging
 import pandas as pd
 from pathlib import Path
-import _constants
+from . import _cli
+from . import _constants
+from . import _manifest
+from . import _mapping
+from . import _metrics
+from . import _node_io
+from . import _node_mappings
+from . import _node_schemas
+from . import _validation
 
-def generate_observational_audit_node(obs_audit_path: Path, obs_case_path: Path, template_headers: list[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
+logger = logging.getLogger(__name__)
+
+
+def build_audit_node(df_audit_input: pd.DataFrame, df_case_input: pd.DataFrame, template_headers: list[str]) -> tuple[_node_io.NodeFrame, pd.DataFrame]:
+   """
+   This function joins the DCC audit data to the ARDaC case node data on the subject ID
+   and produces the ARDaC audit node data for the cases that have audit data, along with
+   the subject IDs of the cases that have no audit data.  When a subject has more than
+   one audit record, the first record is used.
+
+   Parameters
+   ----------
+   df_audit_input : pd.DataFrame
+      The DCC audit data
+   df_case_input : pd.DataFrame
+      The ARDaC case node data generated by case_node_mapper.py
+   template_headers : list[str]
+      The header names extracted from the ARDaC audit node template
+
+   Return
+   ------
+   audit_node : _node_io.NodeFrame
+      The audit node data with its virtual columns
+   df_unmatched : pd.DataFrame
+      The subject IDs of the case node data that could not be matched to any
+      audit data
+   """
+   with _metrics.stage('transform', rows_in=len(df_audit_input)) as stage:
+      # Step 1: Extract "*submitter_id" from the case data and create case_table
+      case_table = pd.DataFrame()
+      case_table["*submitter_id"] = df_case_input["*submitter_id"]
+      if "usubjid" in df_case_input.columns:
+         case_table["usubjid"] = df_case_input["usubjid"]  # Precomputed in the case node sidecar file
+      else:
+         case_table["usubjid"] = _node_io.case_subject_ids(case_table["*submitter_id"])  # Extract the number before "_"
+
+      # Step 2: Keep the first audit record of each subject and join its mapped fields to case_table
+      audit_columns = [column for column in _node_mappings.audit_plan.source_columns
+                       if column in df_audit_input.columns and column not in case_table.columns]
+      df_audit_first = df_audit_input.dropna(subset=["usubjid"]).drop_duplicates(subset="usubjid", keep="first")
+      df_joined = case_table.merge(df_audit_first[["usubjid"] + audit_columns], on="usubjid", how="left", indicator=True)
+      df_joined.index = case_table.index
+      matched = df_joined["_merge"] == "both"
+
+      # Step 3: Map the matched cases to the audit node
+      audit_node = _mapping.build_node(_node_mappings.audit_plan, df_joined[matched], template_headers)
+      stage.rows_out = len(audit_node.data)
+
+   with _metrics.stage('QC', rows_in=len(df_joined)) as stage:
+      # Step 4: QC Create a DataFrame for unmatched records
+      df_unmatched = df_joined.loc[~matched, ["usubjid", "*submitter_id"]].reset_index(drop=True)
+      df_unmatched["missing_audit"] = pd.Series("Y", index=df_unmatched.index, dtype=_node_io.string_dtype())
+      if df_unmatched.empty:
+         # No columns, so the QC file is written without a header as before
+         df_unmatched = pd.DataFrame()
+      stage.rows_out = len(df_unmatched)
+
+   return audit_node, df_unmatched
+
+
+def generate_observational_audit_node(obs_audit_path: Path, obs_case_path: Path, template_headers: list[str]) -> tuple[_node_io.NodeFrame, pd.DataFrame]:
    """
    This function takes the path to the DCC observational audit file, the ARDaC observational case node file,
    and the ARDaC audit node headers and produces the ARDaC audit node data for audit data that matches
@@ -25,74 +92,23 @@ def generate_observational_audit_node(obs_audit_path: Path, obs_case_path: Path,
 
    Return
    ------
-   df_obs_output : pd.DataFrame
-      The observational audit node data
+   df_obs_output : _node_io.NodeFrame
+      The observational audit node data with its virtual columns
    df_unmatched_obs : pd.DataFrame
       The subject IDs of the observational audit data that could not be matched to any
       case node data
    """
    # Read the file using pandas
-   logger.info(f'Reading the observational audit file: {obs_audit_path.as_posix()}')
-   df_obs_audit_input = pd.read_csv(obs_audit_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading observational audit file')
-
-   logger.info(f'Reading the observational ARDaC case file: {obs_case_path.as_posix()}')
-   df_obs_case_input = pd.read_csv(obs_case_path.as_posix(), sep='\t', dtype=str)
-   logger.info(f'Done reading observational case file')
-
-   # Step 1: Extract "*submitter_id" from df_obs_case and create case_table
-   case_table = pd.DataFrame()
-   case_table["*submitter_id"] = df_obs_case_input["*submitter_id"]
-   case_table["usubjid"] = case_table["*submitter_id"].apply(lambda x: x.split("_")[0])  # Extract the number before "_"
-   df_obs_output = pd.DataFrame(index=case_table.index, columns=template_headers)
-
-   # Initialize a list to store unmatched records
-   unmatched_records_obs = []
-
-   # Step 2: Iterate through case_table and map values to df_obs_output
-   for _, row in case_table.iterrows():
-      submitter_id = row["*submitter_id"]
-      usubjid = row["usubjid"]
-
-      # Find the corresponding record in df_obs_input
-      input_row = df_obs_audit_input[df_obs_audit_input["usubjid"] == usubjid]
-    
-      if not input_row.empty:
-         input_row = input_row.iloc[0]  # Extract the first matching row
-         # Populate df_obs_output
-         df_obs_output.loc[:, "*type"] = "audit"
-         df_obs_output.loc[:, "project_id"] = "ARDaC-AlcHepNet"
-         df_obs_output.loc[_, "*submitter_id"] = f"{submitter_id}_audit"
-         df_obs_output.loc[_, "cases.submitter_id"] = f"{submitter_id}"
-        
-         df_obs_output.loc[_, "auditnd"] = input_row.get("auditnd", None)
-         df_obs_output.loc[_, "adt0101"] = input_row.get("adt0101", None)
-         df_obs_output.loc[_, "adt0102"] = input_row.get("adt0102", None)
-         df_obs_output.loc[_, "adt0103"] = input_row.get("adt0103", None)
-         df_obs_output.loc[_, "adt0104"] = input_row.get("adt0104", None)
-         df_obs_output.loc[_, "adt0105"] = input_row.get("adt0105", None)
-         df_obs_output.loc[_, "adt0106"] = input_row.get("adt0106", None)
-         df_obs_output.loc[_, "adt0107"] = input_row.get("adt0107", None)
-         df_obs_output.loc[_, "adt0108"] = input_row.get("adt0108", None)
-         df_obs_output.loc[_, "adt0109"] = input_row.get("adt0109", None)
-         df_obs_output.loc[_, "adt0110"] = input_row.get("adt0110", None)
-      else:
-         # Add unmatched record to the list
-         unmatched_records_obs.append({
-            "usubjid": usubjid,
-            "*submitter_id": submitter_id,
-            "missing_audit": "Y"
-         })
-         # Remove the unmatched row from df_rct_output
-         df_obs_output.drop(_, inplace=True)
-        
-   # Step 3: QC Create a DataFrame for unmatched records
-   df_unmatched_obs = pd.DataFrame(unmatched_records_obs)
+   df_obs_audit_input = _node_io.read_dcc_file(obs_audit_path, _node_mappings.audit_columns, 'observational audit',
+                                               _node_mappings.audit_optional_columns)
+   df_obs_case_input = _node_io.read_case_node(obs_case_path, 'observational case')
+
+   df_obs_output, df_unmatched_obs = build_audit_node(df_obs_audit_input, df_obs_case_input, template_headers)
 
    return df_obs_output, df_unmatched_obs
 
 
-def generate_clinical_audit_node(rct_audit_path: Path, rct_case_path: Path, template_headers: list[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
+def generate_clinical_audit_node(rct_audit_path: Path, rct_case_path: Path, template_headers: list[str]) -> tuple[_node_io.NodeFrame, pd.DataFrame]:
    """
    This function takes the path to the DCC clinical audit file, the ARDaC clinical case node file,
    and the ARDaC audit node headers to produce the ARDaC audit node data for audit data that matches
@@ -110,69 +126,18 @@ def generate_clinical_audit_node(rct_audit_path: Path, rct_case_path: Path, temp
 
    Return
    ------
-   df_rct_output : pd.DataFrame
-      The clinical audit node data
+   df_rct_output : _node_io.NodeFrame
+      The clinical audit node data with its virtual columns
    df_unmatched_rct : pd.DataFrame
       The subject IDs of the clinical audit data that could not be matched to any
       case node data
    """
    # Read the file using pandas
-   logger.info(f'Reading the clinical audit file: {rct_audit_path.as_posix()}')
-   df_rct_audit_input = pd.read_csv(rct_audit_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading clinical audit file')
-
-   logger.info(f'Reading the observational ARDaC case file: {rct_case_path.as_posix()}')
-   df_rct_case_input = pd.read_csv(rct_case_path.as_posix(), sep='\t', dtype=str)
-   logger.info(f'Done reading clinical case file')
-
-   # Step 1: Extract "*submitter_id" from df_rct_case and create case_table
-   case_table = pd.DataFrame()
-   case_table["*submitter_id"] = df_rct_case_input["*submitter_id"]
-   case_table["usubjid"] = case_table["*submitter_id"].apply(lambda x: x.split("_")[0])  # Extract the number before "_"
-   df_rct_output = pd.DataFrame(index=case_table.index, columns=template_headers)
-
-   # Initialize a list to store unmatched records
-   unmatched_records_rct = []
-
-   # Step 2: Iterate through case_table and map values to df_rct_output
-   for _, row in case_table.iterrows():
-      submitter_id = row["*submitter_id"]
-      usubjid = row["usubjid"]
-
-      # Find the corresponding record in df_rct_input
-      input_row = df_rct_audit_input[df_rct_audit_input["usubjid"] == usubjid]
-    
-      if not input_row.empty:
-         input_row = input_row.iloc[0]  # Extract the first matching row
-         # Populate df_rct_output
-         df_rct_output.loc[:, "*type"] = "audit"
-         df_rct_output.loc[:, "project_id"] = "ARDaC-AlcHepNet"
-         df_rct_output.loc[_, "*submitter_id"] = f"{submitter_id}_audit"
-         df_rct_output.loc[_, "cases.submitter_id"] = f"{submitter_id}"
-        
-         df_rct_output.loc[_, "auditnd"] = input_row.get("auditnd", None)
-         df_rct_output.loc[_, "adt0101"] = input_row.get("adt0101", None)
-         df_rct_output.loc[_, "adt0102"] = input_row.get("adt0102", None)
-         df_rct_output.loc[_, "adt0103"] = input_row.get("adt0103", None)
-         df_rct_output.loc[_, "adt0104"] = input_row.get("adt0104", None)
-         df_rct_output.loc[_, "adt0105"] = input_row.get("adt0105", None)
-         df_rct_output.loc[_, "adt0106"] = input_row.get("adt0106", None)
-         df_rct_output.loc[_, "adt0107"] = input_row.get("adt0107", None)
-         df_rct_output.loc[_, "adt0108"] = input_row.get("adt0108", None)
-         df_rct_output.loc[_, "adt0109"] = input_row.get("adt0109", None)
-         df_rct_output.loc[_, "adt0110"] = input_row.get("adt0110", None)
-      else:
-         # Add unmatched record to the list
-         unmatched_records_rct.append({
-            "usubjid": usubjid,
-            "*submitter_id": submitter_id,
-            "missing_audit": "Y"
-         })
-         # Remove the unmatched row from df_rct_output
-         df_rct_output.drop(_, inplace=True)
-     
-   # Step 3: QC Create a DataFrame for unmatched records
-   df_unmatched_rct = pd.DataFrame(unmatched_records_rct)
+   df_rct_audit_input = _node_io.read_dcc_file(rct_audit_path, _node_mappings.audit_columns, 'clinical audit',
+                                               _node_mappings.audit_optional_columns)
+   df_rct_case_input = _node_io.read_case_node(rct_case_path, 'clinical case')
+
+   df_rct_output, df_unmatched_rct = build_audit_node(df_rct_audit_input, df_rct_case_input, template_headers)
 
    return df_rct_output, df_unmatched_rct
 
@@ -192,6 +157,9 @@ def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
    logger : logging.Logger
       The logger to be used to provide user feedback
    """
+   _node_io.set_io_engine(command_arguments.ioEngine)
+   _node_io.set_arrow_strings(command_arguments.arrowStrings)
+
    template_path = Path(command_arguments.nodeTemplatesPath, _constants.audit_template_file_name)
    dcc_audit_path = Path(command_arguments.dccAuditFile)
    node_output_path = Path(command_arguments.nodeOutputPath)
@@ -210,47 +178,69 @@ def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
    
    if command_arguments.subjectsType == 'observational':
       case_file_path = Path(node_output_path, _constants.case_obs_file_name)
+      manifest_path = Path(node_output_path, _constants.audit_obs_manifest_file_name)
    elif command_arguments.subjectsType == 'clinical':
       case_file_path = Path(node_output_path, _constants.case_rct_file_name)
+      manifest_path = Path(node_output_path, _constants.audit_rct_manifest_file_name)
    else:
       raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
 
+   if command_arguments.caseNodeFile is not None:
+      case_file_path = Path(command_arguments.caseNodeFile)
+
    if not case_file_path.is_file():
       logger.critical('Cannot find ARDaC case file: ' + case_file_path.as_posix())
       raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), case_file_path.as_posix())
 
+   # Skip the run when the node files of a previous run with the same inputs are up to date
+   manifest = _manifest.build_manifest(Path(__file__), command_arguments.subjectsType, {'audit': dcc_audit_path, 'case': case_file_path}, {'audit': template_path}, {'validate': command_arguments.validate})
+   if not command_arguments.force and _manifest.is_cached(manifest_path, manifest, node_output_path):
+      logger.info(f'cached: the {command_arguments.subjectsType} audit node is up to date, use --force to regenerate it')
+      _metrics.record_cached()
+      return 0
+
    # Read the template TSV file to extract the headers
-   logger.info(f'Reading audit template CSV file: {template_path.as_posix()}')
-   df_template = pd.read_csv(template_path.as_posix(), sep='\t', nrows=0)  # Read only the header
-   template_headers = df_template.columns.tolist()  # Extract the headers as a list
+   template_headers = _node_io.read_template_headers(template_path)
 
+   df_report = None
    if command_arguments.subjectsType == 'observational':
       logger.info('Transforming observational audit data')
       node_file_path = Path(node_output_path, _constants.audit_obs_file_name)
       node_file_unmatched_path = Path(node_output_path, _constants.audit_obs_unmatched_file_name)
       df_obs_output, df_unmatched_obs = generate_observational_audit_node(dcc_audit_path, case_file_path, template_headers)
-      df_obs_output.to_csv(node_file_path.as_posix(), sep='\t', index=False, header=True)
+      _node_io.write_tsv(df_obs_output, node_file_path)
       logger.info(f'Observational audit node saved as: {node_file_path.as_posix()}')
-      df_unmatched_obs.to_csv(node_file_unmatched_path, sep='\t', index=False)
+      if command_arguments.validate:
+         df_report = _validation.validate_node(df_obs_output, _node_schemas.audit_rules, 'observational audit node')
+      _node_io.write_tsv(df_unmatched_obs, node_file_unmatched_path)
       logger.info(f'Observational QC file saved as: {node_file_unmatched_path.as_posix()}')
    elif command_arguments.subjectsType == 'clinical':
       logger.info('Transforming clinical audit data')
       node_file_path = Path(node_output_path, _constants.audit_rct_file_name)
       node_file_unmatched_path = Path(node_output_path, _constants.audit_rct_unmatched_file_name)
       df_rct_output, df_unmatched_rct = generate_clinical_audit_node(dcc_audit_path, case_file_path, template_headers)
-      df_rct_output.to_csv(node_file_path.as_posix(), sep='\t', index=False, header=True)
+      _node_io.write_tsv(df_rct_output, node_file_path)
       logger.info(f'Clinical audit node saved as: {node_file_path.as_posix()}')
-      df_unmatched_rct.to_csv(node_file_unmatched_path.as_posix(), sep='\t', index=False)
+      if command_arguments.validate:
+         df_report = _validation.validate_node(df_rct_output, _node_schemas.audit_rules, 'clinical audit node')
+      _node_io.write_tsv(df_unmatched_rct, node_file_unmatched_path)
       logger.info(f'Clinical QC file saved as: {node_file_unmatched_path.as_posix()}')
    else:
       raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
+
+   output_paths = [node_file_path, node_file_unmatched_path]
+   if command_arguments.validate:
+      output_paths.append(_validation.write_report(df_report, node_file_path, f'{command_arguments.subjectsType.capitalize()} audit node'))
+
+   _manifest.write_manifest(manifest_path, manifest, output_paths)
    
    return 0
 
 
-if __name__ == '__main__':
-   status = 0
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of this utility."""
    parser = argparse.ArgumentParser(
+      prog=Path(__file__).name,
       description='''This utility generates ARDaC audit nodes from observational or clinical trial DCC audit files and ARDaC case node files.
          The DCC audit files are provided in CSV format, and the ARDaC case node files are provided in ARDaC node TSV format.
          The user must provide the location of the ARDaC audit node template file, the CSV file containing the DCC audit data,
@@ -258,43 +248,22 @@ if __name__ == '__main__':
       epilog=f'''Observational audit node files are named \'{_constants.audit_obs_file_name}\', and observational QC files are named \'{_constants.audit_obs_unmatched_file_name}\'.
          Clinical audit node files are named \'{_constants.audit_rct_file_name}\', and clinical QC files are named \'{_constants.audit_rct_unmatched_file_name}\'.  Audit node files are written to the directory given by the --node_output_path argument.
          The ARDaC case node input TSV file is also expected to be at this location''')
-   valid_log_level_names_mapping = logging.getLevelNamesMapping()
-   valid_log_level_names_mapping.pop('NOTSET') # Remove NOTSET option value
-   parser.add_argument('--version', action='version', version=f'DCC_VERSION={_constants.dcc_release_string},MAPPING_VERSION={_constants.mapping_version_string}')
-   parser.add_argument('--dcc_version', action='version', version=f'{_constants.dcc_release_string}')
-   parser.add_argument('--mapping_version', action='version', version=f'{_constants.mapping_version_string}')
-   parser.add_argument('--log_level', dest='logLevel', default='INFO', choices=list(valid_log_level_names_mapping.keys()), help='A standard log level from the Python logger package')
-   parser.add_argument('--node_templates_path', dest='nodeTemplatesPath', required=True, help='Path to the directory where the ARDaC node template TSV files are located')
-   parser.add_argument('--subjects_type', dest='subjectsType', required=True, choices=['observational', 'clinical'], help='Value indicating if the input subject data is from clinical trial subjects or observational study subjects')
+   _cli.add_common_arguments(parser, io_engines=_node_io.io_engines, force=True,
+                             validate_help=f'Check the audit node against the type and enum rules of the ARDaC audit node schema, and save a report of the violations next to the node file, named for example {_validation.report_file_path(Path(_constants.audit_obs_file_name)).name}',
+                             metrics_stages='read, template-load, transform, QC, validate, and write', node_templates=True, subjects_type=True)
    parser.add_argument('--dcc_audit_file', dest='dccAuditFile', required=True, help='Full path to the DCC input audit file in CSV format')
    parser.add_argument('--node_output_path', dest='nodeOutputPath', required=True, help=f'''Path to the directory where the TSV audit node file is to be saved
                        -- the file name will be either {_constants.audit_obs_file_name} or {_constants.audit_rct_file_name}.
-                       This argument is also the expected location of the input ARDaC case node TSV file.''')
+                       This argument is also the expected location of the input ARDaC case node TSV file, unless --case_node_file is given.''')
+   parser.add_argument('--case_node_file', dest='caseNodeFile', default=None, help='Full path to the input ARDaC case node TSV file, with its Arrow IPC sidecar file next to it when there is one.  By default the case node file is read from the --node_output_path directory')
 
-   parsed_args = parser.parse_args()
-   
-   # Configure and create logger for standard output
-   console_handler = logging.StreamHandler(sys.stdout)
-   console_handler.setLevel(parsed_args.logLevel)
-   console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-
-   logging.basicConfig(
-      level = parsed_args.logLevel,
-      handlers = [console_handler]
-   )
-
-   logger = logging.getLogger(parser.prog)
-   logger.setLevel(parsed_args.logLevel)
-
-   try:
-      # Status codes greater than zero and less than three are reserved for command line processing errors
-      status = 3
-      status = main(parsed_args, logger)
-   except FileNotFoundError as e:
-      logger.critical(f'Input file not found: {e}')
-   except ValueError as e:
-      logger.critical(f'Command line argument or parameter had a bad value: {e}')
-   except Exception as e:
-      logger.critical('Caught an exception', exc_info=True)
-   
-   exit(status)
\ No newline at end of file
+   return parser
+
+
+def run(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """Run this utility with its parsed command line arguments and give the exit status, see _cli.run_main."""
+   return _cli.run_main(main, command_arguments, logger, Path(__file__).name, {'io_engine': command_arguments.ioEngine, 'arrow_strings': command_arguments.arrowStrings})
+
+
+if __name__ == '__main__':
+   exit(_cli.run_script(build_parser(), run))
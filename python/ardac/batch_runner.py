@@ -0,0 +1,210 @@
+import os
+import csv
+import json
+import time
+import errno
+import argparse
+import logging
+import importlib
+from pathlib import Path
+from . import _cli
+
+logger = logging.getLogger(__name__)
+
+# The scripts that can be run as jobs, keyed by the mapper name given in the job manifest.
+# They are imported when their first job runs, so version queries do not import pandas.
+batch_mappers = {
+   "case": "case_node_mapper",
+   "demographic": "demographic_node_mapper",
+   "follow-up": "follow_up_node_mapper",
+   "audit": "audit_node_mapper",
+   "all_nodes": "all_nodes_mapper",
+   "scatter": "scatter_dcc",
+   "gather": "gather_nodes",
+}
+
+# The fields of the job status report
+status_fields = ["job", "mapper", "subjects_type", "status", "exit_status", "wall_seconds"]
+
+
+def read_jobs(jobs_path: Path) -> list[dict]:
+   """
+   This function reads a job manifest.  A JSON manifest holds a list of job objects, and a
+   TSV manifest has a header row and one job per row.  Each job has a mapper field and one
+   field per command line argument of the mapper, named as the argument without the leading
+   dashes, for example subjects_type or node_output_path.  In a TSV manifest, empty fields
+   are left out of the arguments of the job.
+
+   Parameters
+   ----------
+   jobs_path : Path
+      The full path to the JSON or TSV job manifest
+
+   Return
+   ------
+   The jobs in manifest order
+   """
+   if jobs_path.suffix == '.json':
+      try:
+         jobs = json.loads(jobs_path.read_text())
+      except json.JSONDecodeError as e:
+         raise ValueError(f'The job manifest {jobs_path.as_posix()} is not valid JSON: {e}')
+      if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+         raise ValueError(f'The JSON job manifest {jobs_path.as_posix()} must hold a list of job objects')
+   else:
+      with jobs_path.open(newline='') as jobs_file:
+         jobs = [{field: value for field, value in row.items() if value} for row in csv.DictReader(jobs_file, delimiter='\t')]
+
+   for job_number, job in enumerate(jobs, start=1):
+      if "mapper" not in job:
+         raise ValueError(f'Job {job_number} of the job manifest {jobs_path.as_posix()} has no mapper field')
+   return jobs
+
+
+def job_arguments(job: dict) -> list[str]:
+   """
+   This function gives the command line arguments of a job.  A true or "true" value gives a
+   flag argument, a false, "false", or null value leaves the argument out, and a list gives
+   an argument with several values.
+   """
+   arguments = []
+   for field, value in job.items():
+      if field == "mapper" or value is None or value is False or value == "false":
+         continue
+      if value is True or value == "true":
+         arguments.append(f'--{field}')
+      elif isinstance(value, list):
+         arguments += [f'--{field}'] + [str(item) for item in value]
+      else:
+         arguments += [f'--{field}', str(value)]
+   return arguments
+
+
+def run_job(job: dict) -> int:
+   """
+   This function runs one job in this interpreter with the main function of its mapper
+   script and gives its exit status.  As for the mapper scripts, 2 means that the arguments
+   were rejected and 3 that the run failed.
+
+   Parameters
+   ----------
+   job : dict
+      The job as read by read_jobs
+
+   Return
+   ------
+   The exit status of the job
+   """
+   module_name = batch_mappers.get(job["mapper"], str(job["mapper"]).removesuffix('.py'))
+   if module_name not in batch_mappers.values():
+      logger.error(f'Unknown mapper {job["mapper"]}, expected one of: {", ".join(batch_mappers)}')
+      return 2
+
+   try:
+      mapper = importlib.import_module(f'.{module_name}', __package__)
+   except Exception as e:
+      logger.critical(f'Cannot import the {module_name} mapper', exc_info=True)
+      return 3
+
+   parser = mapper.build_parser()
+   try:
+      parsed_args = parser.parse_args(job_arguments(job))
+   except SystemExit as e:
+      # argparse exits after reporting bad arguments, or after printing the help or a version
+      return e.code if isinstance(e.code, int) else 2
+
+   job_logger = logging.getLogger(parser.prog)
+   job_logger.setLevel(parsed_args.logLevel)
+   return mapper.run(parsed_args, job_logger)
+
+
+def write_status_report(job_statuses: list[dict], status_path: Path) -> None:
+   """Write the status of every job as JSON when the file name ends with .json, otherwise as TSV."""
+   if status_path.suffix == '.json':
+      status_path.write_text(json.dumps(job_statuses, indent=3) + '\n')
+   else:
+      with status_path.open('w', newline='') as status_file:
+         writer = csv.DictWriter(status_file, fieldnames=status_fields, delimiter='\t', lineterminator='\n')
+         writer.writeheader()
+         writer.writerows(job_statuses)
+   logger.info(f'Job status report saved as: {status_path.as_posix()}')
+
+
+def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """
+   This function runs the jobs of a job manifest one after the other in this interpreter, so
+   that Python starts and pandas is imported once for all of them.  The status of every job
+   is logged and optionally saved as a report.
+
+   Parameters
+   ----------
+   command_arguments : argparse.Namespace
+      The command line arguments processed by argparse
+   logger : logging.Logger
+      The logger to be used to provide user feedback
+   """
+   jobs_path = Path(command_arguments.jobsFile)
+   status_path = Path(command_arguments.statusFile) if command_arguments.statusFile else None
+
+   if not jobs_path.is_file():
+      logger.critical('Cannot find job manifest file: ' + jobs_path.as_posix())
+      raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), jobs_path.as_posix())
+
+   if status_path is not None and not status_path.parent.is_dir():
+      logger.critical('Cannot find status report output directory: ' + status_path.parent.as_posix())
+      raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), status_path.parent.as_posix())
+
+   jobs = read_jobs(jobs_path)
+   logger.info(f'Running {len(jobs)} jobs from: {jobs_path.as_posix()}')
+
+   job_statuses = []
+   failed = False
+   for job_number, job in enumerate(jobs, start=1):
+      job_status = {"job": job_number, "mapper": job["mapper"], "subjects_type": job.get("subjects_type", ""), "status": "skipped", "exit_status": None, "wall_seconds": None}
+      job_statuses.append(job_status)
+      if failed and command_arguments.stopOnFailure:
+         logger.warning(f'Job {job_number}/{len(jobs)} {job["mapper"]} {job_status["subjects_type"]}: skipped after a failed job')
+         continue
+
+      start_wall = time.perf_counter()
+      exit_status = run_job(job)
+      job_status.update({"status": "completed" if exit_status == 0 else "failed", "exit_status": exit_status,
+                         "wall_seconds": round(time.perf_counter() - start_wall, 6)})
+      failed = failed or exit_status != 0
+      logger.log(logging.INFO if exit_status == 0 else logging.ERROR,
+                 f'Job {job_number}/{len(jobs)} {job["mapper"]} {job_status["subjects_type"]}: {job_status["status"]} with exit status {exit_status} in {job_status["wall_seconds"]:.2f} s')
+
+   if status_path is not None:
+      write_status_report(job_statuses, status_path)
+
+   completed = sum(job_status["status"] == "completed" for job_status in job_statuses)
+   logger.info(f'{completed} of {len(jobs)} jobs completed')
+   return 0 if completed == len(jobs) else 3
+
+
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of this utility."""
+   parser = argparse.ArgumentParser(
+      prog=Path(__file__).name,
+      description='''This utility runs the jobs of a job manifest, each a run of one of the ARDaC node mapper scripts, one after the other
+         in a single Python interpreter, so that Python starts and pandas is imported once for all of them.  The status of every job is
+         logged and can be saved as a report.  The version arguments are answered without importing pandas.''',
+      epilog=f'''A job manifest is a JSON file holding a list of job objects, or a TSV file with a header row and one job per row.  Each
+         job has a mapper field, one of {", ".join(batch_mappers)}, and one field per argument of the mapper script named without the
+         leading dashes, for example {{"mapper": "case", "subjects_type": "observational", "node_templates_path": "...",
+         "dcc_subjects_file": "...", "node_output_path": "..."}}.  A true value gives a flag argument such as force.''')
+   _cli.add_common_arguments(parser, log_level_help='A standard log level from the Python logger package, for the messages of the batch runner and the jobs')
+   parser.add_argument('--jobs_file', dest='jobsFile', required=True, help='Full path to the JSON or TSV job manifest')
+   parser.add_argument('--status_file', dest='statusFile', default=None, help='Full path to a report of the status of every job, written as JSON when the name ends with .json and as TSV otherwise')
+   parser.add_argument('--stop_on_failure', dest='stopOnFailure', action='store_true', help='Skip the remaining jobs after a job fails, for example the jobs reading the case node after the case node job')
+
+   return parser
+
+
+def run(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """Run this utility with its parsed command line arguments and give the exit status, see _cli.run_main."""
+   return _cli.run_main(main, command_arguments, logger, Path(__file__).name, {})
+
+
+if __name__ == '__main__':
+   exit(_cli.run_script(build_parser(), run))
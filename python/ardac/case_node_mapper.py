@@ -1,18 +1,26 @@
 import os
-import sys
 import errno
 import argparse
 import logging
 import pandas as pd
 from pathlib import Path
-import _constants
+from . import _cli
+from . import _constants
+from . import _manifest
+from . import _mapping
+from . import _metrics
+from . import _node_io
+from . import _node_mappings
+from . import _node_schemas
+from . import _validation
 
+logger = logging.getLogger(__name__)
 
-def generate_observational_case_node(obs_subjects_path: Path, template_headers: list[str]) -> pd.DataFrame:
+
+def generate_observational_case_node(obs_subjects_path: Path, template_headers: list[str]) -> _node_io.NodeFrame:
    """
    This function takes the path to observational subject data and generates
-   a pandas dataframe containing the ARDaC case node data for the observational
-   subjects.
+   the ARDaC case node data for the observational subjects.
 
    Parameters
    ----------
@@ -24,40 +32,22 @@ def generate_observational_case_node(obs_subjects_path: Path, template_headers:
 
    Return
    ------
-   A pandas dataframe containing the ARDaC case node data derived from the
-   observational subjects
+   The ARDaC case node data derived from the observational subjects, with its virtual
+   columns
    """
    # Read the file using pandas
-   logger.info(f'Reading observational subjects file: {obs_subjects_path.as_posix()}')
-   df_obs_input = pd.read_csv(obs_subjects_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading observational subjects file')
-
-   # Initialize a DataFrame with the defined headers and same index as df_obs_input
-   df_obs_output = pd.DataFrame(index=df_obs_input.index, columns=template_headers)
-
-   # Initialize a DataFrame with the defined headers and same index as df_obs_input
-   df_obs_output = pd.DataFrame(index=df_obs_input.index, columns=template_headers)
-
-   # Assign fixed values using .loc to align with the index
-   df_obs_output.loc[:, "*type"] = "case"
-   df_obs_output.loc[:, "project_id"] = "ARDaC-AlcHepNet"
-   df_obs_output.loc[:, "*studies.submitter_id"] = "obs"
-   df_obs_output.loc[:, "index_date"] = "Study Enrollment"
+   df_obs_input = _node_io.read_dcc_file(obs_subjects_path, _node_mappings.case_obs_subjects_columns, 'observational subjects')
 
-   # Map dynamic values using .apply
-   df_obs_output["*submitter_id"] = df_obs_input["usubjid"].apply(lambda x: f"{x}_obs" if pd.notna(x) else None)
-   df_obs_output["cohort"] = df_obs_input["obs_arm"].apply(lambda x: x.split(":")[-1].strip() if pd.notna(x) else None)
-   df_obs_output["study_site"] = df_obs_input["site"].apply(lambda x: x.strip() if pd.notna(x) else None)
-   df_obs_output["vital_status"] = df_obs_input["ALIVE"].apply(lambda x: "alive" if x == "Y" else "dead" if x == "N" else None)
+   # Map the subject data to the case node
+   obs_case_node = _mapping.build_node(_node_mappings.case_obs_plan, df_obs_input, template_headers)
 
-   return df_obs_output
+   return obs_case_node
 
 
-def generate_clinical_case_node(rct_subjects_path: Path, template_headers: list[str]) -> pd.DataFrame:
+def generate_clinical_case_node(rct_subjects_path: Path, template_headers: list[str]) -> _node_io.NodeFrame:
    """
    This function takes the path to clinical subject data and generates
-   a pandas dataframe containing the ARDaC case node data for the clinical
-   subjects.
+   the ARDaC case node data for the clinical subjects.
 
    Parameters
    ----------
@@ -69,38 +59,71 @@ def generate_clinical_case_node(rct_subjects_path: Path, template_headers: list[
 
    Return
    ------
-   A pandas dataframe containing the ARDaC case node data derived from the
-   clinical subjects
+   The ARDaC case node data derived from the clinical subjects, with its virtual
+   columns
    """
    # Read the RCT_SUBJECTS.csv file
-   logger.info(f'Reading clinical subjects file: {rct_subjects_path.as_posix()}')
-   df_rct_input = pd.read_csv(rct_subjects_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading clinical subjects file')
+   df_rct_input = _node_io.read_dcc_file(rct_subjects_path, _node_mappings.case_rct_subjects_columns, 'clinical subjects')
 
-   # Initialize a new DataFrame with the defined headers and the same index as df_input_rct
-   df_rct_output = pd.DataFrame(index=df_rct_input.index, columns=template_headers)
+   # Map the subject data to the case node, unmapped columns are left empty
+   rct_case_node = _mapping.build_node(_node_mappings.case_rct_plan, df_rct_input, template_headers)
 
-   # Assign fixed values using .loc for proper alignment
-   df_rct_output.loc[:, "*type"] = "case"
-   df_rct_output.loc[:, "project_id"] = "ARDaC-AlcHepNet"
-   df_rct_output.loc[:, "*studies.submitter_id"] = "clinical"
-   df_rct_output.loc[:, "index_date"] = "Study Enrollment"
+   return rct_case_node
 
-   # Map dynamic values based on the input file
-   df_rct_output["*submitter_id"] = df_rct_input["usubjid"].apply(lambda x: f"{x}_clinical" if pd.notna(x) else None)
-   df_rct_output["actarm"] = df_rct_input["rct_arm"].apply(lambda x: x.strip() if pd.notna(x) else None)
-   df_rct_output["rct_meld_strata"] = df_rct_input["rct_meld_strata"].apply(lambda x: x.strip() if pd.notna(x) else None)
-   df_rct_output["study_site"] = df_rct_input["site"].apply(lambda x: x.strip() if pd.notna(x) else None)
-   df_rct_output["vital_status"] = df_rct_input["ALIVE"].apply(lambda x: "alive" if x == "Y" else "dead" if x == "N" else None)
 
-   # Fill other unmapped columns with NaN for consistency
-   for col in df_rct_output.columns:
-      if col not in ["*type", "project_id", "*submitter_id", "*studies.submitter_id", "actarm", 
-                     "rct_meld_strata", "study_site", "vital_status", "index_date"]:
-         df_rct_output[col] = None
+def stream_case_node(case_plan: _mapping.MappingPlan, subjects_path: Path, subjects_columns: list[str], description: str,
+                     template_headers: list[str], node_file_path: Path, sidecar_path: Path, chunk_size: int,
+                     validate: bool = False) -> pd.DataFrame | None:
+   """
+   This function maps the subject data to the ARDaC case node one chunk of subjects at a time,
+   appending each mapped chunk to the case node TSV file and its Arrow IPC sidecar file.  The
+   case mapping has no dependencies between rows, so the files are identical to those written
+   from the whole subjects table, while memory use is bounded by the chunk size.
 
-   return df_rct_output
+   Parameters
+   ----------
+   case_plan : _mapping.MappingPlan
+      The compiled observational or clinical case node mapping
+   subjects_path : Path
+      The full path to the DCC subject data CSV file
+   subjects_columns : list[str]
+      The DCC subject columns used by the case node mapping
+   description : str
+      The description of the subjects file used in the log messages
+   template_headers : list[str]
+      The headers extracted from the case node template
+   node_file_path : Path
+      The full path to the case node TSV file to be written
+   sidecar_path : Path
+      The full path to the case node Arrow IPC sidecar file to be written
+   chunk_size : int
+      The maximum number of subjects mapped at a time
+   validate : bool
+      When true each chunk is checked against the case node schema rules
 
+   Return
+   ------
+   The violations report of the case node when validate is true, otherwise None
+   """
+   subject_count = 0
+   sidecar_writer = None
+   df_reports = []
+   try:
+      for chunk_number, df_chunk in enumerate(_node_io.read_dcc_file_chunks(subjects_path, subjects_columns, description, chunk_size)):
+         case_node = _mapping.build_node(case_plan, df_chunk, template_headers)
+         # Only the first chunk creates the file and writes the header
+         _node_io.write_tsv(case_node, node_file_path, append=chunk_number > 0)
+         sidecar_writer = _node_io.append_case_sidecar(case_node.data, sidecar_path, sidecar_writer)
+         if validate:
+            df_reports.append(_validation.validate_node(case_node, _node_schemas.case_rules, f'case node chunk {chunk_number + 1}'))
+         subject_count += len(case_node.data)
+   finally:
+      if sidecar_writer is not None:
+         sidecar_writer.close()
+   if sidecar_writer is not None:
+      _node_io.finish_case_sidecar(sidecar_path, node_file_path)
+   logger.info(f'Mapped {subject_count} {description} to the case node')
+   return _validation.combine_reports(df_reports, _node_schemas.case_rules) if validate else None
 
 
 def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
@@ -117,6 +140,9 @@ def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
    logger : logging.Logger
       The logger to be used to provide user feedback
    """
+   _node_io.set_io_engine(command_arguments.ioEngine)
+   _node_io.set_arrow_strings(command_arguments.arrowStrings)
+
    template_path = Path(command_arguments.nodeTemplatesPath, _constants.case_template_file_name)
    dcc_subjects_path = Path(command_arguments.dccSubjectsFile)
    node_output_path = Path(command_arguments.nodeOutputPath)
@@ -133,70 +159,87 @@ def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
       logger.critical('Cannot find node output directory: ' + node_output_path.as_posix())
       raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), node_output_path.as_posix())
    
+   if command_arguments.chunkSize is not None and command_arguments.chunkSize < 1:
+      raise ValueError(f'The chunk size must be a positive number of subjects, not {command_arguments.chunkSize}')
+
+   if command_arguments.subjectsType == 'observational':
+      manifest_path = Path(node_output_path, _constants.case_obs_manifest_file_name)
+   elif command_arguments.subjectsType == 'clinical':
+      manifest_path = Path(node_output_path, _constants.case_rct_manifest_file_name)
+   else:
+      raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
+
+   # Skip the run when the node files of a previous run with the same inputs are up to date
+   manifest = _manifest.build_manifest(Path(__file__), command_arguments.subjectsType, {'subjects': dcc_subjects_path}, {'case': template_path}, {'validate': command_arguments.validate})
+   if not command_arguments.force and _manifest.is_cached(manifest_path, manifest, node_output_path):
+      logger.info(f'cached: the {command_arguments.subjectsType} case node is up to date, use --force to regenerate it')
+      _metrics.record_cached()
+      return 0
+
    # Read the template TSV file to extract the headers
-   logger.info(f'Reading case template CSV file: {template_path.as_posix()}')
-   df_template = pd.read_csv(template_path.as_posix(), sep='\t', nrows=0)  # Read only the header
-   template_headers = df_template.columns.tolist()  # Extract the headers as a list
+   template_headers = _node_io.read_template_headers(template_path)
 
    if command_arguments.subjectsType == 'observational':
       logger.info('Transforming DCC observational subject data to ARDaC case node')
       node_file_path = Path(node_output_path, _constants.case_obs_file_name)
-      df_obs_output = generate_observational_case_node(dcc_subjects_path, template_headers)
-      df_obs_output.to_csv(node_file_path.as_posix(), sep='\t', index=False, header=True)
+      sidecar_path = Path(node_output_path, _constants.case_obs_sidecar_file_name)
+      if command_arguments.chunkSize is not None:
+         df_report = stream_case_node(_node_mappings.case_obs_plan, dcc_subjects_path, _node_mappings.case_obs_subjects_columns, 'observational subjects',
+                                      template_headers, node_file_path, sidecar_path, command_arguments.chunkSize, command_arguments.validate)
+      else:
+         obs_case_node = generate_observational_case_node(dcc_subjects_path, template_headers)
+         _node_io.write_tsv(obs_case_node, node_file_path)
+         _node_io.write_case_sidecar(obs_case_node.data, sidecar_path, node_file_path)
+         if command_arguments.validate:
+            df_report = _validation.validate_node(obs_case_node, _node_schemas.case_rules, 'observational case node')
    elif command_arguments.subjectsType == 'clinical':
       logger.info('Transforming DCC clinical subject data to ARDaC case node')
       node_file_path = Path(node_output_path, _constants.case_rct_file_name)
-      df_rct_output = generate_clinical_case_node(dcc_subjects_path, template_headers)
-      df_rct_output.to_csv(node_file_path.as_posix(), sep='\t', index=False, header=True)
+      sidecar_path = Path(node_output_path, _constants.case_rct_sidecar_file_name)
+      if command_arguments.chunkSize is not None:
+         df_report = stream_case_node(_node_mappings.case_rct_plan, dcc_subjects_path, _node_mappings.case_rct_subjects_columns, 'clinical subjects',
+                                      template_headers, node_file_path, sidecar_path, command_arguments.chunkSize, command_arguments.validate)
+      else:
+         rct_case_node = generate_clinical_case_node(dcc_subjects_path, template_headers)
+         _node_io.write_tsv(rct_case_node, node_file_path)
+         _node_io.write_case_sidecar(rct_case_node.data, sidecar_path, node_file_path)
+         if command_arguments.validate:
+            df_report = _validation.validate_node(rct_case_node, _node_schemas.case_rules, 'clinical case node')
    else:
       raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
+
+   output_paths = [node_file_path, sidecar_path]
+   if command_arguments.validate:
+      output_paths.append(_validation.write_report(df_report, node_file_path, f'{command_arguments.subjectsType.capitalize()} case node'))
+
+   _manifest.write_manifest(manifest_path, manifest, output_paths)
    
    return 0
 
    
-if __name__ == '__main__':
-   status = 0
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of this utility."""
    parser = argparse.ArgumentParser(
+      prog=Path(__file__).name,
       description='''This utility generates ARDaC case nodes from observational or clinical trial DCC subject data provided in CSV format files.
          The user must provide the location of the ARDaC case node template file, the CSV file containing the DCC subject data, and the
          path to where the ARDaC case node file is to be written.''',
       epilog=f'''Observational case node files are named \'{_constants.case_obs_file_name}\'.
          Clinical case node files are named \'{_constants.case_rct_file_name}\'.  Case node files are written to the directory given by the --node_output_path argument.''')
-   valid_log_level_names_mapping = logging.getLevelNamesMapping()
-   valid_log_level_names_mapping.pop('NOTSET') # Remove NOTSET option value
-   parser.add_argument('--version', action='version', version=f'DCC_VERSION={_constants.dcc_release_string},MAPPING_VERSION={_constants.mapping_version_string}')
-   parser.add_argument('--dcc_version', action='version', version=f'{_constants.dcc_release_string}')
-   parser.add_argument('--mapping_version', action='version', version=f'{_constants.mapping_version_string}')
-   parser.add_argument('--log_level', dest='logLevel', default='INFO', choices=list(valid_log_level_names_mapping.keys()), help='A standard log level from the Python logger package: DEBUG, INFO, WARNING, ERROR, CRITICAL')
-   parser.add_argument('--node_templates_path', dest='nodeTemplatesPath', required=True, help='Path to the directory where the ARDaC node template TSV files are located')
-   parser.add_argument('--subjects_type', dest='subjectsType', required=True, choices=['observational', 'clinical'], help='Value indicating if the input subject data is from clinical trial subjects or observational study subjects')
+   _cli.add_common_arguments(parser, io_engines=_node_io.io_engines, force=True,
+                             validate_help=f'Check the case node against the type and enum rules of the ARDaC case node schema, and save a report of the violations next to the node file, named for example {_validation.report_file_path(Path(_constants.case_obs_file_name)).name}',
+                             metrics_stages='read, template-load, transform, QC, validate, and write', node_templates=True, subjects_type=True)
    parser.add_argument('--dcc_subjects_file', dest='dccSubjectsFile', required=True, help='Full path to the DCC input subjects file in CSV format')
-   parser.add_argument('--node_output_path', dest='nodeOutputPath', required=True, help=f'Path to the directory where the TSV case node file is to be saved.  The file name will be either {_constants.case_obs_file_name} or {_constants.case_rct_file_name}')
+   parser.add_argument('--node_output_path', dest='nodeOutputPath', required=True, help=f'Path to the directory where the TSV case node file is to be saved.  The file name will be either {_constants.case_obs_file_name} or {_constants.case_rct_file_name}, with an Arrow IPC sidecar file named {_constants.case_obs_sidecar_file_name} or {_constants.case_rct_sidecar_file_name} when pyarrow is installed')
+   parser.add_argument('--chunk_size', dest='chunkSize', type=int, default=None, help='Map the subjects file this many subjects at a time, appending each chunk to the case node file, to bound memory use on large inputs.  By default the whole file is mapped at once')
 
-   parsed_args = parser.parse_args()
-   
-   # Configure and create logger for standard output
-   console_handler = logging.StreamHandler(sys.stdout)
-   console_handler.setLevel(parsed_args.logLevel)
-   console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+   return parser
 
-   logging.basicConfig(
-      level = parsed_args.logLevel,
-      handlers = [console_handler]
-   )
 
-   logger = logging.getLogger(parser.prog)
-   logger.setLevel(parsed_args.logLevel)
+def run(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """Run this utility with its parsed command line arguments and give the exit status, see _cli.run_main."""
+   return _cli.run_main(main, command_arguments, logger, Path(__file__).name, {'io_engine': command_arguments.ioEngine, 'arrow_strings': command_arguments.arrowStrings})
 
-   try:
-      # Status codes greater than zero and less than three are reserved for command line processing errors
-      status = 3
-      status = main(parsed_args, logger)
-   except FileNotFoundError as e:
-      logger.critical(f'Input file not found: {e}')
-   except ValueError as e:
-      logger.critical(f'Command line argument or parameter had a bad value: {e}')
-   except Exception as e:
-      logger.critical('Caught an exception', exc_info=True)
-   
-   exit(status)
\ No newline at end of file
+
+if __name__ == '__main__':
+   exit(_cli.run_script(build_parser(), run))
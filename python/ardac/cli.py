@@ -0,0 +1,87 @@
+# The ardac command installed by python/pyproject.toml.  Each mapper subcommand runs one of the
+# mapper scripts with the same arguments, and its module is imported only when the subcommand
+# is run, so that the version subcommand and the help return without importing pandas.
+import sys
+import argparse
+import importlib
+from . import _cli
+from . import _constants
+
+# The module of each mapper subcommand and its description in the help
+mapper_subcommands = {
+   "case": ("case_node_mapper", "Generate the case node from the DCC subjects file"),
+   "demographic": ("demographic_node_mapper", "Generate the demographic node from the DCC subjects file and the case node"),
+   "follow-up": ("follow_up_node_mapper", "Generate the follow-up node and its QC file from the DCC visit data files and the case node"),
+   "audit": ("audit_node_mapper", "Generate the audit node and its QC file from the DCC audit file and the case node"),
+   "all-nodes": ("all_nodes_mapper", "Generate every node and QC file in one process that reads each DCC file once"),
+   "scatter": ("scatter_dcc", "Split the DCC files into shards of subjects"),
+   "gather": ("gather_nodes", "Combine the node and QC files written for the shards of subjects"),
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of the ardac command, without the arguments of the mapper subcommands."""
+   parser = argparse.ArgumentParser(
+      prog='ardac',
+      description='''This command runs the ARDaC node mappers that transform observational and clinical trial DCC data provided in CSV
+         format files to ARDaC node files in TSV format.''',
+      epilog='''The mapper subcommands take the arguments of their mapper scripts, run "ardac <subcommand> --help" to list them.''')
+   parser.add_argument('--version', action='version', version=f'DCC_VERSION={_constants.dcc_release_string},MAPPING_VERSION={_constants.mapping_version_string}')
+   subparsers = parser.add_subparsers(dest='subcommand', required=True, metavar='subcommand')
+   for subcommand, (_, description) in mapper_subcommands.items():
+      subparsers.add_parser(subcommand, help=description, add_help=False)
+   version_parser = subparsers.add_parser('version', help='Print the DCC release and mapping versions of the mappers')
+   version_group = version_parser.add_mutually_exclusive_group()
+   version_group.add_argument('--dcc_version', dest='dccVersion', action='store_true', help='Print only the DCC release version')
+   version_group.add_argument('--mapping_version', dest='mappingVersion', action='store_true', help='Print only the mapping version')
+   return parser
+
+
+def run_mapper(subcommand: str, arguments: list[str]) -> int:
+   """
+   This function runs a mapper subcommand with the arguments that follow it on the command
+   line, as its mapper script does, and gives the exit status.
+
+   Parameters
+   ----------
+   subcommand : str
+      The mapper subcommand, one of mapper_subcommands
+   arguments : list[str]
+      The command line arguments of the mapper
+
+   Return
+   ------
+   The exit status of the mapper
+   """
+   mapper = importlib.import_module(f'.{mapper_subcommands[subcommand][0]}', __package__)
+   parser = mapper.build_parser()
+   parser.prog = f'ardac {subcommand}'
+   return _cli.run_script(parser, mapper.run, arguments)
+
+
+def main(arguments: list[str] | None = None) -> int:
+   """
+   This function runs the ardac command and gives the exit status.  The arguments of a mapper
+   subcommand are parsed by the parser of its mapper script.
+
+   Parameters
+   ----------
+   arguments : list[str] | None
+      The command line arguments, by default those of the process
+   """
+   arguments = sys.argv[1:] if arguments is None else arguments
+   if arguments and arguments[0] in mapper_subcommands:
+      return run_mapper(arguments[0], arguments[1:])
+
+   parsed_args = build_parser().parse_args(arguments)
+   if parsed_args.dccVersion:
+      print(_constants.dcc_release_string)
+   elif parsed_args.mappingVersion:
+      print(_constants.mapping_version_string)
+   else:
+      print(f'DCC_VERSION={_constants.dcc_release_string},MAPPING_VERSION={_constants.mapping_version_string}')
+   return 0
+
+
+if __name__ == '__main__':
+   sys.exit(main())
@@ -1,15 +1,66 @@
 import os
-import sys
 import errno
 import argparse
 import logging
 import pandas as pd
 from pathlib import Path
-from datetime import datetime
-import _constants
+from . import _cli
+from . import _constants
+from . import _manifest
+from . import _mapping
+from . import _metrics
+from . import _node_io
+from . import _node_mappings
+from . import _node_schemas
+from . import _validation
 
+logger = logging.getLogger(__name__)
 
-def generate_observational_demographic_node(obs_subjects_path: Path, obs_case_path: Path, template_headers: list[str]) -> pd.DataFrame:
+
+def build_demographic_node(df_subjects_input: pd.DataFrame, df_case_input: pd.DataFrame, template_headers: list[str]) -> _node_io.NodeFrame:
+   """
+   This function joins the DCC subject data to the ARDaC case node data on the subject ID
+   and produces the ARDaC demographic node data.  When a subject ID appears more than once
+   in the subject data, the first record is used.
+
+   Parameters
+   ----------
+   df_subjects_input : pd.DataFrame
+      The DCC subject data
+   df_case_input : pd.DataFrame
+      The ARDaC case node data generated by case_node_mapper.py
+   template_headers : list[str]
+      The header names extracted from the demographic node template
+
+   Return
+   ------
+   The ARDaC demographic node data with its virtual columns
+   """
+   with _metrics.stage('transform', rows_in=len(df_subjects_input)) as stage:
+      # Step 1: Extract "*submitter_id" from the case data and create case_table
+      case_table = pd.DataFrame()
+      case_table["*submitter_id"] = df_case_input["*submitter_id"]
+      if "usubjid" in df_case_input.columns:
+         case_table["usubjid"] = df_case_input["usubjid"]  # Precomputed in the case node sidecar file
+      else:
+         case_table["usubjid"] = _node_io.case_subject_ids(case_table["*submitter_id"])  # Extract the number before "_"
+
+      # Step 2: Keep the first subject record of each subject and join its mapped fields to case_table
+      subject_columns = [column for column in _node_mappings.demographic_plan.source_columns
+                         if column in df_subjects_input.columns and column not in case_table.columns]
+      df_subjects_first = df_subjects_input.dropna(subset=["usubjid"]).drop_duplicates(subset="usubjid", keep="first")
+      df_joined = case_table.merge(df_subjects_first[["usubjid"] + subject_columns], on="usubjid", how="left", indicator=True)
+      df_joined.index = case_table.index
+
+      # Step 3: Map the matched cases to the demographic node, with one row per subject record
+      demographic_node = _mapping.build_node(_node_mappings.demographic_plan, df_joined[df_joined["_merge"] == "both"], template_headers)
+      demographic_node = demographic_node._replace(data=demographic_node.data.reindex(df_subjects_input.index))
+      stage.rows_out = len(demographic_node.data)
+
+   return demographic_node
+
+
+def generate_observational_demographic_node(obs_subjects_path: Path, obs_case_path: Path, template_headers: list[str]) -> _node_io.NodeFrame:
    """
    This function takes the path to the DCC observational subjects file, the ARDaC observational case node file,
    and the ARDaC demographic node headers and produces the ARDaC demographic node data.
@@ -25,83 +76,20 @@ def generate_observational_demographic_node(obs_subjects_path: Path, obs_case_pa
 
    Return
    ------
-   A pandas dataframe containing the ARDaC demographic node data derived from the
-   observational subjects
+   The ARDaC demographic node data derived from the observational subjects, with its
+   virtual columns
    """
    # Read the file using pandas
-   logger.info(f'Reading the observational subjects file: {obs_subjects_path.as_posix()}')
-   df_obs_subjects_input = pd.read_csv(obs_subjects_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading observational subjects file')
-
-   logger.info(f'Reading the observational ARDaC case file: {obs_case_path.as_posix()}')
-   df_obs_case_input = pd.read_csv(obs_case_path.as_posix(), sep='\t', dtype=str)
-   logger.info(f'Done reading observational case file')
-
-   df_obs_output = pd.DataFrame(index=df_obs_subjects_input.index, columns=template_headers)
-
-   # Step 1: Extract "*submitter_id" from df_obs_case and create case_table
-   case_table = pd.DataFrame()
-   case_table["*submitter_id"] = df_obs_case_input["*submitter_id"]
-   case_table["usubjid"] = case_table["*submitter_id"].apply(lambda x: x.split("_")[0])  # Extract the number before "_"
-
-   # Step 2: Iterate through case_table and map values to df_obs_output
-   for _, row in case_table.iterrows():
-      submitter_id = row["*submitter_id"]
-      usubjid = row["usubjid"]
-
-      # Find the corresponding record in df_obs_input
-      input_row = df_obs_subjects_input[df_obs_subjects_input["usubjid"] == usubjid]
-
-      if not input_row.empty:
-         input_row = input_row.iloc[0]  # Extract the first matching row
-
-         # Populate df_obs_output
-         df_obs_output.loc[:, "*type"] = "demographic"
-         df_obs_output.loc[:, "project_id"] = "ARDaC-AlcHepNet"
-         df_obs_output.loc[_, "*submitter_id"] = f"{submitter_id}_demographic"
-         df_obs_output.loc[_, "*cases.submitter_id"] = f"{submitter_id}"
-         df_obs_output.loc[_, "age_at_index"] = input_row.get("calc_age", None)
-         df_obs_output.loc[_, "cause_of_death_primary"] = input_row.get("codp", None)
-         df_obs_output.loc[_, "cause_of_death_secondary"] = input_row.get("cods", None)
-         df_obs_output.loc[_, "cur_employ_stat"] = input_row.get("employed", None)
-         df_obs_output.loc[_, "education"] = input_row.get("edu", None)
-         df_obs_output.loc[_, "ethnicity"] = input_row.get("ethnic", None)
-         df_obs_output.loc[_, "gender"] = input_row.get("gender", None)
-         df_obs_output.loc[_, "marital"] = input_row.get("maristat", None)
-         df_obs_output.loc[_, "race"] = input_row.get("race", None)
-         df_obs_output.loc[_, "sex"] = input_row.get("sex", None)
-
-         # Map "vital_status" from "ALIVE"
-         alive = input_row.get("ALIVE", "").strip()
-         if alive == "Y":
-            df_obs_output.loc[_, "vital_status"] = "Alive"
-         elif alive == "N":
-            df_obs_output.loc[_, "vital_status"] = "Dead"
-         else:
-            df_obs_output.loc[_, "vital_status"] = "Not Reported"
-
-         # Extract "year_of_birth" and "year_of_death"
-         brthdtc = input_row.get("brthdtc", None)
-         df_obs_output.loc[_, "year_of_birth"] = brthdtc.split("-")[0] if pd.notna(brthdtc) else None
-
-         dthdtc = input_row.get("dthdtc", None)
-         df_obs_output.loc[_, "year_of_death"] = dthdtc.split("-")[0] if pd.notna(dthdtc) else None
-
-         # Calculate "days_to_death"
-         scdat = input_row.get("scdat", None)  # Study enrollment date
-         if pd.notna(dthdtc) and pd.notna(scdat):
-            try:
-               death_date = datetime.strptime(dthdtc, "%Y-%m-%d")
-               study_date = datetime.strptime(scdat, "%Y-%m-%d")
-               days_to_death = (death_date - study_date).days
-               df_obs_output.loc[_, "days_to_death"] = days_to_death
-            except ValueError:
-                df_obs_output.loc[_, "days_to_death"] = None
+   df_obs_subjects_input = _node_io.read_dcc_file(obs_subjects_path, _node_mappings.demographic_subjects_columns, 'observational subjects',
+                                                  _node_mappings.demographic_subjects_optional_columns)
+   df_obs_case_input = _node_io.read_case_node(obs_case_path, 'observational case')
+
+   df_obs_output = build_demographic_node(df_obs_subjects_input, df_obs_case_input, template_headers)
 
    return df_obs_output
 
 
-def generate_clinical_demographic_node(rct_subjects_path: Path, rct_case_path: Path, template_headers: list[str]) -> pd.DataFrame:
+def generate_clinical_demographic_node(rct_subjects_path: Path, rct_case_path: Path, template_headers: list[str]) -> _node_io.NodeFrame:
    """
    This function takes the path to the DCC clinical subjects file, the ARDaC clinical case node file,
    and the ARDaC demographic node headers to produce the ARDaC demographic node data.
@@ -117,78 +105,15 @@ def generate_clinical_demographic_node(rct_subjects_path: Path, rct_case_path: P
 
    Return
    ------
-   A pandas dataframe containing the ARDaC demographic node data derived from the
-   clinical subjects
+   The ARDaC demographic node data derived from the clinical subjects, with its virtual
+   columns
    """
    # Read the file using pandas
-   logger.info(f'Reading the clinical subjects file: {rct_subjects_path.as_posix()}')
-   df_rct_subjects_input = pd.read_csv(rct_subjects_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading clinical subjects file')
-
-   logger.info(f'Reading the clinical ARDaC case file: {rct_case_path.as_posix()}')
-   df_rct_case_input = pd.read_csv(rct_case_path.as_posix(), sep='\t', dtype=str)
-   logger.info(f'Done reading clinical case file')
-
-   df_rct_output = pd.DataFrame(index=df_rct_subjects_input.index, columns=template_headers)
-
-   # Step 1: Extract "*submitter_id" from df_rct_case and create case_table
-   case_table = pd.DataFrame()
-   case_table["*submitter_id"] = df_rct_case_input["*submitter_id"]
-   case_table["usubjid"] = case_table["*submitter_id"].apply(lambda x: x.split("_")[0])  # Extract the number before "_"
-
-   # Step 2: Iterate through case_table and map values to df_rct_output
-   for _, row in case_table.iterrows():
-      submitter_id = row["*submitter_id"]
-      usubjid = row["usubjid"]
-
-      # Find the corresponding record in df_rct_input
-      input_row = df_rct_subjects_input[df_rct_subjects_input["usubjid"] == usubjid]
-
-      if not input_row.empty:
-         input_row = input_row.iloc[0]  # Extract the first matching row
-
-         # Populate df_rct_output
-         df_rct_output.loc[:, "*type"] = "demographic"
-         df_rct_output.loc[:, "project_id"] = "ARDaC-AlcHepNet"
-         df_rct_output.loc[_, "*submitter_id"] = f"{submitter_id}_demographic"
-         df_rct_output.loc[_, "*cases.submitter_id"] = f"{submitter_id}"
-         df_rct_output.loc[_, "age_at_index"] = input_row.get("calc_age", None)
-         df_rct_output.loc[_, "cause_of_death_primary"] = input_row.get("codp", None)
-         df_rct_output.loc[_, "cause_of_death_secondary"] = input_row.get("cods", None)
-         df_rct_output.loc[_, "cur_employ_stat"] = input_row.get("employed", None)
-         df_rct_output.loc[_, "education"] = input_row.get("edu", None)
-         df_rct_output.loc[_, "ethnicity"] = input_row.get("ethnic", None)
-         df_rct_output.loc[_, "gender"] = input_row.get("gender", None)
-         df_rct_output.loc[_, "marital"] = input_row.get("maristat", None)
-         df_rct_output.loc[_, "race"] = input_row.get("race", None)
-         df_rct_output.loc[_, "sex"] = input_row.get("sex", None)
-
-         # Map "vital_status" from "ALIVE"
-         alive = input_row.get("ALIVE", "").strip()
-         if alive == "Y":
-            df_rct_output.loc[_, "vital_status"] = "Alive"
-         elif alive == "N":
-            df_rct_output.loc[_, "vital_status"] = "Dead"
-         else:
-            df_rct_output.loc[_, "vital_status"] = "Not Reported"
-
-         # Extract "year_of_birth" and "year_of_death"
-         brthdtc = input_row.get("brthdtc", None)
-         df_rct_output.loc[_, "year_of_birth"] = brthdtc.split("-")[0] if pd.notna(brthdtc) else None
-
-         dthdtc = input_row.get("dthdtc", None)
-         df_rct_output.loc[_, "year_of_death"] = dthdtc.split("-")[0] if pd.notna(dthdtc) else None
-
-         # Calculate "days_to_death"
-         scdat = input_row.get("scdat", None)  # Study enrollment date
-         if pd.notna(dthdtc) and pd.notna(scdat):
-            try:
-               death_date = datetime.strptime(dthdtc, "%Y-%m-%d")
-               study_date = datetime.strptime(scdat, "%Y-%m-%d")
-               days_to_death = (death_date - study_date).days
-               df_rct_output.loc[_, "days_to_death"] = days_to_death
-            except ValueError:
-                df_rct_output.loc[_, "days_to_death"] = None
+   df_rct_subjects_input = _node_io.read_dcc_file(rct_subjects_path, _node_mappings.demographic_subjects_columns, 'clinical subjects',
+                                                  _node_mappings.demographic_subjects_optional_columns)
+   df_rct_case_input = _node_io.read_case_node(rct_case_path, 'clinical case')
+
+   df_rct_output = build_demographic_node(df_rct_subjects_input, df_rct_case_input, template_headers)
 
    return df_rct_output
 
@@ -207,6 +132,9 @@ def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
    logger : logging.Logger
       The logger to be used to provide user feedback
    """
+   _node_io.set_io_engine(command_arguments.ioEngine)
+   _node_io.set_arrow_strings(command_arguments.arrowStrings)
+
    template_path = Path(command_arguments.nodeTemplatesPath, _constants.demographic_template_file_name)
    dcc_subjects_path = Path(command_arguments.dccSubjectsFile)
    node_output_path = Path(command_arguments.nodeOutputPath)
@@ -225,38 +153,63 @@ def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
    
    if command_arguments.subjectsType == 'observational':
       case_file_path = Path(node_output_path, _constants.case_obs_file_name)
+      manifest_path = Path(node_output_path, _constants.demographic_obs_manifest_file_name)
    elif command_arguments.subjectsType == 'clinical':
       case_file_path = Path(node_output_path, _constants.case_rct_file_name)
+      manifest_path = Path(node_output_path, _constants.demographic_rct_manifest_file_name)
    else:
       raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
 
+   if command_arguments.caseNodeFile is not None:
+      case_file_path = Path(command_arguments.caseNodeFile)
+
    if not case_file_path.is_file():
       logger.critical('Cannot find ARDaC case file: ' + case_file_path.as_posix())
       raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), case_file_path.as_posix())
 
+   # Skip the run when the node files of a previous run with the same inputs are up to date
+   manifest = _manifest.build_manifest(Path(__file__), command_arguments.subjectsType, {'subjects': dcc_subjects_path, 'case': case_file_path}, {'demographic': template_path}, {'validate': command_arguments.validate})
+   if not command_arguments.force and _manifest.is_cached(manifest_path, manifest, node_output_path):
+      logger.info(f'cached: the {command_arguments.subjectsType} demographic node is up to date, use --force to regenerate it')
+      _metrics.record_cached()
+      return 0
+
    # Read the template TSV file to extract the headers
-   logger.info(f'Reading demographic template CSV file: {template_path.as_posix()}')
-   df_template = pd.read_csv(template_path.as_posix(), sep='\t', nrows=0)  # Read only the header
-   template_headers = df_template.columns.tolist()  # Extract the headers as a list
+   template_headers = _node_io.read_template_headers(template_path)
 
+   df_report = None
    if command_arguments.subjectsType == 'observational':
       logger.info('Transforming observational subject data')
       node_file_path = Path(node_output_path, _constants.demographic_obs_file_name)
       df_obs_output = generate_observational_demographic_node(dcc_subjects_path, case_file_path, template_headers)
-      df_obs_output.to_csv(node_file_path.as_posix(), sep='\t', index=False, header=True)
+      _node_io.write_tsv(df_obs_output, node_file_path)
       logger.info(f'Observational demographic node saved as: {node_file_path.as_posix()}')
+      if command_arguments.validate:
+         df_report = _validation.validate_node(df_obs_output, _node_schemas.demographic_rules, 'observational demographic node')
    elif command_arguments.subjectsType == 'clinical':
       logger.info('Transforming clinical audit data')
       node_file_path = Path(node_output_path, _constants.demographic_rct_file_name)
       df_rct_output = generate_clinical_demographic_node(dcc_subjects_path, case_file_path, template_headers)
-      df_rct_output.to_csv(node_file_path.as_posix(), sep='\t', index=False, header=True)
+      _node_io.write_tsv(df_rct_output, node_file_path)
       logger.info(f'Clinical demographic node saved as: {node_file_path.as_posix()}')
+      if command_arguments.validate:
+         df_report = _validation.validate_node(df_rct_output, _node_schemas.demographic_rules, 'clinical demographic node')
    else:
       raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
 
-if __name__ == '__main__':
-   status = 0
+   output_paths = [node_file_path]
+   if command_arguments.validate:
+      output_paths.append(_validation.write_report(df_report, node_file_path, f'{command_arguments.subjectsType.capitalize()} demographic node'))
+
+   _manifest.write_manifest(manifest_path, manifest, output_paths)
+
+   return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of this utility."""
    parser = argparse.ArgumentParser(
+      prog=Path(__file__).name,
       description='''This utility generates ARDaC demographic nodes from observational or clinical trial DCC subject files and ARDaC case node files.
          The DCC subject files are provided in CSV format, and the ARDaC case node files are provided in ARDaC node TSV format.
          The user must provide the location of the ARDaC demographic node template file, the CSV file containing the DCC subject data,
@@ -264,43 +217,22 @@ if __name__ == '__main__':
       epilog=f'''Observational case node files are named \'{_constants.case_obs_file_name}\'.
          Clinical case node files are named \'{_constants.case_rct_file_name}\'.  Demographic node files are written to the directory given by the --node_output_path argument.
          The ARDaC case node input TSV file is also expected to be at this location''')
-   valid_log_level_names_mapping = logging.getLevelNamesMapping()
-   valid_log_level_names_mapping.pop('NOTSET') # Remove NOTSET option value
-   parser.add_argument('--version', action='version', version=f'DCC_VERSION={_constants.dcc_release_string},MAPPING_VERSION={_constants.mapping_version_string}')
-   parser.add_argument('--dcc_version', action='version', version=f'{_constants.dcc_release_string}')
-   parser.add_argument('--mapping_version', action='version', version=f'{_constants.mapping_version_string}')
-   parser.add_argument('--log_level', dest='logLevel', default='INFO', choices=list(valid_log_level_names_mapping.keys()), help='A standard log level from the Python logger package')
-   parser.add_argument('--node_templates_path', dest='nodeTemplatesPath', required=True, help='Path to the directory where the ARDaC node template TSV files are located')
-   parser.add_argument('--subjects_type', dest='subjectsType', required=True, choices=['observational', 'clinical'], help='Value indicating if the input subject data is from clinical trial subjects or observational study subjects')
+   _cli.add_common_arguments(parser, io_engines=_node_io.io_engines, force=True,
+                             validate_help=f'Check the demographic node against the type and enum rules of the ARDaC demographic node schema, and save a report of the violations next to the node file, named for example {_validation.report_file_path(Path(_constants.demographic_obs_file_name)).name}',
+                             metrics_stages='read, template-load, transform, QC, validate, and write', node_templates=True, subjects_type=True)
    parser.add_argument('--dcc_subjects_file', dest='dccSubjectsFile', required=True, help='Full path to the DCC input subjects file in CSV format')
    parser.add_argument('--node_output_path', dest='nodeOutputPath', required=True, help=f'''Path to the directory where the TSV audit node file is to be saved
                        -- the file name will be either {_constants.audit_obs_file_name} or {_constants.demographic_rct_file_name}.
-                       This argument is also the expected location of the input ARDaC case node TSV file.''')
+                       This argument is also the expected location of the input ARDaC case node TSV file, unless --case_node_file is given.''')
+   parser.add_argument('--case_node_file', dest='caseNodeFile', default=None, help='Full path to the input ARDaC case node TSV file, with its Arrow IPC sidecar file next to it when there is one.  By default the case node file is read from the --node_output_path directory')
 
-   parsed_args = parser.parse_args()
-   
-   # Configure and create logger for standard output
-   console_handler = logging.StreamHandler(sys.stdout)
-   console_handler.setLevel(parsed_args.logLevel)
-   console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-
-   logging.basicConfig(
-      level = parsed_args.logLevel,
-      handlers = [console_handler]
-   )
-
-   logger = logging.getLogger(parser.prog)
-   logger.setLevel(parsed_args.logLevel)
-
-   try:
-      # Status codes greater than zero and less than three are reserved for command line processing errors
-      status = 3
-      status = main(parsed_args, logger)
-   except FileNotFoundError as e:
-      logger.critical(f'Input file not found: {e}')
-   except ValueError as e:
-      logger.critical(f'Command line argument or parameter had a bad value: {e}')
-   except Exception as e:
-      logger.critical('Caught an exception', exc_info=True)
-   
-   exit(status)
\ No newline at end of file
+   return parser
+
+
+def run(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """Run this utility with its parsed command line arguments and give the exit status, see _cli.run_main."""
+   return _cli.run_main(main, command_arguments, logger, Path(__file__).name, {'io_engine': command_arguments.ioEngine, 'arrow_strings': command_arguments.arrowStrings})
+
+
+if __name__ == '__main__':
+   exit(_cli.run_script(build_parser(), run))
@@ -1,13 +1,243 @@
 import os
-import sys
 import errno
 import argparse
 import logging
+import itertools
+import operator
+import tempfile
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import _constants
+from typing import Callable, Iterator
+from . import _cli
+from . import _constants
+from . import _external_sort
+from . import _manifest
+from . import _mapping
+from . import _metrics
+from . import _node_io
+from . import _node_mappings
+from . import _node_schemas
+from . import _sharding
+from . import _validation
+
+logger = logging.getLogger(__name__)
+
+
+def build_follow_up_skeleton(case_table: pd.DataFrame, extensions: dict[str, str], template_headers: list[str]) -> _node_io.NodeFrame:
+   """
+   This function builds the follow-up node rows for every combination of case and visit,
+   ordered by case and then by visit, with only the fixed follow-up fields populated.
+
+   Parameters
+   ----------
+   case_table : pd.DataFrame
+      The case submitter IDs in the "*submitter_id" column
+   extensions : dict[str, str]
+      The submitter ID extension of each visit keyed by the DCC redcap_event_name
+   template_headers : list[str]
+      The header names extracted from the ARDaC follow-up node template
+
+   Return
+   ------
+   The follow-up node data with one row per case and visit, the source fields are virtual
+   empty columns
+   """
+   # The extensions have the dtype of the submitter IDs, so that an empty case table still gives string columns
+   visits = pd.DataFrame({"extension": pd.Series(list(extensions.values()), dtype=case_table["*submitter_id"].dtype)})
+   df_grid = case_table[["*submitter_id"]].merge(visits, how="cross")
+   follow_up_node = _mapping.build_node(_node_mappings.follow_up_visit_plan, df_grid, template_headers)
+
+   return follow_up_node
+
+
+def join_follow_up_source(df_output: pd.DataFrame, df_source: pd.DataFrame, plan: _mapping.MappingPlan, extensions: dict[str, str], case_suffix: str) -> None:
+   """
+   This function copies the fields of a DCC visit data source into the matching follow-up
+   rows in a single keyed join.  Source rows are matched to follow-up rows by the subject ID
+   and the visit extension of their redcap_event_name, and rows of unknown visits are ignored.
+   When a subject has more than one row for the same visit, the last row is used.  Every
+   matched follow-up row has all of the source fields overwritten, including with empty
+   values, so later sources take precedence over earlier ones for shared fields.
+
+   Parameters
+   ----------
+   df_output : pd.DataFrame
+      The follow-up node data to be updated in place
+   df_source : pd.DataFrame
+      The DCC visit data with "usubjid" and "redcap_event_name" columns
+   plan : _mapping.MappingPlan
+      The compiled mapping of the source fields to the ARDaC follow-up fields.  Source
+      fields missing from df_source are copied as empty values.
+   extensions : dict[str, str]
+      The submitter ID extension of each visit keyed by the DCC redcap_event_name
+   case_suffix : str
+      The suffix appended to the subject ID to form the case submitter ID
+   """
+   # Reduce the source to the known visits
+   df_visits = df_source[df_source["redcap_event_name"].isin(extensions.keys())]
+   # The extensions take the dtype of the subject IDs, as a categorical event name maps to a categorical and an empty one to no type
+   submitter_ids = df_visits["usubjid"] + case_suffix + df_visits["redcap_event_name"].map(extensions).astype(df_visits["usubjid"].dtype)
+
+   # Map the source fields and key them by follow-up submitter ID, keeping the last row of each visit
+   df_fields = _mapping.apply_mapping_plan(plan, df_visits).set_axis(submitter_ids)
+   df_fields = df_fields[df_fields.index.notna() & ~df_fields.index.duplicated(keep="last")]
+
+   # Only the first follow-up row with a given submitter ID receives values
+   output_ids = df_output["*submitter_id"]
+   positions = df_fields.index.get_indexer(output_ids)
+   positions[output_ids.duplicated(keep="first").to_numpy()] = -1
+   matched = positions >= 0
+   # Each field is gathered from its own column, so Arrow backed strings are never converted to Python objects.  The
+   # source fields are virtual empty columns of the follow-up rows until their source is joined
+   for column in plan.targets:
+      values = pd.Series(df_fields[column].array.take(positions, allow_fill=True), index=df_output.index)
+      df_output[column] = values.where(matched, df_output[column]) if column in df_output.columns else values
+
+
+def remove_empty_follow_up_rows(df_output: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+   """
+   This function removes the follow-up rows that have no values outside of the fixed
+   follow-up fields and records the removed rows for quality control.
+
+   Parameters
+   ----------
+   df_output : pd.DataFrame
+      The follow-up node data
+
+   Return
+   ------
+   df_output : pd.DataFrame
+      The follow-up node data without the empty rows
+   df_qc : pd.DataFrame
+      The subject and submitter IDs of the removed follow-up rows
+   """
+   with _metrics.stage('QC', rows_in=len(df_output)) as stage:
+      # Columns that define a row as "non-empty" (exclude the fixed columns)
+      non_empty_columns = list(set(df_output.columns) - set(_node_mappings.follow_up_visit_plan.targets))
+
+      # Identify the rows where all non-fixed columns are empty
+      empty_rows = df_output[non_empty_columns].isnull().all(axis=1)
+
+      # Record the QC information
+      df_qc = pd.DataFrame({
+         "usubjid": _node_io.case_subject_ids(df_output.loc[empty_rows, "cases.submitter_id"]),  # Extract usubjid
+         "*submitter_id": df_output.loc[empty_rows, "*submitter_id"],
+         "empty_follow-up": pd.Series("Y", index=df_output.index[empty_rows], dtype=_node_io.string_dtype())
+      }).reset_index(drop=True)
+      if df_qc.empty:
+         # No columns, so the QC file is written without a header as before
+         df_qc = pd.DataFrame()
+      stage.rows_out = len(df_qc)
+
+   return df_output[~empty_rows], df_qc
+
+
+def build_observational_follow_up_node(df_liver_scores_input: pd.DataFrame, df_med_info_input: pd.DataFrame, df_vitals_input: pd.DataFrame, df_soc_input: pd.DataFrame, df_case_input: pd.DataFrame, template_headers: list[str]) -> tuple[_node_io.NodeFrame, pd.DataFrame]:
+   """
+   This function takes the DCC observational liver scores, medical information, vitals, and SOC
+   data and the ARDaC observational case node data and generates the ARDaC observational
+   follow-up node data.
+
+   Parameters
+   ----------
+   df_liver_scores_input : pd.DataFrame
+      The DCC observational liver scores data
+   df_med_info_input : pd.DataFrame
+      The DCC observational medical information data
+   df_vitals_input : pd.DataFrame
+      The DCC observational vitals data
+   df_soc_input : pd.DataFrame
+      The DCC observational SOC data
+   df_case_input : pd.DataFrame
+      The ARDaC observational case node data
+   template_headers : list[str]
+      The header names extracted from the ARDaC follow-up node template
+
+   Return
+   ------
+   df_output : _node_io.NodeFrame
+      The observational follow-up node data with its virtual columns
+   df_qc : pd.DataFrame
+      The observational follow-up QC data
+   """
+   # Define the extensions for mapping
+   extensions = _node_mappings.obs_visit_extensions
+
+   with _metrics.stage('transform', rows_in=len(df_liver_scores_input) + len(df_med_info_input) + len(df_vitals_input) + len(df_soc_input)) as stage:
+      # Extract "*submitter_id" from df_case_input and create case_table
+      case_table = pd.DataFrame()
+      case_table["*submitter_id"] = df_case_input["*submitter_id"]
+
+      # Initialize the output DataFrame with one row per case and visit
+      follow_up_node = build_follow_up_skeleton(case_table, extensions, template_headers)
+      df_output = follow_up_node.data
+
+      # Join the liver scores, medical information, vitals, and SOC to the follow-up rows
+      join_follow_up_source(df_output, df_liver_scores_input, _node_mappings.liver_scores_plan, extensions, "_obs")
+      join_follow_up_source(df_output, df_med_info_input, _node_mappings.med_info_plan, extensions, "_obs")
+      join_follow_up_source(df_output, df_vitals_input, _node_mappings.vitals_plan, extensions, "_obs")
+      join_follow_up_source(df_output, df_soc_input, _node_mappings.soc_plan, extensions, "_obs")
+      stage.rows_out = len(df_output)
+
+   # Final check: Remove empty rows and log them in a QC file
+   df_output, df_qc = remove_empty_follow_up_rows(df_output)
+
+   return follow_up_node._replace(data=df_output), df_qc
+
+
+def build_clinical_follow_up_node(df_liver_scores_input: pd.DataFrame, df_vitals_input: pd.DataFrame, df_soc_input: pd.DataFrame, df_case_input: pd.DataFrame, template_headers: list[str]) -> tuple[_node_io.NodeFrame, pd.DataFrame]:
+   """
+   This function takes the DCC clinical liver scores, vitals, and SOC data and the ARDaC
+   clinical case node data and generates the ARDaC clinical follow-up node data.
+
+   Parameters
+   ----------
+   df_liver_scores_input : pd.DataFrame
+      The DCC clinical liver scores data
+   df_vitals_input : pd.DataFrame
+      The DCC clinical vitals data
+   df_soc_input : pd.DataFrame
+      The DCC clinical SOC data
+   df_case_input : pd.DataFrame
+      The ARDaC clinical case node data
+   template_headers : list[str]
+      The header names extracted from the ARDaC follow-up node template
+
+   Return
+   ------
+   df_output_rct : _node_io.NodeFrame
+      The clinical follow-up node data with its virtual columns
+   df_qc_rct : pd.DataFrame
+      The clinical follow-up QC data
+   """
+   # Define the extensions for mapping
+   extensions_rct = _node_mappings.rct_visit_extensions
+
+   with _metrics.stage('transform', rows_in=len(df_liver_scores_input) + len(df_vitals_input) + len(df_soc_input)) as stage:
+      # Extract "*submitter_id" from df_case_input and create case_table
+      case_table_rct = pd.DataFrame()
+      case_table_rct["*submitter_id"] = df_case_input["*submitter_id"]
+
+      # Initialize the output DataFrame with one row per case and visit
+      follow_up_node_rct = build_follow_up_skeleton(case_table_rct, extensions_rct, template_headers)
+      df_output_rct = follow_up_node_rct.data
+
+      # Join the liver scores, vitals, and SOC to the follow-up rows
+      # JRM: The medical information mapping was commented out in the Python workbook for some reason
+      join_follow_up_source(df_output_rct, df_liver_scores_input, _node_mappings.liver_scores_plan, extensions_rct, "_clinical")
+      join_follow_up_source(df_output_rct, df_vitals_input, _node_mappings.vitals_plan, extensions_rct, "_clinical")
+      join_follow_up_source(df_output_rct, df_soc_input, _node_mappings.soc_plan, extensions_rct, "_clinical")
+      stage.rows_out = len(df_output_rct)
+
+   # Final check: Remove empty rows and log them in a QC file
+   df_output_rct, df_qc_rct = remove_empty_follow_up_rows(df_output_rct)
+
+   return follow_up_node_rct._replace(data=df_output_rct), df_qc_rct
 
-def generate_observational_follow_up_node(obs_liver_scores_path: Path, obs_med_info_path: Path,  obs_vitals_path: Path, obs_soc_path: Path, obs_case_path: Path, template_headers: list[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
+
+def generate_observational_follow_up_node(obs_liver_scores_path: Path, obs_med_info_path: Path,  obs_vitals_path: Path, obs_soc_path: Path, obs_case_path: Path, template_headers: list[str], workers: int = 1) -> tuple[_node_io.NodeFrame, pd.DataFrame]:
    """
    This function takes the path to the DCC observational liver scores, medical information, vitals,
    SOC, and the ARDaC observational case node files and the ARDaC follow-up template headers to
@@ -27,440 +257,313 @@ def generate_observational_follow_up_node(obs_liver_scores_path: Path, obs_med_i
       The full path to the ARDaC observational case node TSV file
    template_headers : list[str]
       The header names extracted from the ARDaC follow-up node template
+   workers : int
+      The number of processes building shards of the subjects, see build_follow_up_node_in_shards
 
    Return
    ------
-   df_output : pd.DataFrame
-      The observational follow-up node data
+   df_output : _node_io.NodeFrame
+      The observational follow-up node data with its virtual columns
    df_qc : pd.DataFrame
       The observational follow-up QC data
    """
-   # Define the extensions for mapping
-   extensions = {"Week 0": "_0", "Week 4": "_28", "Week 12": "_84", "Week 24": "_168"}
-
    # Read the file using pandas
-   logger.info(f'Reading the observational liver scores file: {obs_liver_scores_path.as_posix()}')
-   df_obs_liver_scores_input = pd.read_csv(obs_liver_scores_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading observational liver scores file')
-
-   logger.info(f'Reading the observational medical information file: {obs_med_info_path.as_posix()}')
-   df_obs_med_info_input = pd.read_csv(obs_med_info_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading observational medical information file')
-
-   logger.info(f'Reading the observational vitals file: {obs_vitals_path.as_posix()}')
-   df_obs_vitals_input = pd.read_csv(obs_vitals_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading observational vitals file')
-
-   logger.info(f'Reading the observational SOC file: {obs_soc_path.as_posix()}')
-   df_obs_soc_input = pd.read_csv(obs_vitals_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading observational vitals file')
-
-   logger.info(f'Reading the observational ARDaC case file: {obs_case_path.as_posix()}')
-   df_obs_case_input = pd.read_csv(obs_case_path.as_posix(), sep='\t', dtype=str)
-   logger.info(f'Done reading observational case file')
-
-   # Extract "*submitter_id" from df_obs_case and create case_table
-   case_table = pd.DataFrame()
-   case_table["*submitter_id"] = df_obs_case_input["*submitter_id"]
-   case_table["usubjid"] = case_table["*submitter_id"].apply(lambda x: x.split("_")[0])  # Extract the number before "_"
-
-   # Initialize the output DataFrame with the headers
-   df_output = pd.DataFrame(columns=template_headers)
-
-   for _, row in case_table.iterrows():
-    submitter_id = row["*submitter_id"]
-
-    for week, ext in extensions.items():
-        new_row = {
-            "*type": "follow_up",
-            "project_id": "ARDaC-AlcHepNet",
-            "*submitter_id": f"{submitter_id}{ext}",
-            "cases.submitter_id": submitter_id,
-            "demographics.submitter_id": f"{submitter_id}_demographic",
-            "*days_to_follow_up": ext.lstrip("_"),  # Remove "_" from the extension
-            "visit_day": ext.lstrip("_")
-        }
-
-        df_output = pd.concat([df_output, pd.DataFrame([new_row])], ignore_index=True)
-   
-   # Process the liver scores and map values to follow-up rows
-   for _, row in df_obs_liver_scores_input.iterrows():
-      usubjid = row["usubjid"]
-      redcap_event_name = row["redcap_event_name"]
-
-      # Only process rows with valid weeks
-      if redcap_event_name not in extensions:
-         continue
-
-      # Convert redcap_event_name to the extension
-      extension = extensions[redcap_event_name]
-      submitter_id = f"{usubjid}_obs{extension}"
-
-      # Find the matching row in df_output
-      output_row_index = df_output[df_output["*submitter_id"] == submitter_id].index
-      if not output_row_index.empty:
-         # Perform the mapping
-         output_row_index = output_row_index[0]  # Get the first matching index
-         df_output.loc[output_row_index, "meld_score"] = row.get("meld", None)
-         df_output.loc[output_row_index, "child_pugh_score"] = row.get("cps", None)
-         df_output.loc[output_row_index, "tlfb_drinking_days"] = row.get("tlfbnumdd", None)
-         df_output.loc[output_row_index, "tlfb_number_drinks"] = row.get("tlfbnumd", None)
-         df_output.loc[output_row_index, "liver_score_date"] = row.get("liverdat", None)
-
-   # Process the medical information and map values to follow-up rows
-   for _, row in df_obs_med_info_input.iterrows():
-      usubjid = row["usubjid"]
-      redcap_event_name = row["redcap_event_name"]
-
-      # Only process rows with valid weeks
-      if redcap_event_name not in extensions:
-         continue
-
-      # Convert redcap_event_name to the extension
-      extension = extensions[redcap_event_name]
-      submitter_id = f"{usubjid}_obs{extension}"
-
-      # Find the matching row in df_output
-      output_row_index = df_output[df_output["*submitter_id"] == submitter_id].index
-      if not output_row_index.empty:
-         # Perform the mapping
-         output_row_index = output_row_index[0]  # Get the first matching index
-         df_output.loc[output_row_index, "ascites_culture"] = row.get("ascyn", None)
-         df_output.loc[output_row_index, "hep_enceph"] = row.get("hepenyn", None)
-         df_output.loc[output_row_index, "varices"] = row.get("varyn", None)
-         df_output.loc[output_row_index, "hep_carcinoma"] = row.get("hepcaryn", None)
-         df_output.loc[output_row_index, "liver_transplant"] = row.get("livtnsplyn", None)
-         df_output.loc[output_row_index, "ascites_date"] = row.get("ascdat", None)
-         df_output.loc[output_row_index, "hep_enceph_diagnosis_date"] = row.get("hependat", None)
-         df_output.loc[output_row_index, "varices_diagnosis_date"] = row.get("vardat", None)
-         df_output.loc[output_row_index, "hepcar_diagnosis_date"] = row.get("hepcardat", None)
-         df_output.loc[output_row_index, "liver_transplant_date"] = row.get("livtnspldat", None)
-
-   # Process the vitals and map values to follow-up rows
-   for _, row in df_obs_vitals_input.iterrows():
-      usubjid = row["usubjid"]
-      redcap_event_name = row["redcap_event_name"]
-
-      # Only process rows with valid weeks
-      if redcap_event_name not in extensions:
-         continue
-
-      # Convert redcap_event_name to the extension
-      extension = extensions[redcap_event_name]
-      submitter_id = f"{usubjid}_obs{extension}"
-
-      # Find the matching row in df_output
-      output_row_index = df_output[df_output["*submitter_id"] == submitter_id].index
-      if not output_row_index.empty:
-         # Perform the mapping
-         output_row_index = output_row_index[0]  # Get the first matching index
-         df_output.loc[output_row_index, "weight"] = row.get("weight", None)
-         df_output.loc[output_row_index, "bmi"] = row.get("bmi", None)
-   
-   # Process the SOC and map values to follow-up rows
-   for _, row in df_obs_soc_input.iterrows():
-      usubjid = row["usubjid"]
-      redcap_event_name = row["redcap_event_name"]
-
-      # Only process rows with valid weeks
-      if redcap_event_name not in extensions:
-         continue
-
-      # Convert redcap_event_name to the extension
-      extension = extensions[redcap_event_name]
-      submitter_id = f"{usubjid}_obs{extension}"
-
-      # Find the matching row in df_output
-      output_row_index = df_output[df_output["*submitter_id"] == submitter_id].index
-      if not output_row_index.empty:
-         # Perform the mapping
-         output_row_index = output_row_index[0]  # Get the first matching index
-         df_output.loc[output_row_index, "infection_screen_done"] = row.get("infscreennd", None)
-         df_output.loc[output_row_index, "infection_screen_date"] = row.get("infscreen_date", None)
-         df_output.loc[output_row_index, "blood_culture"] = row.get("socisbcnd___999", None)
-         df_output.loc[output_row_index, "blood_culture_result"] = row.get("socisbc", None)
-         df_output.loc[output_row_index, "blood_organism"] = row.get("socisbc_pos", None)
-         df_output.loc[output_row_index, "blood_culture_date"] = row.get("socisbcdat", None)
-         df_output.loc[output_row_index, "urine_culture"] = row.get("socisucnd___999", None)
-         df_output.loc[output_row_index, "urine_culture_result"] = row.get("socisuc", None)
-         df_output.loc[output_row_index, "urine_culture_organism"] = row.get("socisuc_pos", None)
-         df_output.loc[output_row_index, "urine_culture_date"] = row.get("socisucdat", None)
-         df_output.loc[output_row_index, "urine_culture_fungal_result"] = row.get("soicuc_fung", None)
-         df_output.loc[output_row_index, "ascites_culture"] = row.get("socisacnd___999", None)
-         df_output.loc[output_row_index, "ascites_culture_result"] = row.get("socisac", None)
-         df_output.loc[output_row_index, "ascites_organism"] = row.get("socisac_pos", None)
-         df_output.loc[output_row_index, "ascites_date"] = row.get("socisacdat", None)
-         df_output.loc[output_row_index, "endoscopy"] = row.get("endond", None)
-         df_output.loc[output_row_index, "endoscopy_date"] = row.get("endodat", None)
-         df_output.loc[output_row_index, "esophageal_varices_size"] = row.get("endovarsiz_esoph", None)
-         df_output.loc[output_row_index, "esophageal_varices_bleed"] = row.get("endobled_esoph", None)
-         df_output.loc[output_row_index, "gastric_varices_size"] = row.get("endovarsiz_gast", None)
-         df_output.loc[output_row_index, "gastric_varices_bleed"] = row.get("endobled_gast", None)
-         df_output.loc[output_row_index, "portal_hypertensive_gastropathy"] = row.get("porthypsev", None)
-         df_output.loc[output_row_index, "esophageal_ulcer_size"] = row.get("endoulcsiz_esoph", None)
-         df_output.loc[output_row_index, "esophageal_ulcer_bleed"] = row.get("endoulcbled_esoph", None)
-         df_output.loc[output_row_index, "gastric_ulcer_size"] = row.get("endoulcsiz_gast", None)
-         df_output.loc[output_row_index, "gastric_ulcer_bleed"] = row.get("endoulcbled_gast", None)
-         df_output.loc[output_row_index, "duodenum_ulcer_size"] = row.get("endoulcsiz_duod", None)
-         df_output.loc[output_row_index, "duodenum_ulcer_bleed"] = row.get("endoulcbled_duod", None)
-
-   # Final check: Remove empty rows and log them in a QC file
-   qc_records = []  # To store QC information for deleted rows
-
-   # Columns that define a row as "non-empty" (exclude the fixed columns)
-   non_empty_columns = list(set(df_output.columns) - {
-      "*type", "project_id", "*submitter_id", "cases.submitter_id",
-      "demographics.submitter_id", "*days_to_follow_up", "visit_day"
-   })
-
-   # Iterate over df_output rows to identify empty rows
-   for index, row in df_output.iterrows():
-      # Check if all non-fixed columns are empty
-      if row[non_empty_columns].isnull().all():
-         # Record the QC information
-         qc_records.append({
-            "usubjid": row["cases.submitter_id"].split("_")[0],  # Extract usubjid
-            "*submitter_id": row["*submitter_id"],
-            "empty_follow-up": "Y"
-         })
-         # Drop the empty row
-         df_output.drop(index, inplace=True)
-
-   # Save the QC records to a TSV file
-   qc_output_path = "follow-up_qc_obs_DCC_data_release_v2-0-0.tsv"
-   df_qc = pd.DataFrame(qc_records)
+   df_obs_liver_scores_input = _node_io.read_dcc_file(obs_liver_scores_path, _node_mappings.liver_scores_columns, 'observational liver scores', _node_mappings.liver_scores_optional_columns)
+   df_obs_med_info_input = _node_io.read_dcc_file(obs_med_info_path, _node_mappings.med_info_columns, 'observational medical information', _node_mappings.med_info_optional_columns)
+   df_obs_vitals_input = _node_io.read_dcc_file(obs_vitals_path, _node_mappings.vitals_columns, 'observational vitals', _node_mappings.vitals_optional_columns)
+   df_obs_soc_input = _node_io.read_dcc_file(obs_soc_path, _node_mappings.soc_columns, 'observational SOC', _node_mappings.soc_optional_columns)
+   df_obs_case_input = _node_io.read_case_node(obs_case_path, 'observational case')
+
+   if workers > 1:
+      df_output, df_qc = build_follow_up_node_in_shards(build_observational_follow_up_node, [df_obs_liver_scores_input, df_obs_med_info_input, df_obs_vitals_input, df_obs_soc_input],
+                                                        df_obs_case_input, _node_mappings.obs_visit_extensions, "_obs", template_headers, workers)
+   else:
+      df_output, df_qc = build_observational_follow_up_node(df_obs_liver_scores_input, df_obs_med_info_input, df_obs_vitals_input,
+                                                            df_obs_soc_input, df_obs_case_input, template_headers)
 
    return df_output, df_qc
 
-def generate_clinical_follow_up_node(rct_liver_scores_path: Path, rct_med_info_path: Path,  rct_vitals_path: Path, rct_soc_path: Path, rct_case_path: Path, template_headers: list[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
+
+def generate_clinical_follow_up_node(rct_liver_scores_path: Path, rct_med_info_path: Path,  rct_vitals_path: Path, rct_soc_path: Path, rct_case_path: Path, template_headers: list[str], workers: int = 1) -> tuple[_node_io.NodeFrame, pd.DataFrame]:
    """
    This function takes the path to the DCC clinical liver scores, medical information, vitals,
    SOC, and the ARDaC clinical case node files and the ARDaC follow-up template headers to
-   generate the clinical ARDaC follow-up node data.
+   generate the clinical ARDaC follow-up node data.  The clinical medical information is not
+   mapped yet, so the medical information file is not read.
 
    Parameters
    ----------
-   obs_liver_scores_path : Path
+   rct_liver_scores_path : Path
       The full path to the DCC clinical liver scores CSV file
-   obs_med_info_path : Path
+   rct_med_info_path : Path
       The full path to the DCC clinical medical information CSV file
-   obs_vitals_path : Path
+   rct_vitals_path : Path
       The full path to the DCC clinical vitals CSV file
-   obs_soc_path : Path
+   rct_soc_path : Path
       The full path to the DCC clinical SOC CSV file
-   obs_case_path : Path
+   rct_case_path : Path
       The full path to the ARDaC clinical case node TSV file
    template_headers : list[str]
       The header names extracted from the ARDaC follow-up node template
+   workers : int
+      The number of processes building shards of the subjects, see build_follow_up_node_in_shards
 
    Return
    ------
-   df_output : pd.DataFrame
-      The clinical follow-up node data
+   df_output : _node_io.NodeFrame
+      The clinical follow-up node data with its virtual columns
    df_qc : pd.DataFrame
       The clinical follow-up QC data
    """
-   # Define the extensions for mapping
-   extensions_rct = {"Day 0": "_0", "Day 3": "_3", "Day 7": "_7", "Day 14": "_14", "Day 28": "_28","Day 60": "_60","Day 90": "_90", "Day 180": "_180"}
-
    # Read the file using pandas
-   logger.info(f'Reading the clinical liver scores file: {rct_liver_scores_path.as_posix()}')
-   df_rct_liver_scores_input = pd.read_csv(rct_liver_scores_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading clinical liver scores file')
-
-   logger.info(f'Reading the clinical medical information file: {rct_med_info_path.as_posix()}')
-   df_rct_med_info_input = pd.read_csv(rct_med_info_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading clinical medical information file')
-
-   logger.info(f'Reading the clinical vitals file: {rct_vitals_path.as_posix()}')
-   df_rct_vitals_input = pd.read_csv(rct_vitals_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading clinical vitals file')
-
-   logger.info(f'Reading the clinical SOC file: {rct_soc_path.as_posix()}')
-   df_rct_soc_input = pd.read_csv(rct_vitals_path.as_posix(), sep=',', dtype=str)
-   logger.info(f'Done reading clinical vitals file')
-
-   logger.info(f'Reading the clinical ARDaC case file: {rct_case_path.as_posix()}')
-   df_rct_case_input = pd.read_csv(rct_case_path.as_posix(), sep='\t', dtype=str)
-   logger.info(f'Done reading clinical case file')
-
-   # Extract "*submitter_id" from df_obs_case and create case_table
-   case_table_rct = pd.DataFrame()
-   case_table_rct["*submitter_id"] = df_rct_case_input["*submitter_id"]
-   case_table_rct["usubjid"] = case_table_rct["*submitter_id"].apply(lambda x: x.split("_")[0])  # Extract the number before "_"
-
-   # Initialize the output DataFrame with the headers
-   df_output_rct = pd.DataFrame(columns=template_headers)
-
-   for _, row in case_table_rct.iterrows():
-      submitter_id = row["*submitter_id"]
-
-      for day, ext in extensions_rct.items():
-         new_row = {
-            "*type": "follow_up",
-            "project_id": "ARDaC-AlcHepNet",
-            "*submitter_id": f"{submitter_id}{ext}",
-            "cases.submitter_id": submitter_id,
-            "demographics.submitter_id": f"{submitter_id}_demographic",
-            "*days_to_follow_up": ext.lstrip("_"),  # Remove "_" from the extension
-            "visit_day": ext.lstrip("_")
-         }
-         
-         df_output_rct = pd.concat([df_output_rct, pd.DataFrame([new_row])], ignore_index=True)
-
-   # Process the liver scores and map values to follow-up rows
-   for _, row in df_rct_liver_scores_input.iterrows():
-      usubjid = row["usubjid"]
-      redcap_event_name = row["redcap_event_name"]
-
-      # Only process rows with valid Days
-      if redcap_event_name not in extensions_rct:
-         continue
-
-      # Convert redcap_event_name to the extension
-      extension = extensions_rct[redcap_event_name]
-      submitter_id = f"{usubjid}_clinical{extension}"
-
-      # Find the matching row in df_output
-      output_row_index = df_output_rct[df_output_rct["*submitter_id"] == submitter_id].index
-      if not output_row_index.empty:
-         # Perform the mapping
-         output_row_index = output_row_index[0]  # Get the first matching index
-         df_output_rct.loc[output_row_index, "meld_score"] = row.get("meld", None)
-         df_output_rct.loc[output_row_index, "child_pugh_score"] = row.get("cps", None)
-         df_output_rct.loc[output_row_index, "tlfb_drinking_days"] = row.get("tlfbnumdd", None)
-         df_output_rct.loc[output_row_index, "tlfb_number_drinks"] = row.get("tlfbnumd", None)
-         df_output_rct.loc[output_row_index, "liver_score_date"] = row.get("liverdat", None)
-   
-   # JRM: This was commented out in the Python workbook for some reason
-   # # Process the medinfo and map values to follow-up rows
-   # for _, row in tqdm(df_med_info.iterrows(), total=len(df_med_info), desc="Processing MedInfo"):
-   #     usubjid = row["usubjid"]
-   #     redcap_event_name = row["redcap_event_name"]
-
-   #     # Only process rows with valid weeks
-   #     if redcap_event_name not in extensions_rct:
-   #         continue
-
-   #     # Convert redcap_event_name to the extension
-   #     extension = extensions_rct[redcap_event_name]
-   #     submitter_id = f"{usubjid}_clinical{extension}"
-
-   #     # Find the matching row in df_output
-   #     output_row_index = df_output[df_output["*submitter_id"] == submitter_id].index
-   #     if not output_row_index.empty:
-   #         # Perform the mapping
-   #         output_row_index = output_row_index[0]  # Get the first matching index
-   #         df_output.loc[output_row_index, "ascites_culture"] = row.get("ascyn", None)
-   #         df_output.loc[output_row_index, "hep_enceph"] = row.get("hepenyn", None)
-   #         df_output.loc[output_row_index, "varices"] = row.get("varyn", None)
-   #         df_output.loc[output_row_index, "hep_carcinoma"] = row.get("hepcaryn", None)
-   #         df_output.loc[output_row_index, "liver_transplant"] = row.get("livtnsplyn", None)
-   #         df_output.loc[output_row_index, "ascites_date"] = row.get("ascdat", None)
-   #         df_output.loc[output_row_index, "hep_enceph_diagnosis_date"] = row.get("hependat", None)
-   #         df_output.loc[output_row_index, "varices_diagnosis_date"] = row.get("vardat", None)
-   #         df_output.loc[output_row_index, "hepcar_diagnosis_date"] = row.get("hepcardat", None)
-   #         df_output.loc[output_row_index, "liver_transplant_date"] = row.get("livtnspldat", None)
-
-   # Process the vitals and map values to follow-up rows
-   for _, row in df_rct_vitals_input.iterrows():
-      usubjid = row["usubjid"]
-      redcap_event_name = row["redcap_event_name"]
-
-      # Only process rows with valid weeks
-      if redcap_event_name not in extensions_rct:
-         continue
-
-      # Convert redcap_event_name to the extension
-      extension = extensions_rct[redcap_event_name]
-      submitter_id = f"{usubjid}_clinical{extension}"
-
-      # Find the matching row in df_output
-      output_row_index = df_output_rct[df_output_rct["*submitter_id"] == submitter_id].index
-      if not output_row_index.empty:
-         # Perform the mapping
-         output_row_index = output_row_index[0]  # Get the first matching index
-         df_output_rct.loc[output_row_index, "weight"] = row.get("weight", None)
-         df_output_rct.loc[output_row_index, "bmi"] = row.get("bmi", None)
-
-   # Process the SOC and map values to follow-up rows
-   for _, row in df_rct_soc_input.iterrows():
-      usubjid = row["usubjid"]
-      redcap_event_name = row["redcap_event_name"]
-
-      # Only process rows with valid weeks
-      if redcap_event_name not in extensions_rct:
-         continue
-
-      # Convert redcap_event_name to the extension
-      extension = extensions_rct[redcap_event_name]
-      submitter_id = f"{usubjid}_clinical{extension}"
-
-      # Find the matching row in df_output
-      output_row_index = df_output_rct[df_output_rct["*submitter_id"] == submitter_id].index
-
-      if not output_row_index.empty:
-         # Perform the mapping
-         output_row_index = output_row_index[0]  # Get the first matching index
-         df_output_rct.loc[output_row_index, "infection_screen_done"] = row.get("infscreennd", None)
-         df_output_rct.loc[output_row_index, "infection_screen_date"] = row.get("infscreen_date", None)
-         df_output_rct.loc[output_row_index, "blood_culture"] = row.get("socisbcnd___999", None)
-         df_output_rct.loc[output_row_index, "blood_culture_result"] = row.get("socisbc", None)
-         df_output_rct.loc[output_row_index, "blood_organism"] = row.get("socisbc_pos", None)
-         df_output_rct.loc[output_row_index, "blood_culture_date"] = row.get("socisbcdat", None)
-         df_output_rct.loc[output_row_index, "urine_culture"] = row.get("socisucnd___999", None)
-         df_output_rct.loc[output_row_index, "urine_culture_result"] = row.get("socisuc", None)
-         df_output_rct.loc[output_row_index, "urine_culture_organism"] = row.get("socisuc_pos", None)
-         df_output_rct.loc[output_row_index, "urine_culture_date"] = row.get("socisucdat", None)
-         df_output_rct.loc[output_row_index, "urine_culture_fungal_result"] = row.get("soicuc_fung", None)
-         df_output_rct.loc[output_row_index, "ascites_culture"] = row.get("socisacnd___999", None)
-         df_output_rct.loc[output_row_index, "ascites_culture_result"] = row.get("socisac", None)
-         df_output_rct.loc[output_row_index, "ascites_organism"] = row.get("socisac_pos", None)
-         df_output_rct.loc[output_row_index, "ascites_date"] = row.get("socisacdat", None)
-         df_output_rct.loc[output_row_index, "endoscopy"] = row.get("endond", None)
-         df_output_rct.loc[output_row_index, "endoscopy_date"] = row.get("endodat", None)
-         df_output_rct.loc[output_row_index, "esophageal_varices_size"] = row.get("endovarsiz_esoph", None)
-         df_output_rct.loc[output_row_index, "esophageal_varices_bleed"] = row.get("endobled_esoph", None)
-         df_output_rct.loc[output_row_index, "gastric_varices_size"] = row.get("endovarsiz_gast", None)
-         df_output_rct.loc[output_row_index, "gastric_varices_bleed"] = row.get("endobled_gast", None)
-         df_output_rct.loc[output_row_index, "portal_hypertensive_gastropathy"] = row.get("porthypsev", None)
-         df_output_rct.loc[output_row_index, "esophageal_ulcer_size"] = row.get("endoulcsiz_esoph", None)
-         df_output_rct.loc[output_row_index, "esophageal_ulcer_bleed"] = row.get("endoulcbled_esoph", None)
-         df_output_rct.loc[output_row_index, "gastric_ulcer_size"] = row.get("endoulcsiz_gast", None)
-         df_output_rct.loc[output_row_index, "gastric_ulcer_bleed"] = row.get("endoulcbled_gast", None)
-         df_output_rct.loc[output_row_index, "duodenum_ulcer_size"] = row.get("endoulcsiz_duod", None)
-         df_output_rct.loc[output_row_index, "duodenum_ulcer_bleed"] = row.get("endoulcbled_duod", None)
-
-   # Final check: Remove empty rows and log them in a QC file
-   qc_records_rct = []  # To store QC information for deleted rows
-
-   # Columns that define a row as "non-empty" (exclude the fixed columns)
-   non_empty_columns = list(set(df_output_rct.columns) - {
-      "*type", "project_id", "*submitter_id", "cases.submitter_id",
-      "demographics.submitter_id", "*days_to_follow_up", "visit_day"
-   })
-
-   # Iterate over df_output rows to identify empty rows
-   for index, row in df_output_rct.iterrows():
-      # Check if all non-fixed columns are empty
-      if row[non_empty_columns].isnull().all():
-         # Record the QC information
-         qc_records_rct.append({
-            "usubjid": row["cases.submitter_id"].split("_")[0],  # Extract usubjid
-            "*submitter_id": row["*submitter_id"],
-            "empty_follow-up": "Y"
-         })
-
-         # Drop the empty row
-         df_output_rct.drop(index, inplace=True)
-
-   # Save the QC records to a TSV file
-   
-   df_qc_rct = pd.DataFrame(qc_records_rct)
+   df_rct_liver_scores_input = _node_io.read_dcc_file(rct_liver_scores_path, _node_mappings.liver_scores_columns, 'clinical liver scores', _node_mappings.liver_scores_optional_columns)
+   df_rct_vitals_input = _node_io.read_dcc_file(rct_vitals_path, _node_mappings.vitals_columns, 'clinical vitals', _node_mappings.vitals_optional_columns)
+   df_rct_soc_input = _node_io.read_dcc_file(rct_soc_path, _node_mappings.soc_columns, 'clinical SOC', _node_mappings.soc_optional_columns)
+   df_rct_case_input = _node_io.read_case_node(rct_case_path, 'clinical case')
+
+   if workers > 1:
+      df_output_rct, df_qc_rct = build_follow_up_node_in_shards(build_clinical_follow_up_node, [df_rct_liver_scores_input, df_rct_vitals_input, df_rct_soc_input],
+                                                                df_rct_case_input, _node_mappings.rct_visit_extensions, "_clinical", template_headers, workers)
+   else:
+      df_output_rct, df_qc_rct = build_clinical_follow_up_node(df_rct_liver_scores_input, df_rct_vitals_input, df_rct_soc_input,
+                                                               df_rct_case_input, template_headers)
 
    return df_output_rct, df_qc_rct
 
    
+def stream_follow_up_node(build_follow_up_node: Callable[..., tuple[_node_io.NodeFrame, pd.DataFrame]], sources: list[tuple[Path, list[str], list[str], str]],
+                          case_path: Path, extensions: dict[str, str], case_suffix: str, template_headers: list[str],
+                          node_file_path: Path, node_file_qc_path: Path, chunk_size: int, temp_path: Path | None,
+                          validate: bool = False) -> pd.DataFrame | None:
+   """
+   This function generates the follow-up node and QC files out of core, for inputs larger than
+   memory.  The case node submitter IDs and each DCC visit data source are externally sorted by
+   case submitter ID into temporary run files.  The sorted cases are then taken in batches of
+   about chunk_size subjects, the source rows of those subjects are taken from a k-way merge of
+   each source's runs, and the batch is built with the in-memory follow-up builder and appended
+   to the node and QC files.  Memory use depends on the chunk size, not on the cohort size.
+
+   A subject's follow-up rows only depend on the source rows of that subject, so the files have
+   the same rows as the in-memory mapper, ordered by case submitter ID instead of by case node
+   order.  Both orders are the same when the case node is sorted by subject ID.
+
+   Parameters
+   ----------
+   build_follow_up_node : Callable[..., tuple[_node_io.NodeFrame, pd.DataFrame]]
+      build_observational_follow_up_node or build_clinical_follow_up_node
+   sources : list[tuple[Path, list[str], list[str], str]]
+      The path, DCC columns, optional DCC columns, and description of each visit data source, in the argument order
+      of build_follow_up_node
+   case_path : Path
+      The full path to the ARDaC case node TSV file
+   extensions : dict[str, str]
+      The submitter ID extension of each visit keyed by the DCC redcap_event_name
+   case_suffix : str
+      The suffix appended to the subject ID to form the case submitter ID
+   template_headers : list[str]
+      The header names extracted from the ARDaC follow-up node template
+   node_file_path : Path
+      The full path to the follow-up node TSV file to be written
+   node_file_qc_path : Path
+      The full path to the follow-up QC TSV file to be written
+   chunk_size : int
+      The number of rows in each sorted run and the number of subjects built at a time
+   temp_path : Path | None
+      The directory for the temporary run files, or None for the system default
+   validate : bool
+      When true each batch is checked against the follow-up node schema rules
+
+   Return
+   ------
+   The violations report of the follow-up node when validate is true, otherwise None
+   """
+   df_reports = []
+   with tempfile.TemporaryDirectory(prefix='follow_up_', dir=temp_path) as run_directory:
+      # Sort the case submitter IDs, skipping rows without one
+      case_chunks = (df_chunk.dropna(subset=["*submitter_id"])
+                     for df_chunk in _node_io.read_csv_column_chunks(case_path, ["*submitter_id"], '\t', 'case node', chunk_size))
+      case_runs = _external_sort.write_sorted_runs(case_chunks, "*submitter_id", run_directory, 'case')
+      _, case_rows = _external_sort.merge_sorted_runs(case_runs, "*submitter_id", chunk_size)
+
+      # Sort the rows of known visits of each source by the case submitter ID of the subject
+      source_groups = []
+      source_columns = []
+      for source_number, (source_path, columns, optional_columns, description) in enumerate(sources):
+         visit_chunks = (df_chunk[df_chunk["usubjid"].notna() & df_chunk["redcap_event_name"].isin(extensions.keys())]
+                         for df_chunk in _node_io.read_dcc_file_chunks(source_path, columns, description, chunk_size, optional_columns))
+         keyed_chunks = (df_visits.assign(**{"*submitter_id": df_visits["usubjid"] + case_suffix}) for df_visits in visit_chunks)
+         source_runs = _external_sort.write_sorted_runs(keyed_chunks, "*submitter_id", run_directory, f'source_{source_number}')
+         run_columns, source_rows = _external_sort.merge_sorted_runs(source_runs, "*submitter_id", chunk_size)
+         source_groups.append(_external_sort.KeyedGroups(source_rows, run_columns.index("*submitter_id")))
+         source_columns.append(run_columns)
+
+      qc_written = False
+      subject_count = 0
+      for batch_number, case_batch in enumerate(case_batches(case_rows, chunk_size)):
+         batch_keys = {row[0] for row in case_batch}
+         last_key = case_batch[-1][0] if case_batch else ''
+         df_case_input = pd.DataFrame({"*submitter_id": [row[0] for row in case_batch]}, dtype=_node_io.string_dtype())
+         df_source_inputs = [pd.DataFrame.from_records(groups.take_through(last_key, batch_keys), columns=columns)
+                             .drop(columns=["*submitter_id", _external_sort.row_column]).astype(_node_io.string_dtype())
+                             for groups, columns in zip(source_groups, source_columns)]
+
+         follow_up_node, df_qc = build_follow_up_node(*df_source_inputs, df_case_input, template_headers)
+
+         # Only the first batch creates the node file and writes the header
+         _node_io.write_tsv(follow_up_node, node_file_path, append=batch_number > 0)
+         if not df_qc.empty:
+            _node_io.write_tsv(df_qc, node_file_qc_path, append=qc_written)
+            qc_written = True
+         if validate:
+            df_reports.append(_validation.validate_node(follow_up_node, _node_schemas.follow_up_rules, f'follow-up node batch {batch_number + 1}'))
+         subject_count += len(case_batch)
+         logger.debug(f'Built the follow-up rows of {subject_count} cases')
+
+      if not qc_written:
+         # No empty follow-up rows, so the QC file is written without a header as before
+         _node_io.write_tsv(pd.DataFrame(), node_file_qc_path)
+
+   return _validation.combine_reports(df_reports, _node_schemas.follow_up_rules) if validate else None
+
+
+def case_batches(case_rows: Iterator[tuple], batch_size: int) -> Iterator[list[tuple]]:
+   """
+   This function groups sorted case rows into batches of at least batch_size rows, except for
+   the last batch, without splitting rows with the same submitter ID across batches.  At least
+   one batch is produced, which is empty when there are no cases.
+
+   Parameters
+   ----------
+   case_rows : Iterator[tuple]
+      The case rows sorted by submitter ID, with the submitter ID first
+   batch_size : int
+      The minimum number of rows in each batch
+
+   Return
+   ------
+   An iterator over the batches of case rows
+   """
+   batch = []
+   for _, group in itertools.groupby(case_rows, key=operator.itemgetter(0)):
+      if len(batch) >= batch_size:
+         yield batch
+         batch = []
+      batch.extend(group)
+   yield batch
+
+
+def build_follow_up_shard(build_follow_up_node: Callable[..., tuple[_node_io.NodeFrame, pd.DataFrame]], df_source_inputs: list[pd.DataFrame], df_case_input: pd.DataFrame,
+                          template_headers: list[str], case_positions: np.ndarray, visit_count: int) -> tuple[_node_io.NodeFrame, pd.DataFrame]:
+   """
+   This function builds the follow-up node and QC data of one shard of the cases in a worker
+   process.  The follow-up builder numbers the rows of its case and visit grid, visit_count
+   rows per case, and keeps that number as the index of the rows it does not remove.  Each
+   node and QC row is given the number of its grid row in the build of all cases instead, so
+   that the shards can be put back in the original order.
+
+   Parameters
+   ----------
+   build_follow_up_node : Callable[..., tuple[_node_io.NodeFrame, pd.DataFrame]]
+      build_observational_follow_up_node or build_clinical_follow_up_node
+   df_source_inputs : list[pd.DataFrame]
+      The DCC visit data rows of the shard's subjects, in the argument order of build_follow_up_node
+   df_case_input : pd.DataFrame
+      The case node rows of the shard
+   template_headers : list[str]
+      The header names extracted from the ARDaC follow-up node template
+   case_positions : np.ndarray
+      The position in the case node of each case row of the shard
+   visit_count : int
+      The number of visits of each case
+
+   Return
+   ------
+   follow_up_node : _node_io.NodeFrame
+      The follow-up node data of the shard, indexed by grid row number
+   df_qc : pd.DataFrame
+      The follow-up QC data of the shard, indexed by grid row number
+   """
+   follow_up_node, df_qc = build_follow_up_node(*df_source_inputs, df_case_input, template_headers)
+
+   grid_rows = follow_up_node.data.index.to_numpy()
+   follow_up_node.data.index = case_positions[grid_rows // visit_count] * visit_count + grid_rows % visit_count
+   if not df_qc.columns.empty:
+      # The QC rows are the removed grid rows, in grid order
+      removed_rows = np.setdiff1d(np.arange(len(case_positions) * visit_count), grid_rows)
+      df_qc.index = case_positions[removed_rows // visit_count] * visit_count + removed_rows % visit_count
+
+   return follow_up_node, df_qc
+
+
+def build_follow_up_node_in_shards(build_follow_up_node: Callable[..., tuple[_node_io.NodeFrame, pd.DataFrame]], df_source_inputs: list[pd.DataFrame], df_case_input: pd.DataFrame,
+                                   extensions: dict[str, str], case_suffix: str, template_headers: list[str], workers: int) -> tuple[_node_io.NodeFrame, pd.DataFrame]:
+   """
+   This function builds the follow-up node and QC data with a pool of worker processes.  The
+   cases and the DCC visit data rows are partitioned into workers shards by a hash of the case
+   submitter ID, the subject ID followed by the case suffix, which is the key the visit data
+   rows are joined to the follow-up rows on.  A subject's follow-up rows only depend on its own
+   rows, so each shard is built independently, and the shards are concatenated in the case
+   node order.  The data is the same as that built by build_follow_up_node in one process.
+
+   Parameters
+   ----------
+   build_follow_up_node : Callable[..., tuple[_node_io.NodeFrame, pd.DataFrame]]
+      build_observational_follow_up_node or build_clinical_follow_up_node
+   df_source_inputs : list[pd.DataFrame]
+      The DCC visit data sources, in the argument order of build_follow_up_node
+   df_case_input : pd.DataFrame
+      The ARDaC case node data
+   extensions : dict[str, str]
+      The submitter ID extension of each visit keyed by the DCC redcap_event_name
+   case_suffix : str
+      The suffix appended to the subject ID to form the case submitter ID
+   template_headers : list[str]
+      The header names extracted from the ARDaC follow-up node template
+   workers : int
+      The number of shards and worker processes
+
+   Return
+   ------
+   follow_up_node : _node_io.NodeFrame
+      The follow-up node data with its virtual columns
+   df_qc : pd.DataFrame
+      The follow-up QC data
+   """
+   with _metrics.stage('transform', rows_in=sum(len(df_source) for df_source in df_source_inputs)) as stage:
+      case_shards = _sharding.shard_numbers(df_case_input["*submitter_id"], workers)
+      source_shards = [_sharding.shard_numbers(df_source["usubjid"] + case_suffix, workers) for df_source in df_source_inputs]
+
+      logger.info(f'Building the follow-up node in {workers} shards of subjects')
+      shard_builds = []
+      # The workers build the node columns with the string dtype of this process
+      with ProcessPoolExecutor(max_workers=workers, initializer=_node_io.set_arrow_strings, initargs=(_node_io.arrow_strings,)) as executor:
+         for shard in range(workers):
+            in_shard = case_shards == shard
+            if not in_shard.any():
+               continue
+            shard_source_inputs = [df_source[shards == shard] for df_source, shards in zip(df_source_inputs, source_shards)]
+            shard_builds.append(executor.submit(build_follow_up_shard, build_follow_up_node, shard_source_inputs, df_case_input[in_shard],
+                                                template_headers, np.flatnonzero(in_shard), len(extensions)))
+         shard_results = [shard_build.result() for shard_build in shard_builds]
+
+      if not shard_results:
+         # No cases, so there is nothing to shard
+         return build_follow_up_node(*df_source_inputs, df_case_input, template_headers)
+
+      # Every shard declares the same virtual columns
+      df_output = pd.concat([shard_node.data for shard_node, _ in shard_results]).sort_index()
+      follow_up_node = shard_results[0][0]._replace(data=df_output)
+      qc_shards = [df_shard_qc for _, df_shard_qc in shard_results if not df_shard_qc.columns.empty]
+      if qc_shards:
+         df_qc = pd.concat(qc_shards).sort_index().reset_index(drop=True)
+      else:
+         # No empty follow-up rows, so the QC file is written without a header as before
+         df_qc = pd.DataFrame()
+      stage.rows_out = len(df_output)
+
+   return follow_up_node, df_qc
+
+
 def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
    """
    This function implements the steps needed for converting observational or clinical
@@ -474,6 +577,9 @@ def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
    logger : logging.Logger
       The logger to be used to provide user feedback
    """
+   _node_io.set_io_engine(command_arguments.ioEngine)
+   _node_io.set_arrow_strings(command_arguments.arrowStrings)
+
    template_path = Path(command_arguments.nodeTemplatesPath, _constants.follow_up_template_file_name)
    dcc_liver_scores_path = Path(command_arguments.dccLiverScoresFile)
    dcc_med_info_path = Path(command_arguments.dccMedInfoFile)
@@ -507,91 +613,137 @@ def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
    
    if command_arguments.subjectsType == 'observational':
       case_file_path = Path(node_output_path, _constants.case_obs_file_name)
+      manifest_path = Path(node_output_path, _constants.follow_up_obs_manifest_file_name)
+      dcc_input_paths = {'liver scores': dcc_liver_scores_path, 'medical information': dcc_med_info_path, 'vitals': dcc_vitals_path, 'SOC': dcc_soc_path}
    elif command_arguments.subjectsType == 'clinical':
       case_file_path = Path(node_output_path, _constants.case_rct_file_name)
+      manifest_path = Path(node_output_path, _constants.follow_up_rct_manifest_file_name)
+      # The clinical medical information is not mapped yet
+      dcc_input_paths = {'liver scores': dcc_liver_scores_path, 'vitals': dcc_vitals_path, 'SOC': dcc_soc_path}
    else:
       raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
 
+   if command_arguments.caseNodeFile is not None:
+      case_file_path = Path(command_arguments.caseNodeFile)
+
    if not case_file_path.is_file():
       logger.critical('Cannot find ARDaC case file: ' + case_file_path.as_posix())
       raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), case_file_path.as_posix())
-   
-   # Read the template TSV file to extract the headers
-   logger.info(f'Reading follow-up template CSV file: {template_path.as_posix()}')
-   df_template = pd.read_csv(template_path.as_posix(), sep='\t', nrows=0)  # Read only the header
-   template_headers = df_template.columns.tolist()  # Extract the headers as a list
 
-   if command_arguments.subjectsType == 'observational':
+   # Skip the run when the node files of a previous run with the same inputs are up to date
+   manifest = _manifest.build_manifest(Path(__file__), command_arguments.subjectsType, dict(dcc_input_paths, case=case_file_path), {'follow-up': template_path}, {'out_of_core': command_arguments.outOfCore, 'validate': command_arguments.validate})
+   if not command_arguments.force and _manifest.is_cached(manifest_path, manifest, node_output_path):
+      logger.info(f'cached: the {command_arguments.subjectsType} follow-up node is up to date, use --force to regenerate it')
+      _metrics.record_cached()
+      return 0
+
+   if command_arguments.outOfCore and command_arguments.chunkSize < 1:
+      raise ValueError(f'The chunk size must be a positive number of rows, not {command_arguments.chunkSize}')
+
+   if command_arguments.workers < 1:
+      raise ValueError(f'The number of workers must be a positive number of processes, not {command_arguments.workers}')
+
+   if command_arguments.outOfCore and command_arguments.workers > 1:
+      raise ValueError('The --workers argument cannot be combined with --out_of_core')
+
+   # Read the template TSV file to extract the headers
+   template_headers = _node_io.read_template_headers(template_path)
+
+   df_report = None
+   if command_arguments.outOfCore:
+      temp_path = Path(command_arguments.tempPath) if command_arguments.tempPath else None
+      if command_arguments.subjectsType == 'observational':
+         logger.info('Extracting observational follow-up data and creating ARDaC follow-up node out of core')
+         node_file_path = Path(node_output_path, _constants.follow_up_obs_file_name)
+         node_file_qc_path = Path(node_output_path, _constants.follow_up_qc_obs_file_name)
+         sources = [(dcc_liver_scores_path, _node_mappings.liver_scores_columns, _node_mappings.liver_scores_optional_columns, 'observational liver scores'),
+                    (dcc_med_info_path, _node_mappings.med_info_columns, _node_mappings.med_info_optional_columns, 'observational medical information'),
+                    (dcc_vitals_path, _node_mappings.vitals_columns, _node_mappings.vitals_optional_columns, 'observational vitals'),
+                    (dcc_soc_path, _node_mappings.soc_columns, _node_mappings.soc_optional_columns, 'observational SOC')]
+         df_report = stream_follow_up_node(build_observational_follow_up_node, sources, case_file_path, _node_mappings.obs_visit_extensions, "_obs",
+                                           template_headers, node_file_path, node_file_qc_path, command_arguments.chunkSize, temp_path,
+                                           command_arguments.validate)
+      else:
+         logger.info('Extracting clinical follow-up data and creating ARDaC follow-up node out of core')
+         node_file_path = Path(node_output_path, _constants.follow_up_rct_file_name)
+         node_file_qc_path = Path(node_output_path, _constants.follow_up_qc_rct_file_name)
+         sources = [(dcc_liver_scores_path, _node_mappings.liver_scores_columns, _node_mappings.liver_scores_optional_columns, 'clinical liver scores'),
+                    (dcc_vitals_path, _node_mappings.vitals_columns, _node_mappings.vitals_optional_columns, 'clinical vitals'),
+                    (dcc_soc_path, _node_mappings.soc_columns, _node_mappings.soc_optional_columns, 'clinical SOC')]
+         df_report = stream_follow_up_node(build_clinical_follow_up_node, sources, case_file_path, _node_mappings.rct_visit_extensions, "_clinical",
+                                           template_headers, node_file_path, node_file_qc_path, command_arguments.chunkSize, temp_path,
+                                           command_arguments.validate)
+      logger.info(f'Follow-up node saved as: {node_file_path.as_posix()}')
+      logger.info(f'Follow-up QC file saved as: {node_file_qc_path.as_posix()}')
+   elif command_arguments.subjectsType == 'observational':
       logger.info('Extracting observational follow-up data and creating ARDaC follow-up node')
       node_file_path = Path(node_output_path, _constants.follow_up_obs_file_name)
       node_file_qc_path = Path(node_output_path, _constants.follow_up_qc_obs_file_name)
       df_obs_output, df_qc_obs = generate_observational_follow_up_node(dcc_liver_scores_path, dcc_med_info_path,
-                                                                       dcc_vitals_path, dcc_soc_path, case_file_path, template_headers)
-      df_obs_output.to_csv(node_file_path.as_posix(), sep='\t', index=False, header=True)
+                                                                       dcc_vitals_path, dcc_soc_path, case_file_path, template_headers,
+                                                                       command_arguments.workers)
+      _node_io.write_tsv(df_obs_output, node_file_path)
       logger.info(f'Observational follow-up node saved as: {node_file_path.as_posix()}')
-      df_qc_obs.to_csv(node_file_qc_path.as_posix(), sep='\t', index=False, header=True)
+      _node_io.write_tsv(df_qc_obs, node_file_qc_path)
       logger.info(f'Observational follow-up QC file saved as: {node_file_qc_path.as_posix()}')
+      if command_arguments.validate:
+         df_report = _validation.validate_node(df_obs_output, _node_schemas.follow_up_rules, 'observational follow-up node')
    elif command_arguments.subjectsType == 'clinical':
       logger.info('Extracting clinical follow-up data and creating ARDaC follow-up node')
       node_file_path = Path(node_output_path, _constants.follow_up_rct_file_name)
       node_file_qc_path = Path(node_output_path, _constants.follow_up_qc_rct_file_name)
       df_rct_output, df_qc_rct = generate_clinical_follow_up_node(dcc_liver_scores_path, dcc_med_info_path,
-                                                                  dcc_vitals_path, dcc_soc_path, case_file_path, template_headers)
-      df_rct_output.to_csv(node_file_path.as_posix(), sep='\t', index=False, header=True)
+                                                                  dcc_vitals_path, dcc_soc_path, case_file_path, template_headers,
+                                                                  command_arguments.workers)
+      _node_io.write_tsv(df_rct_output, node_file_path)
       logger.info(f'Clinical follow-up node saved as: {node_file_path.as_posix()}')
-      df_qc_rct.to_csv(node_file_qc_path.as_posix(), sep='\t', index=False, header=True)
+      _node_io.write_tsv(df_qc_rct, node_file_qc_path)
       logger.info(f'Clinical QC file saved as: {node_file_qc_path.as_posix()}')
+      if command_arguments.validate:
+         df_report = _validation.validate_node(df_rct_output, _node_schemas.follow_up_rules, 'clinical follow-up node')
    else:
       raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
 
+   output_paths = [node_file_path, node_file_qc_path]
+   if command_arguments.validate:
+      output_paths.append(_validation.write_report(df_report, node_file_path, f'{command_arguments.subjectsType.capitalize()} follow-up node'))
 
-if __name__ == '__main__':
-   status = 0
+   _manifest.write_manifest(manifest_path, manifest, output_paths)
+
+   return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of this utility."""
    parser = argparse.ArgumentParser(
+      prog=Path(__file__).name,
       description='''This utility generates ARDaC follow-up nodes from ARDaC case nodes and observational or clinical trial DCC liver scores, medical information, vitals, and SOC data provided in CSV format files.
          The user must provide the location of the ARDaC follow-up node template file, the CSV files containing the DCC datasets, and the
          path to where the ARDaC follow-up node and quality control files are to be written.''',
       epilog=f'''Observational follow-up node files are named \'{_constants.follow_up_obs_file_name}\', and observational QC files are named \'{_constants.follow_up_qc_obs_file_name}\'.
          Clinical follow-up node files are named \'{_constants.follow_up_rct_file_name}\', and clinical QC files are named \'{_constants.follow_up_qc_rct_file_name}\'.  Node files are written to the directory given by the --node_output_path argument.
          The ARDaC case node input TSV file also expected to be at this location.''')
-   valid_log_level_names_mapping = logging.getLevelNamesMapping()
-   valid_log_level_names_mapping.pop('NOTSET') # Remove NOTSET option value
-   parser.add_argument('--version', action='version', version=f'DCC_VERSION={_constants.dcc_release_string},MAPPING_VERSION={_constants.mapping_version_string}')
-   parser.add_argument('--dcc_version', action='version', version=f'{_constants.dcc_release_string}')
-   parser.add_argument('--mapping_version', action='version', version=f'{_constants.mapping_version_string}')
-   parser.add_argument('--log_level', dest='logLevel', default='INFO', choices=list(valid_log_level_names_mapping.keys()), help='A standard log level from the Python logger package')
-   parser.add_argument('--node_templates_path', dest='nodeTemplatesPath', required=True, help='Path to the directory where the ARDaC node template TSV files are located')
-   parser.add_argument('--subjects_type', dest='subjectsType', required=True, choices=['observational', 'clinical'], help='Value indicating if the input subject data is from clinical trial subjects or observational study subjects')
+   _cli.add_common_arguments(parser, io_engines=_node_io.io_engines, force=True,
+                             validate_help=f'Check the follow-up node against the type and enum rules of the ARDaC follow-up node schema, and save a report of the violations next to the node file, named for example {_validation.report_file_path(Path(_constants.follow_up_obs_file_name)).name}',
+                             metrics_stages='read, template-load, transform, QC, validate, and write', node_templates=True, subjects_type=True)
    parser.add_argument('--dcc_liver_scores_file', dest='dccLiverScoresFile', required=True, help='Full path to the DCC input liver scores file in CSV format')
    parser.add_argument('--dcc_med_info_file', dest='dccMedInfoFile', required=True, help='Full path to the DCC input medical information file in CSV format')
    parser.add_argument('--dcc_vitals_file', dest='dccVitalsFile', required=True, help='Full path to the DCC input vitals file in CSV format')
    parser.add_argument('--dcc_soc_file', dest='dccSOCFile', required=True, help='Full path to the DCC input SOC file in CSV format')
    parser.add_argument('--node_output_path', dest='nodeOutputPath', required=True, help=f'Path to the directory where the TSV case node file is to be saved.  The file name will be either {_constants.case_obs_file_name} or {_constants.case_rct_file_name}')
+   parser.add_argument('--out_of_core', dest='outOfCore', action='store_true', help='Sort the case node and DCC files into temporary run files and build the follow-up node a batch of subjects at a time, for inputs larger than memory.  Rows are written in case submitter ID order')
+   parser.add_argument('--chunk_size', dest='chunkSize', type=int, default=100000, help='With --out_of_core, the number of rows in each sorted run file and the number of subjects built at a time')
+   parser.add_argument('--workers', dest='workers', type=int, default=1, help='Build the follow-up node with this many worker processes, each building the subjects of one shard partitioned by a hash of the subject ID.  The files are the same as those built by one process.  Cannot be combined with --out_of_core')
+   parser.add_argument('--temp_path', dest='tempPath', default=None, help='With --out_of_core, the directory for the temporary run files.  The system temporary directory is used by default')
+   parser.add_argument('--case_node_file', dest='caseNodeFile', default=None, help='Full path to the input ARDaC case node TSV file, with its Arrow IPC sidecar file next to it when there is one.  By default the case node file is read from the --node_output_path directory')
 
-   parsed_args = parser.parse_args()
-   
-   # Configure and create logger for standard output
-   console_handler = logging.StreamHandler(sys.stdout)
-   console_handler.setLevel(parsed_args.logLevel)
-   console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-
-   logging.basicConfig(
-      level = parsed_args.logLevel,
-      handlers = [console_handler]
-   )
-
-   logger = logging.getLogger(parser.prog)
-   logger.setLevel(parsed_args.logLevel)
-
-   try:
-      # Status codes greater than zero and less than three are reserved for command line processing errors
-      status = 3
-      status = main(parsed_args, logger)
-   except FileNotFoundError as e:
-      logger.critical(f'Input file not found: {e}')
-   except ValueError as e:
-      logger.critical(f'Command line argument or parameter had a bad value: {e}')
-   except Exception as e:
-      logger.critical('Caught an exception', exc_info=True)
-   
-   exit(status)
\ No newline at end of file
+   return parser
+
+
+def run(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """Run this utility with its parsed command line arguments and give the exit status, see _cli.run_main."""
+   return _cli.run_main(main, command_arguments, logger, Path(__file__).name, {'io_engine': command_arguments.ioEngine, 'arrow_strings': command_arguments.arrowStrings})
+
+
+if __name__ == '__main__':
+   exit(_cli.run_script(build_parser(), run))
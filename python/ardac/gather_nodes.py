@@ -0,0 +1,181 @@
+import os
+import errno
+import argparse
+import logging
+import pandas as pd
+from pathlib import Path
+from . import _cli
+from . import _constants
+from . import _delta
+from . import _metrics
+from . import _node_io
+from . import _node_schemas
+from . import _validation
+
+logger = logging.getLogger(__name__)
+
+# The schema rules checked by --validate for each node, the QC files are not validated
+node_rules = {
+   'case node': _node_schemas.case_rules,
+   'demographic node': _node_schemas.demographic_rules,
+   'follow-up node': _node_schemas.follow_up_rules,
+   'audit node': _node_schemas.audit_rules,
+}
+
+
+def gather_node(df_shards: list[pd.DataFrame], key_column: str, subject_order: pd.Series | None) -> pd.DataFrame:
+   """
+   This function combines the node or QC data written for the shards of a subjects type into
+   the node data of a full run.  The rows are ordered by the position of their subject in the
+   subjects file and the rows of each subject keep their order, so the result does not depend
+   on the order of the shards.  A QC file left without rows has no columns, as when it is
+   written by a full run.
+
+   Parameters
+   ----------
+   df_shards : list[pd.DataFrame]
+      The node data of each shard, read by _node_io.read_node_text
+   key_column : str
+      The column holding the subject ID, or the case submitter ID of the subject
+   subject_order : pd.Series | None
+      The position of each subject in the subjects file indexed by subject ID, or None when
+      the subject IDs are not unique and every row is in one shard
+
+   Return
+   ------
+   A pandas dataframe containing the node data of every subject
+   """
+   frames = [df_shard for df_shard in df_shards if not df_shard.columns.empty]
+   if not frames:
+      return pd.DataFrame()
+   df_node = pd.concat(frames, ignore_index=True)[frames[0].columns]
+   if subject_order is None:
+      return df_node
+   return _delta.splice_node(pd.DataFrame(), df_node, key_column, set(), subject_order)
+
+
+def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """
+   This function combines the case, demographic, follow-up, and audit node and QC files
+   written by the node mappers for each shard made by scatter_dcc.py into the node files of
+   the subjects type.
+
+   Parameters
+   ----------
+   command_arguments : argparse.Namespace
+      The command line arguments processed by argparse
+   logger : logging.Logger
+      The logger to be used to provide user feedback
+   """
+   _node_io.set_io_engine(command_arguments.ioEngine)
+   _node_io.set_arrow_strings(command_arguments.arrowStrings)
+
+   dcc_subjects_path = Path(command_arguments.dccSubjectsFile)
+   shard_node_paths = [Path(shard_node_file) for shard_node_file in command_arguments.shardNodeFiles]
+   node_output_path = Path(command_arguments.nodeOutputPath)
+
+   if not dcc_subjects_path.is_file():
+      logger.critical('Cannot find DCC subjects file: ' + dcc_subjects_path.as_posix())
+      raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), dcc_subjects_path.as_posix())
+
+   for shard_node_path in shard_node_paths:
+      if not shard_node_path.is_file():
+         logger.critical('Cannot find shard node file: ' + shard_node_path.as_posix())
+         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), shard_node_path.as_posix())
+
+   if not node_output_path.is_dir():
+      logger.critical('Cannot find node output directory: ' + node_output_path.as_posix())
+      raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), node_output_path.as_posix())
+
+   if command_arguments.subjectsType == 'observational':
+      subjects_label = 'Observational'
+      case_sidecar_file_name = _constants.case_obs_sidecar_file_name
+      # The node and QC files with their description and the column identifying the subject of each row
+      outputs = {
+         _constants.case_obs_file_name: ('case node', "*submitter_id"),
+         _constants.demographic_obs_file_name: ('demographic node', "*cases.submitter_id"),
+         _constants.follow_up_obs_file_name: ('follow-up node', "cases.submitter_id"),
+         _constants.follow_up_qc_obs_file_name: ('follow-up QC file', "usubjid"),
+         _constants.audit_obs_file_name: ('audit node', "cases.submitter_id"),
+         _constants.audit_obs_unmatched_file_name: ('audit QC file', "usubjid"),
+      }
+   elif command_arguments.subjectsType == 'clinical':
+      subjects_label = 'Clinical'
+      case_sidecar_file_name = _constants.case_rct_sidecar_file_name
+      outputs = {
+         _constants.case_rct_file_name: ('case node', "*submitter_id"),
+         _constants.demographic_rct_file_name: ('demographic node', "*cases.submitter_id"),
+         _constants.follow_up_rct_file_name: ('follow-up node', "cases.submitter_id"),
+         _constants.follow_up_qc_rct_file_name: ('follow-up QC file', "usubjid"),
+         _constants.audit_rct_file_name: ('audit node', "cases.submitter_id"),
+         _constants.audit_rct_unmatched_file_name: ('audit QC file', "usubjid"),
+      }
+   else:
+      raise ValueError(f'Processing for subjects_type={command_arguments.subjectsType} is not implemented')
+
+   # Every shard writes each node file under the same name
+   shard_paths = {file_name: [] for file_name in outputs}
+   for shard_node_path in shard_node_paths:
+      if shard_node_path.name not in shard_paths:
+         raise ValueError(f'The shard node file {shard_node_path.as_posix()} is not a {subjects_label.lower()} node or QC file')
+      shard_paths[shard_node_path.name].append(shard_node_path)
+   shard_counts = {len(paths) for paths in shard_paths.values()}
+   if len(shard_counts) != 1 or 0 in shard_counts:
+      raise ValueError(f'Every shard must give each of the {subjects_label.lower()} node and QC files: {", ".join(outputs)}')
+
+   logger.info(f'Reading the DCC {subjects_label.lower()} subjects file: {dcc_subjects_path.as_posix()}')
+   with _metrics.stage('read') as stage:
+      df_subjects = pd.read_csv(dcc_subjects_path.as_posix(), usecols=["usubjid"], dtype=str)
+      stage.rows_out = len(df_subjects)
+   subject_order = None
+   if _delta.unique_subjects(df_subjects):
+      subject_ids = df_subjects["usubjid"].astype(object)
+      subject_order = pd.Series(range(len(subject_ids)), index=subject_ids.to_numpy())
+   else:
+      logger.warning('The subjects file has missing or repeated subject IDs, the shard node files are combined in the order given')
+
+   df_case_output = None
+   case_file_path = None
+   for file_name, (description, key_column) in outputs.items():
+      logger.info(f'Combining the {subjects_label.lower()} {description} files of {len(shard_paths[file_name])} shards')
+      df_output = gather_node([_node_io.read_node_text(shard_path) for shard_path in shard_paths[file_name]], key_column, subject_order)
+      _node_io.write_node_file(df_output, Path(node_output_path, file_name), f'{subjects_label} {description}')
+      if command_arguments.validate and description in node_rules:
+         df_report = _validation.validate_node(df_output, node_rules[description], f'{subjects_label.lower()} {description}')
+         _validation.write_report(df_report, Path(node_output_path, file_name), f'{subjects_label} {description}')
+      if key_column == "*submitter_id":
+         df_case_output = df_output
+         case_file_path = Path(node_output_path, file_name)
+   _node_io.write_case_sidecar(df_case_output, Path(node_output_path, case_sidecar_file_name), case_file_path)
+
+   return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of this utility."""
+   parser = argparse.ArgumentParser(
+      prog=Path(__file__).name,
+      description='''This utility combines the case, demographic, follow-up, and audit node and quality control files written by the node
+         mappers for the shards of subjects made by scatter_dcc.py into the node and quality control files of a full run.  The rows are
+         ordered by the DCC subjects file, so the combined files do not depend on the order in which the shard files are given.''',
+      epilog=f'''The shard node files all have the names written by the node mappers, for example \'{_constants.case_obs_file_name}\', and
+         are given from separate directories.  The combined files are written with the same names to the directory given by the
+         --node_output_path argument.''')
+   _cli.add_common_arguments(parser, io_engines=_node_io.io_engines,
+                             io_engine_help='The engine used to write the node files.  Both engines write the same files',
+                             validate_help=f'Check the combined case, demographic, follow-up, and audit nodes against the type and enum rules of their ARDaC node schemas, and save a report of the violations next to each node file, named for example {_validation.report_file_path(Path(_constants.case_obs_file_name)).name}',
+                             metrics_stages='read, validate, and write', subjects_type=True)
+   parser.add_argument('--dcc_subjects_file', dest='dccSubjectsFile', required=True, help='Full path to the DCC input subjects file in CSV format that was split by scatter_dcc.py')
+   parser.add_argument('--shard_node_files', dest='shardNodeFiles', nargs='+', required=True, help='Full paths to the node and QC TSV files written for every shard')
+   parser.add_argument('--node_output_path', dest='nodeOutputPath', required=True, help='Path to the directory where the combined TSV node and quality control files are to be saved')
+
+   return parser
+
+
+def run(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """Run this utility with its parsed command line arguments and give the exit status, see _cli.run_main."""
+   return _cli.run_main(main, command_arguments, logger, Path(__file__).name, {'io_engine': command_arguments.ioEngine, 'arrow_strings': command_arguments.arrowStrings})
+
+
+if __name__ == '__main__':
+   exit(_cli.run_script(build_parser(), run))
@@ -0,0 +1,71 @@
+import os
+import json
+import errno
+import argparse
+import logging
+from pathlib import Path
+from . import _cli
+from . import _metrics
+
+logger = logging.getLogger(__name__)
+
+
+def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """
+   This function combines the JSON metrics files written by the mapper scripts with the
+   --metrics_file argument into one report of the workflow run.
+
+   Parameters
+   ----------
+   command_arguments : argparse.Namespace
+      The command line arguments processed by argparse
+   logger : logging.Logger
+      The logger to be used to provide user feedback
+   """
+   metrics_paths = [Path(metrics_file) for metrics_file in command_arguments.metricsFiles]
+   report_path = Path(command_arguments.reportFile)
+
+   for metrics_path in metrics_paths:
+      if not metrics_path.is_file():
+         logger.critical('Cannot find metrics file: ' + metrics_path.as_posix())
+         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), metrics_path.as_posix())
+
+   if not report_path.parent.is_dir():
+      logger.critical('Cannot find report output directory: ' + report_path.parent.as_posix())
+      raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), report_path.parent.as_posix())
+
+   reports = []
+   for metrics_path in metrics_paths:
+      logger.info(f'Reading metrics file: {metrics_path.as_posix()}')
+      try:
+         reports.append(json.loads(metrics_path.read_text()))
+      except json.JSONDecodeError as e:
+         raise ValueError(f'The metrics file {metrics_path.as_posix()} is not valid JSON: {e}')
+
+   report = _metrics.combine_reports(reports)
+   report_path.write_text(json.dumps(report, indent=3) + '\n')
+   logger.info(f'Metrics report of {len(reports)} mapper runs saved as: {report_path.as_posix()}')
+
+   return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of this utility."""
+   parser = argparse.ArgumentParser(
+      prog=Path(__file__).name,
+      description='''This utility combines the JSON metrics files written by the ARDaC node mappers with the --metrics_file argument
+         into one report of the workflow run, with the stage metrics of every mapper run and their totals.''')
+   _cli.add_common_arguments(parser)
+   parser.add_argument('--metrics_files', dest='metricsFiles', nargs='+', required=True, help='Full paths to the JSON metrics files written by the mapper scripts')
+   parser.add_argument('--report_file', dest='reportFile', required=True, help='Full path to the JSON report file to be written')
+
+   return parser
+
+
+def run(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """Run this utility with its parsed command line arguments and give the exit status, see _cli.run_main."""
+   return _cli.run_main(main, command_arguments, logger, Path(__file__).name, {})
+
+
+if __name__ == '__main__':
+   exit(_cli.run_script(build_parser(), run))
@@ -0,0 +1,149 @@
+import os
+import errno
+import argparse
+import logging
+import pandas as pd
+from pathlib import Path
+from . import _cli
+from . import _delta
+from . import _metrics
+from . import _sharding
+
+logger = logging.getLogger(__name__)
+
+# The number of DCC rows read and split at a time
+scatter_chunk_size = 100000
+
+
+def shard_directory_name(shard: int) -> str:
+   """Give the name of the directory holding the DCC files of a shard."""
+   return f'shard_{shard}'
+
+
+def scatter_dcc_file(dcc_path: Path, shard_paths: list[Path], description: str, single_shard: bool) -> None:
+   """
+   This function splits a DCC CSV file into one file of the same name in each shard
+   directory by a hash of the subject ID, so that every row of a subject lands in the same
+   shard.  The rows keep their order, every column is copied with its values as the text that
+   was read, and every shard file has the header, also when the shard has no rows.
+
+   Parameters
+   ----------
+   dcc_path : Path
+      The full path to the DCC CSV file
+   shard_paths : list[Path]
+      The shard directories, in shard order
+   description : str
+      The description of the file used in the log and error messages
+   single_shard : bool
+      When true every row is written to the first shard
+   """
+   logger.info(f'Splitting the {description} file into {len(shard_paths)} shards: {dcc_path.as_posix()}')
+   with _metrics.stage('read'):
+      columns = pd.read_csv(dcc_path.as_posix(), nrows=0).columns
+   if "usubjid" not in columns:
+      raise ValueError(f'The {description} file {dcc_path.as_posix()} has no usubjid column')
+
+   shard_file_paths = [Path(shard_path, dcc_path.name) for shard_path in shard_paths]
+   with _metrics.stage('write'):
+      for shard_file_path in shard_file_paths:
+         pd.DataFrame(columns=columns).to_csv(shard_file_path.as_posix(), index=False)
+
+   chunks = pd.read_csv(dcc_path.as_posix(), dtype=str, keep_default_na=False, na_filter=False, chunksize=scatter_chunk_size)
+   for df_chunk in _metrics.timed_chunks('read', chunks):
+      with _metrics.stage('write', len(df_chunk)) as stage:
+         if single_shard:
+            chunk_shards = pd.Series(0, index=df_chunk.index)
+         else:
+            chunk_shards = pd.Series(_sharding.shard_numbers(df_chunk["usubjid"], len(shard_paths)), index=df_chunk.index)
+         for shard, df_shard in df_chunk.groupby(chunk_shards, sort=True):
+            df_shard.to_csv(shard_file_paths[shard].as_posix(), mode='a', header=False, index=False)
+            stage.rows_out += len(df_shard)
+
+
+def main(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """
+   This function splits the DCC subjects, liver scores, medical information, vitals, SOC, and
+   audit files of a subjects type into shards of subjects, so that the node mappers can run on
+   each shard separately and gather_nodes.py can combine their node files.
+
+   Parameters
+   ----------
+   command_arguments : argparse.Namespace
+      The command line arguments processed by argparse
+   logger : logging.Logger
+      The logger to be used to provide user feedback
+   """
+   shard_output_path = Path(command_arguments.shardOutputPath)
+   dcc_paths = {
+      'subjects': Path(command_arguments.dccSubjectsFile),
+      'liver scores': Path(command_arguments.dccLiverScoresFile),
+      'medical information': Path(command_arguments.dccMedInfoFile),
+      'vitals': Path(command_arguments.dccVitalsFile),
+      'SOC': Path(command_arguments.dccSOCFile),
+      'audit': Path(command_arguments.dccAuditFile),
+   }
+
+   for description, dcc_path in dcc_paths.items():
+      if not dcc_path.is_file():
+         logger.critical(f'Cannot find DCC {description} file: ' + dcc_path.as_posix())
+         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), dcc_path.as_posix())
+
+   if not shard_output_path.is_dir():
+      logger.critical('Cannot find shard output directory: ' + shard_output_path.as_posix())
+      raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), shard_output_path.as_posix())
+
+   if command_arguments.shards < 1:
+      raise ValueError(f'The number of shards must be at least 1, got {command_arguments.shards}')
+
+   if len(set(dcc_path.name for dcc_path in dcc_paths.values())) < len(dcc_paths):
+      raise ValueError('The DCC files must have different file names, they are written with the same names in each shard directory')
+
+   # The nodes of a shard are ordered by the subjects file as in a full run only when each subject is in it once, otherwise
+   # every row goes to the first shard and the other shards are empty, so that the gathered node files are still those of a full run
+   with _metrics.stage('read'):
+      df_subjects = pd.read_csv(dcc_paths['subjects'].as_posix(), usecols=["usubjid"], dtype=str)
+   single_shard = not _delta.unique_subjects(df_subjects)
+   if single_shard:
+      logger.warning('The subjects file has missing or repeated subject IDs, every subject is written to the first shard')
+
+   shard_paths = [Path(shard_output_path, shard_directory_name(shard)) for shard in range(command_arguments.shards)]
+   for shard_path in shard_paths:
+      shard_path.mkdir(exist_ok=True)
+
+   for description, dcc_path in dcc_paths.items():
+      scatter_dcc_file(dcc_path, shard_paths, f'DCC {command_arguments.subjectsType} {description}', single_shard)
+   logger.info(f'DCC {command_arguments.subjectsType} files split into {command_arguments.shards} shards in: {shard_output_path.as_posix()}')
+
+   return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+   """Give the command line argument parser of this utility."""
+   parser = argparse.ArgumentParser(
+      prog=Path(__file__).name,
+      description='''This utility splits the observational or clinical trial DCC data provided in CSV format files into shards of subjects by
+         a hash of the usubjid column, so that the node mappers can run on each shard in parallel.  Every row of a subject is in the same shard.
+         The node files written for the shards are combined by gather_nodes.py.''',
+      epilog='''Each shard directory, shard_0 to shard_<N-1>, holds a file with the same name and header as each DCC file, with the rows of
+         the subjects of the shard in their original order.''')
+   _cli.add_common_arguments(parser, metrics_stages='read and write', subjects_type=True)
+   parser.add_argument('--dcc_subjects_file', dest='dccSubjectsFile', required=True, help='Full path to the DCC input subjects file in CSV format')
+   parser.add_argument('--dcc_liver_scores_file', dest='dccLiverScoresFile', required=True, help='Full path to the DCC input liver scores file in CSV format')
+   parser.add_argument('--dcc_med_info_file', dest='dccMedInfoFile', required=True, help='Full path to the DCC input medical information file in CSV format')
+   parser.add_argument('--dcc_vitals_file', dest='dccVitalsFile', required=True, help='Full path to the DCC input vitals file in CSV format')
+   parser.add_argument('--dcc_soc_file', dest='dccSOCFile', required=True, help='Full path to the DCC input SOC file in CSV format')
+   parser.add_argument('--dcc_audit_file', dest='dccAuditFile', required=True, help='Full path to the DCC input audit file in CSV format')
+   parser.add_argument('--shards', dest='shards', type=int, required=True, help='The number of shards of subjects to split the DCC files into')
+   parser.add_argument('--shard_output_path', dest='shardOutputPath', required=True, help='Path to the directory where the shard directories are to be created')
+
+   return parser
+
+
+def run(command_arguments: argparse.Namespace, logger: logging.Logger) -> int:
+   """Run this utility with its parsed command line arguments and give the exit status, see _cli.run_main."""
+   return _cli.run_main(main, command_arguments, logger, Path(__file__).name, {'shards': command_arguments.shards})
+
+
+if __name__ == '__main__':
+   exit(_cli.run_script(build_parser(), run))
@@ -0,0 +1,77 @@
+import pytest
+from pathlib import Path
+from typing import NamedTuple
+import synthetic_dcc
+from ardac import _constants
+from ardac import _node_io
+from ardac import case_node_mapper
+
+# Subject counts of the synthetic releases the node mappers are timed with
+benchmark_subject_counts = [1000, 10000, 100000, 1000000]
+
+
+class SyntheticRelease(NamedTuple):
+   """
+   A synthetic DCC release written by synthetic_dcc.generate_release, with the case nodes
+   the other node mappers read.
+
+   Attributes
+   ----------
+   release_path : Path
+      The directory holding the release
+   node_output_path : Path
+      The directory holding the case node files and their sidecar files
+   subject_count : int
+      The number of subjects of each subjects type
+   """
+   release_path: Path
+   node_output_path: Path
+   subject_count: int
+
+   def dcc_file(self, subjects_val: str, file_name: str) -> Path:
+      """Give the full path to a DCC file, for example dcc_file('obs', 'SOC')."""
+      return synthetic_dcc.dcc_file_path(self.release_path, subjects_val, file_name)
+
+   def template_headers(self, template_file_name: str) -> list[str]:
+      """Give the header names of a node template."""
+      return _node_io.read_template_headers(Path(self.release_path, synthetic_dcc.node_templates_directory, template_file_name))
+
+   def case_file(self, subjects_val: str) -> Path:
+      """Give the full path to the case node file of the obs or rct subjects."""
+      return Path(self.node_output_path, _constants.case_obs_file_name if subjects_val == 'obs' else _constants.case_rct_file_name)
+
+
+def pytest_addoption(parser):
+   parser.addoption('--max_subjects', type=int, default=10000,
+                    help=f'The largest synthetic release to time the node mappers with, out of {benchmark_subject_counts} subjects')
+
+
+def pytest_collection_modifyitems(config, items):
+   """Skip the benchmarks when pytest-benchmark is not installed or is disabled, so the functional tests still run."""
+   if config.pluginmanager.hasplugin('benchmark'):
+      return
+   skip_benchmark = pytest.mark.skip(reason='pytest-benchmark is not installed or is disabled')
+   for item in items:
+      if 'benchmark' in getattr(item, 'fixturenames', ()):
+         item.add_marker(skip_benchmark)
+
+
+@pytest.fixture(scope='session', params=benchmark_subject_counts, ids=lambda subject_count: f'{subject_count}_subjects')
+def synthetic_release(request, tmp_path_factory) -> SyntheticRelease:
+   """Write a synthetic release of each benchmark size once per session, with the case nodes written by case_node_mapper.py."""
+   subject_count = request.param
+   if subject_count > request.config.getoption('max_subjects'):
+      pytest.skip(f'{subject_count} subjects is more than --max_subjects')
+
+   release_path = tmp_path_factory.mktemp(f'dcc_{subject_count}_subjects')
+   synthetic_dcc.generate_release(release_path, subject_count)
+   release = SyntheticRelease(release_path, Path(release_path, 'ardac_nodes'), subject_count)
+   release.node_output_path.mkdir()
+
+   case_headers = release.template_headers(_constants.case_template_file_name)
+   obs_case_node = case_node_mapper.generate_observational_case_node(release.dcc_file('obs', 'SUBJECTS'), case_headers)
+   rct_case_node = case_node_mapper.generate_clinical_case_node(release.dcc_file('rct', 'SUBJECTS'), case_headers)
+   for subjects_val, case_node, sidecar_file_name in [('obs', obs_case_node, _constants.case_obs_sidecar_file_name), ('rct', rct_case_node, _constants.case_rct_sidecar_file_name)]:
+      _node_io.write_tsv(case_node, release.case_file(subjects_val))
+      _node_io.write_case_sidecar(case_node.data, Path(release.node_output_path, sidecar_file_name), release.case_file(subjects_val))
+   return release
@@ -0,0 +1,88 @@
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from ardac import _node_io
+from ardac import _node_mappings
+
+
+def write_synthetic_soc_file(dcc_path: Path, subject_count: int, extra_column_count: int, seed: int) -> None:
+   """
+   This function writes a DCC SOC shaped CSV file with one row per subject and visit, the SOC
+   columns used by the follow-up mapping, and extra unmapped columns like those of the DCC
+   release files.
+
+   Parameters
+   ----------
+   dcc_path : Path
+      The full path to the CSV file to be written
+   subject_count : int
+      The number of subjects
+   extra_column_count : int
+      The number of unmapped columns
+   seed : int
+      The random number generator seed
+   """
+   rng = np.random.default_rng(seed)
+   visits = list(_node_mappings.obs_visit_extensions.keys())
+   row_count = subject_count * len(visits)
+   columns = {
+      "usubjid": np.repeat([f'{subject:08d}' for subject in range(subject_count)], len(visits)),
+      "redcap_event_name": visits * subject_count,
+   }
+   for column in _node_mappings.soc_columns[2:]:
+      columns[column] = rng.choice(["0", "1", "2023-04-17", "Not done", ""], size=row_count)
+   for extra_column in range(extra_column_count):
+      columns[f'extra_{extra_column}'] = rng.integers(0, 1000, size=row_count).astype(str)
+   df_soc = pd.DataFrame(columns)
+   df_soc.to_csv(dcc_path.as_posix(), index=False)
+
+
+def time_engine(engine: str, dcc_path: Path, node_path: Path, repeat: int) -> tuple[float, float]:
+   """Give the best read and write times in seconds of the SOC file with the given I/O engine."""
+   _node_io.set_io_engine(engine)
+   read_times = []
+   write_times = []
+   for _ in range(repeat):
+      start = time.perf_counter()
+      df_soc = _node_io.read_dcc_file(dcc_path, _node_mappings.soc_columns, 'synthetic SOC')
+      read_times.append(time.perf_counter() - start)
+
+      df_node = df_soc.astype(object)
+      start = time.perf_counter()
+      _node_io.write_tsv(df_node, node_path)
+      write_times.append(time.perf_counter() - start)
+   return min(read_times), min(write_times)
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(
+      description='''This utility compares the pandas and pyarrow I/O engines of the node mappers on a synthetic DCC SOC shaped CSV file.
+         It reports the best time of reading the mapped SOC columns and of writing them as a TSV node file, and checks that both
+         engines write the same file.''')
+   parser.add_argument('--subjects', dest='subjectCount', type=int, default=50000, help='The number of synthetic subjects, each with one row per observational visit')
+   parser.add_argument('--extra_columns', dest='extraColumnCount', type=int, default=100, help='The number of unmapped columns in the synthetic file')
+   parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='The number of timed repetitions of each engine')
+   parser.add_argument('--seed', dest='seed', type=int, default=0, help='The random number generator seed')
+   parsed_args = parser.parse_args()
+
+   with tempfile.TemporaryDirectory(prefix='io_engine_benchmark_') as work_directory:
+      dcc_path = Path(work_directory, 'SOC.csv')
+      write_synthetic_soc_file(dcc_path, parsed_args.subjectCount, parsed_args.extraColumnCount, parsed_args.seed)
+      print(f'Synthetic SOC file: {parsed_args.subjectCount * len(_node_mappings.obs_visit_extensions)} rows, '
+            f'{dcc_path.stat().st_size / 2**20:.1f} MiB')
+
+      timings = {}
+      for engine in _node_io.io_engines:
+         timings[engine] = time_engine(engine, dcc_path, Path(work_directory, f'{engine}.tsv'), parsed_args.repeat)
+         print(f'{engine:>8}: read {timings[engine][0]:.3f} s, write {timings[engine][1]:.3f} s')
+
+      pandas_read, pandas_write = timings['pandas']
+      pyarrow_read, pyarrow_write = timings['pyarrow']
+      print(f' speedup: read {pandas_read / pyarrow_read:.1f}x, write {pandas_write / pyarrow_write:.1f}x')
+      same = Path(work_directory, 'pandas.tsv').read_bytes() == Path(work_directory, 'pyarrow.tsv').read_bytes()
+      print(f'Identical TSV files: {same}')
+      sys.exit(0 if same else 1)
@@ -0,0 +1,262 @@
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from ardac import _constants
+from ardac import _node_mappings
+
+# Directory and file names of a synthetic release, the defaults of the NextFlow configuration
+node_templates_directory = "node_templates"
+subjects_directories = {"obs": "obs_data", "rct": "rct_data"}
+# The DCC files of each subjects type and the node mapper argument giving each of them
+dcc_file_arguments = {
+   "SUBJECTS": "--dcc_subjects_file",
+   "LIVERSCORES": "--dcc_liver_scores_file",
+   "MEDINFO": "--dcc_med_info_file",
+   "VITALS": "--dcc_vitals_file",
+   "SOC": "--dcc_soc_file",
+   "AUDIT": "--dcc_audit_file",
+}
+
+# Fraction of empty values in the generated data columns
+empty_fraction = 0.1
+# Fraction of subject visits with a row in each visit data file
+visit_fraction = 0.85
+# Fraction of visit and audit rows repeated, which the mappers resolve by keeping one row
+repeat_fraction = 0.02
+# Fraction of visit rows with an event that is not a follow-up visit
+unscheduled_fraction = 0.03
+
+# Values of the subjects columns, as found in the DCC release files
+subjects_values = {
+   "site": [" Site 01", "Site 02 ", "Site 03", "Site 04", "Site 05"],
+   "obs_arm": ["1: Heavy drinker", "2: Alcohol-associated hepatitis", "3: Alcohol-associated cirrhosis"],
+   "rct_arm": ["Arm A: Anakinra plus zinc ", " Arm B: Prednisone"],
+   "rct_meld_strata": ["MELD <= 25 ", " MELD > 25"],
+   "ALIVE": ["Y", "Y", "Y", "N"],
+   "codp": ["Liver failure", "Sepsis", "Gastrointestinal bleeding", "Unknown"],
+   "cods": ["Renal failure", "Pneumonia", "Unknown"],
+   "employed": ["1", "2", "3", "4", "5"],
+   "edu": ["1", "2", "3", "4", "5", "6", "7", "8"],
+   "ethnic": ["1", "2", "3"],
+   "gender": ["1", "2", "3"],
+   "maristat": ["1", "2", "3", "4", "5"],
+   "race": ["1", "2", "3", "4", "5", "6"],
+   "sex": ["1", "2"],
+}
+
+# Ranges of the numeric visit data columns, the other columns are flags or dates
+numeric_ranges = {
+   "meld": (6, 40), "cps": (5, 15), "tlfbnumdd": (0, 30), "tlfbnumd": (0, 400),
+   "weight": (40, 160), "bmi": (16, 50),
+   "adt0101": (0, 4), "adt0102": (0, 4), "adt0103": (0, 4), "adt0104": (0, 4), "adt0105": (0, 4),
+   "adt0106": (0, 4), "adt0107": (0, 4), "adt0108": (0, 4), "adt0109": (0, 4), "adt0110": (0, 4),
+}
+organisms = ["E. coli", "Klebsiella pneumoniae", "Staphylococcus aureus", "Candida albicans", "Enterococcus faecalis"]
+
+
+def random_dates(rng: np.random.Generator, size: int, first_year: int, last_year: int) -> np.ndarray:
+   """Give random YYYY-MM-DD dates between the first and last years."""
+   first_day = np.datetime64(f'{first_year}-01-01')
+   days = rng.integers(0, (last_year - first_year + 1) * 365, size=size)
+   return np.datetime_as_string(first_day + days, unit='D').astype(object)
+
+
+def column_values(rng: np.random.Generator, column: str, size: int) -> np.ndarray:
+   """
+   This function generates the values of a DCC column from its name: categories for the
+   subjects columns, dates for the date columns, numbers for the scores and measurements,
+   organisms for the culture results, and flags otherwise.  A fraction of the values is empty.
+
+   Parameters
+   ----------
+   rng : np.random.Generator
+      The random number generator
+   column : str
+      The DCC column name
+   size : int
+      The number of values
+
+   Return
+   ------
+   An array of string values, with None for the empty values
+   """
+   if column in subjects_values:
+      values = rng.choice(subjects_values[column], size=size).astype(object)
+   elif column.endswith(("dat", "date", "dtc")):
+      values = random_dates(rng, size, 2019, 2025)
+   elif column in numeric_ranges:
+      low, high = numeric_ranges[column]
+      values = rng.integers(low, high + 1, size=size).astype(str).astype(object)
+   elif column.endswith("_pos"):
+      values = rng.choice(organisms, size=size).astype(object)
+   elif column == "calc_age":
+      values = rng.integers(21, 80, size=size).astype(str).astype(object)
+   else:
+      values = rng.choice(["0", "1"], size=size).astype(object)
+   values[rng.random(size) < empty_fraction] = None
+   return values
+
+
+def subjects_frame(rng: np.random.Generator, subject_ids: np.ndarray, extra_column_count: int) -> pd.DataFrame:
+   """Generate the subjects file with one row per subject, the columns of both subjects types, and unmapped columns."""
+   subject_count = len(subject_ids)
+   columns = {"usubjid": subject_ids}
+   for column in _node_mappings.all_nodes_obs_subjects_columns + _node_mappings.all_nodes_rct_subjects_columns:
+      if column not in columns:
+         columns[column] = column_values(rng, column, subject_count)
+   # Birth dates are far before the visits, and most subjects have no death date
+   columns["brthdtc"] = random_dates(rng, subject_count, 1945, 2003)
+   columns["dthdtc"] = np.where(columns["ALIVE"] == "N", random_dates(rng, subject_count, 2020, 2025), None)
+   for extra_column in range(extra_column_count):
+      columns[f'subjects_field_{extra_column}'] = column_values(rng, f'subjects_field_{extra_column}', subject_count)
+   return pd.DataFrame(columns)
+
+
+def visits_frame(rng: np.random.Generator, subject_ids: np.ndarray, visits: list[str], columns: list[str], file_name: str, extra_column_count: int) -> pd.DataFrame:
+   """
+   This function generates a visit data file with rows for most of the visits of each
+   subject, a few repeated rows, and a few rows of unscheduled events, ordered by subject and
+   visit as in the DCC release files.
+
+   Parameters
+   ----------
+   rng : np.random.Generator
+      The random number generator
+   subject_ids : np.ndarray
+      The subject IDs
+   visits : list[str]
+      The redcap_event_name of each follow-up visit
+   columns : list[str]
+      The mapped columns of the file, starting with the key columns
+   file_name : str
+      The DCC file name, used to name the unmapped columns
+   extra_column_count : int
+      The number of unmapped columns
+
+   Return
+   ------
+   A pandas dataframe with the file content
+   """
+   events = visits + ["Unscheduled"]
+   subject_index = np.repeat(np.arange(len(subject_ids)), len(events))
+   event_index = np.tile(np.arange(len(events)), len(subject_ids))
+   scheduled = event_index < len(visits)
+   kept = np.where(scheduled, rng.random(len(event_index)) < visit_fraction, rng.random(len(event_index)) < unscheduled_fraction)
+   rows = np.flatnonzero(kept)
+   rows = np.sort(np.concatenate([rows, rows[rng.random(len(rows)) < repeat_fraction]]), kind="stable")
+
+   row_count = len(rows)
+   data = {
+      "usubjid": subject_ids[subject_index[rows]],
+      "redcap_event_name": np.array(events, dtype=object)[event_index[rows]],
+   }
+   for column in columns[2:]:
+      data[column] = column_values(rng, column, row_count)
+   for extra_column in range(extra_column_count):
+      data[f'{file_name.lower()}_field_{extra_column}'] = column_values(rng, f'{file_name.lower()}_field_{extra_column}', row_count)
+   return pd.DataFrame(data)
+
+
+def audit_frame(rng: np.random.Generator, subject_ids: np.ndarray, first_visit: str, extra_column_count: int) -> pd.DataFrame:
+   """Generate the audit file with a baseline row for most subjects and a few repeated rows."""
+   rows = np.flatnonzero(rng.random(len(subject_ids)) < visit_fraction)
+   rows = np.sort(np.concatenate([rows, rows[rng.random(len(rows)) < repeat_fraction]]), kind="stable")
+   data = {"usubjid": subject_ids[rows], "redcap_event_name": first_visit}
+   for column in _node_mappings.audit_columns[1:]:
+      data[column] = column_values(rng, column, len(rows))
+   for extra_column in range(extra_column_count):
+      data[f'audit_field_{extra_column}'] = column_values(rng, f'audit_field_{extra_column}', len(rows))
+   return pd.DataFrame(data)
+
+
+def template_headers() -> dict[str, list[str]]:
+   """Give the headers of the node templates, the mapped fields followed by a few unmapped fields as in the ARDaC templates."""
+   follow_up_plans = [_node_mappings.follow_up_visit_plan, _node_mappings.liver_scores_plan, _node_mappings.med_info_plan,
+                      _node_mappings.vitals_plan, _node_mappings.soc_plan]
+   case_targets = _node_mappings.case_obs_plan.targets + _node_mappings.case_rct_plan.targets
+   follow_up_targets = [target for plan in follow_up_plans for target in plan.targets]
+   return {
+      _constants.case_template_file_name: list(dict.fromkeys(case_targets)) + ["disease_type", "primary_site"],
+      _constants.demographic_template_file_name: _node_mappings.demographic_plan.targets + ["country_of_residence_at_enrollment"],
+      _constants.follow_up_template_file_name: list(dict.fromkeys(follow_up_targets)) + ["height", "comorbidity"],
+      _constants.audit_template_file_name: _node_mappings.audit_plan.targets + ["audit_total"],
+   }
+
+
+def generate_release(release_path: Path, subject_count: int, seed: int = 0, extra_column_count: int = 10) -> None:
+   """
+   This function writes a synthetic DCC release for the observational and clinical subjects,
+   with the SUBJECTS, LIVERSCORES, MEDINFO, VITALS, SOC and AUDIT CSV files of each subjects
+   type and the four ARDaC node templates.  The files have the mapped columns of the node
+   mappers, unmapped columns like those of the DCC release files, and the redcap_event_name
+   values of the follow-up visits.  The same seed always writes the same files.
+
+   Parameters
+   ----------
+   release_path : Path
+      The directory where the release is written, laid out as the NextFlow input directory
+   subject_count : int
+      The number of subjects of each subjects type
+   seed : int
+      The random number generator seed
+   extra_column_count : int
+      The number of unmapped columns in each DCC file
+   """
+   rng = np.random.default_rng(seed)
+   templates_path = Path(release_path, node_templates_directory)
+   templates_path.mkdir(parents=True, exist_ok=True)
+   for template_file_name, headers in template_headers().items():
+      Path(templates_path, template_file_name).write_text('\t'.join(headers) + '\n')
+
+   visit_columns = {
+      "LIVERSCORES": _node_mappings.liver_scores_columns,
+      "MEDINFO": _node_mappings.med_info_columns,
+      "VITALS": _node_mappings.vitals_columns,
+      "SOC": _node_mappings.soc_columns,
+   }
+   for subjects_val, visit_extensions, id_prefix in [("obs", _node_mappings.obs_visit_extensions, "1"), ("rct", _node_mappings.rct_visit_extensions, "2")]:
+      dcc_path = Path(release_path, subjects_directories[subjects_val])
+      dcc_path.mkdir(parents=True, exist_ok=True)
+      prefix = subjects_val.upper()
+      subject_ids = np.array([f'{id_prefix}{subject:07d}' for subject in range(subject_count)], dtype=object)
+      visits = list(visit_extensions.keys())
+
+      subjects_frame(rng, subject_ids, extra_column_count).to_csv(Path(dcc_path, f'{prefix}_SUBJECTS.csv'), index=False)
+      for file_name, columns in visit_columns.items():
+         df_visits = visits_frame(rng, subject_ids, visits, columns, file_name, extra_column_count)
+         df_visits.to_csv(Path(dcc_path, f'{prefix}_{file_name}.csv'), index=False)
+      audit_frame(rng, subject_ids, visits[0], extra_column_count).to_csv(Path(dcc_path, f'{prefix}_AUDIT.csv'), index=False)
+
+
+def dcc_file_path(release_path: Path, subjects_val: str, file_name: str) -> Path:
+   """Give the full path to a DCC file of a synthetic release, for example dcc_file_path(path, 'obs', 'SOC')."""
+   return Path(release_path, subjects_directories[subjects_val], f'{subjects_val.upper()}_{file_name}.csv')
+
+
+
+def dcc_arguments(dcc_path: Path, subjects_val: str) -> list[str]:
+   """
+   Give the --subjects_type and DCC file arguments of all_nodes_mapper.py and scatter_dcc.py
+   for the obs or rct DCC files of a synthetic release held in a directory, the subjects
+   directory of the release or a shard directory written by scatter_dcc.py.
+   """
+   command_line = ["--subjects_type", "observational" if subjects_val == "obs" else "clinical"]
+   for file_name, argument in dcc_file_arguments.items():
+      command_line += [argument, Path(dcc_path, f'{subjects_val.upper()}_{file_name}.csv').as_posix()]
+   return command_line
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(
+      description='''This utility writes a seeded synthetic DCC release for the observational and clinical subjects, with the SUBJECTS,
+         LIVERSCORES, MEDINFO, VITALS, SOC and AUDIT CSV files and the ARDaC node templates.  It is laid out as the NextFlow input
+         directory, so the workflow and the node mappers can be run and timed without the protected DCC data.''')
+   parser.add_argument('--release_path', dest='releasePath', required=True, help='Path to the directory where the synthetic release is to be written')
+   parser.add_argument('--subjects', dest='subjectCount', type=int, default=1000, help='The number of subjects of each subjects type')
+   parser.add_argument('--extra_columns', dest='extraColumnCount', type=int, default=10, help='The number of unmapped columns in each DCC file')
+   parser.add_argument('--seed', dest='seed', type=int, default=0, help='The random number generator seed')
+   parsed_args = parser.parse_args()
+
+   generate_release(Path(parsed_args.releasePath), parsed_args.subjectCount, parsed_args.seed, parsed_args.extraColumnCount)
+   print(f'Synthetic DCC release of {parsed_args.subjectCount} subjects per subjects type written to {parsed_args.releasePath}')
@@ -0,0 +1,57 @@
+import pytest
+import pandas as pd
+from ardac import _constants
+from ardac import _node_io
+from ardac import audit_node_mapper
+from ardac import case_node_mapper
+from ardac import demographic_node_mapper
+from ardac import follow_up_node_mapper
+
+pytest.importorskip('pyarrow')
+
+
+def node_builds(release, subjects_val: str) -> dict:
+   """Give the generate_*_node function of each node of the obs or rct subjects and its arguments."""
+   observational = subjects_val == 'obs'
+   return {
+      'case': (case_node_mapper.generate_observational_case_node if observational else case_node_mapper.generate_clinical_case_node,
+               release.dcc_file(subjects_val, 'SUBJECTS'), release.template_headers(_constants.case_template_file_name)),
+      'demographic': (demographic_node_mapper.generate_observational_demographic_node if observational else demographic_node_mapper.generate_clinical_demographic_node,
+                      release.dcc_file(subjects_val, 'SUBJECTS'), release.case_file(subjects_val),
+                      release.template_headers(_constants.demographic_template_file_name)),
+      'follow-up': (follow_up_node_mapper.generate_observational_follow_up_node if observational else follow_up_node_mapper.generate_clinical_follow_up_node,
+                    release.dcc_file(subjects_val, 'LIVERSCORES'), release.dcc_file(subjects_val, 'MEDINFO'),
+                    release.dcc_file(subjects_val, 'VITALS'), release.dcc_file(subjects_val, 'SOC'), release.case_file(subjects_val),
+                    release.template_headers(_constants.follow_up_template_file_name)),
+      'audit': (audit_node_mapper.generate_observational_audit_node if observational else audit_node_mapper.generate_clinical_audit_node,
+                release.dcc_file(subjects_val, 'AUDIT'), release.case_file(subjects_val), release.template_headers(_constants.audit_template_file_name)),
+   }
+
+
+def written_node_files(node_build: tuple, arrow_strings: bool, io_engine: str, file_path_prefix) -> list[bytes]:
+   """Generate a node, and its QC data, with or without Arrow backed strings and give the text of the TSV files written."""
+   _node_io.set_io_engine(io_engine)
+   _node_io.set_arrow_strings(arrow_strings)
+   try:
+      generate_node, *args = node_build
+      node_frames = generate_node(*args)
+   finally:
+      _node_io.set_io_engine('pandas')
+      _node_io.set_arrow_strings(False)
+
+   file_texts = []
+   for number, df_output in enumerate((node_frames,) if isinstance(node_frames, _node_io.NodeFrame) else node_frames):
+      if arrow_strings:
+         assert all(isinstance(dtype, pd.StringDtype) for dtype in _node_io.node_frame(df_output).data.dtypes)
+      file_path = file_path_prefix.with_name(f'{file_path_prefix.name}_{number}.tsv')
+      _node_io.write_tsv(df_output, file_path)
+      file_texts.append(file_path.read_bytes())
+   return file_texts
+
+
+@pytest.mark.parametrize('io_engine', ['pandas', 'pyarrow'])
+@pytest.mark.parametrize('node', ['case', 'demographic', 'follow-up', 'audit'])
+@pytest.mark.parametrize('subjects_val', ['obs', 'rct'])
+def test_arrow_strings_write_the_same_files(synthetic_release, subjects_val, node, io_engine, tmp_path):
+   node_build = node_builds(synthetic_release, subjects_val)[node]
+   assert written_node_files(node_build, True, io_engine, tmp_path / 'arrow') == written_node_files(node_build, False, 'pandas', tmp_path / 'object')
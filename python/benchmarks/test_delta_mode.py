@@ -0,0 +1,123 @@
+import logging
+import shutil
+import pandas as pd
+import pytest
+from pathlib import Path
+import synthetic_dcc
+from ardac import _constants
+from ardac import _node_mappings
+from ardac import all_nodes_mapper
+
+# A mapped column changed for one subject in each of these DCC files
+mutated_columns = {
+   'SUBJECTS': "site",
+   'LIVERSCORES': _node_mappings.liver_scores_columns[2],
+   'VITALS': _node_mappings.vitals_columns[2],
+   'SOC': _node_mappings.soc_columns[2],
+}
+
+
+def read_dcc_text(dcc_path: Path) -> pd.DataFrame:
+   """Read a DCC file with every value as its text, so that it is written again unchanged."""
+   return pd.read_csv(dcc_path, dtype=str, keep_default_na=False)
+
+
+def copy_release(release, subjects_val: str, release_path: Path) -> None:
+   """Copy the DCC files of the obs or rct subjects and the node templates of a synthetic release."""
+   shutil.copytree(Path(release.release_path, synthetic_dcc.node_templates_directory), Path(release_path, synthetic_dcc.node_templates_directory))
+   shutil.copytree(Path(release.release_path, synthetic_dcc.subjects_directories[subjects_val]), Path(release_path, synthetic_dcc.subjects_directories[subjects_val]))
+
+
+def next_release(release, subjects_val: str, release_path: Path) -> None:
+   """
+   This function writes the DCC files of a release following a synthetic release, where a few
+   subjects are dropped, a few subjects have a mapped value changed in one of their files, and
+   a few subjects are added with the rows of an existing subject.
+   """
+   copy_release(release, subjects_val, release_path)
+   subject_ids = read_dcc_text(release.dcc_file(subjects_val, 'SUBJECTS'))["usubjid"]
+   dropped = set(subject_ids.iloc[[1, 2, len(subject_ids) - 1]])
+   mutated = dict(zip(mutated_columns, subject_ids.iloc[[5, 6, 7, 8]]))
+   added = {subject_ids.iloc[10]: subject_ids.iloc[10][0] + f'{release.subject_count + 1:07d}',
+            subject_ids.iloc[11]: subject_ids.iloc[11][0] + f'{release.subject_count + 2:07d}'}
+
+   for file_name in synthetic_dcc.dcc_file_arguments:
+      dcc_path = synthetic_dcc.dcc_file_path(release_path, subjects_val, file_name)
+      df_dcc = read_dcc_text(dcc_path)
+      if file_name in mutated_columns:
+         column = mutated_columns[file_name]
+         subject_rows = df_dcc["usubjid"] == mutated[file_name]
+         # A value of another subject that differs from the first value of the mutated subject
+         values = df_dcc.loc[~subject_rows & (df_dcc[column] != ''), column]
+         df_dcc.loc[subject_rows, column] = values[values != df_dcc.loc[subject_rows, column].iloc[0]].iloc[0]
+      df_added = df_dcc[df_dcc["usubjid"].isin(added)].copy()
+      df_added["usubjid"] = df_added["usubjid"].map(added)
+      df_dcc = pd.concat([df_dcc[~df_dcc["usubjid"].isin(dropped)], df_added], ignore_index=True)
+      df_dcc.to_csv(dcc_path, index=False)
+
+
+def map_release(release_path: Path, subjects_val: str, node_output_path: Path, *options: str) -> None:
+   """Run all_nodes_mapper.py on the DCC files of the obs or rct subjects of a release."""
+   node_output_path.mkdir()
+   command_line = ['--node_templates_path', str(Path(release_path, synthetic_dcc.node_templates_directory)), '--node_output_path', str(node_output_path),
+                   *synthetic_dcc.dcc_arguments(Path(release_path, synthetic_dcc.subjects_directories[subjects_val]), subjects_val), *options]
+   command_arguments = all_nodes_mapper.build_parser().parse_args(command_line)
+   assert all_nodes_mapper.run(command_arguments, logging.getLogger('test_delta_mode')) == 0
+
+
+def written_files(node_output_path: Path, subjects_val: str) -> dict[str, bytes]:
+   """Give the content of the node, sidecar, and QC files written by all_nodes_mapper.py, leaving out its manifest."""
+   manifest_file_name = _constants.all_nodes_obs_manifest_file_name if subjects_val == 'obs' else _constants.all_nodes_rct_manifest_file_name
+   return {path.name: path.read_bytes() for path in sorted(node_output_path.iterdir()) if path.name != manifest_file_name}
+
+
+def delta_and_full_runs(release, subjects_val: str, tmp_path: Path, caplog, repeated_subject: bool = False, previous_options: tuple = ()) -> tuple[dict, dict]:
+   """
+   This function maps a synthetic release, and the release following it in delta mode and in
+   full, and gives the files written by the delta and the full runs.  Optionally a subject row
+   is repeated in the subjects file of the following release, or the synthetic release is
+   mapped with other options.
+   """
+   previous_release_path = Path(tmp_path, 'previous_release')
+   release_path = Path(tmp_path, 'release')
+   copy_release(release, subjects_val, previous_release_path)
+   next_release(release, subjects_val, release_path)
+   if repeated_subject:
+      subjects_path = synthetic_dcc.dcc_file_path(release_path, subjects_val, 'SUBJECTS')
+      df_subjects = read_dcc_text(subjects_path)
+      pd.concat([df_subjects, df_subjects.iloc[[20]]], ignore_index=True).to_csv(subjects_path, index=False)
+
+   map_release(previous_release_path, subjects_val, Path(tmp_path, 'previous_nodes'), *previous_options)
+   caplog.clear()
+   map_release(release_path, subjects_val, Path(tmp_path, 'delta_nodes'),
+               '--previous_dcc_path', str(Path(previous_release_path, synthetic_dcc.subjects_directories[subjects_val])),
+               '--previous_nodes_path', str(Path(tmp_path, 'previous_nodes')))
+   map_release(release_path, subjects_val, Path(tmp_path, 'full_nodes'))
+   return written_files(Path(tmp_path, 'delta_nodes'), subjects_val), written_files(Path(tmp_path, 'full_nodes'), subjects_val)
+
+
+@pytest.mark.parametrize('subjects_val', ['obs', 'rct'])
+def test_delta_mode_writes_the_files_of_a_full_run(synthetic_release, subjects_val, tmp_path, caplog):
+   caplog.set_level(logging.INFO)
+   delta_files, full_files = delta_and_full_runs(synthetic_release, subjects_val, tmp_path, caplog)
+   # Three subjects dropped, four changed, and two added
+   assert 'Delta mode: 9 subjects changed since the previous release' in caplog.text
+   assert delta_files == full_files
+
+
+@pytest.mark.parametrize('subjects_val', ['obs', 'rct'])
+def test_delta_mode_maps_every_subject_of_a_subjects_file_with_repeated_subjects(synthetic_release, subjects_val, tmp_path, caplog):
+   caplog.set_level(logging.INFO)
+   delta_files, full_files = delta_and_full_runs(synthetic_release, subjects_val, tmp_path, caplog, repeated_subject=True)
+   assert 'The current subjects file has missing or repeated subject IDs' in caplog.text
+   assert 'Delta mode:' not in caplog.text
+   assert delta_files == full_files
+
+
+@pytest.mark.parametrize('subjects_val', ['obs', 'rct'])
+def test_delta_mode_maps_every_subject_after_a_run_with_other_options(synthetic_release, subjects_val, tmp_path, caplog):
+   caplog.set_level(logging.INFO)
+   delta_files, full_files = delta_and_full_runs(synthetic_release, subjects_val, tmp_path, caplog, previous_options=('--validate',))
+   assert 'The previous run has a different options' in caplog.text
+   assert 'Delta mode:' not in caplog.text
+   assert delta_files == full_files
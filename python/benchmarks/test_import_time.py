@@ -0,0 +1,46 @@
+import os
+import sys
+import subprocess
+import pytest
+from pathlib import Path
+
+# The python directory holding the ardac package, put on the module search path of the commands
+python_path = Path(__file__).resolve().parent.parent
+
+# The cumulative import time allowed for a short command, in microseconds.  Importing pandas
+# alone takes several times longer.
+import_time_budget = 250000
+
+# The modules a short command must not import
+heavy_modules = ['numpy', 'pandas', 'pyarrow']
+
+
+def command_import_times(arguments: list[str]) -> dict[str, tuple[int, bool]]:
+   """
+   Run a command with python -X importtime and give the cumulative import time of each
+   imported module, in microseconds, and whether it was imported at the top level rather than
+   by another module, parsed from the lines written to standard error.
+   """
+   environment = dict(os.environ, PYTHONPATH=python_path.as_posix())
+   completed = subprocess.run([sys.executable, '-X', 'importtime'] + arguments, cwd=python_path, env=environment,
+                              capture_output=True, text=True, check=True)
+   import_times = {}
+   for line in completed.stderr.splitlines():
+      if not line.startswith('import time:') or 'cumulative' in line:
+         continue
+      _, cumulative, module = line.split('|')
+      import_times[module.strip()] = (int(cumulative), not module.startswith('  '))
+   return import_times
+
+
+@pytest.mark.parametrize('arguments', [
+   ['-m', 'ardac', 'version'],
+   ['-m', 'ardac', 'version', '--mapping_version'],
+   ['-m', 'ardac', '--help'],
+   ['-m', 'ardac.batch_runner', '--dcc_version'],
+], ids=lambda arguments: ' '.join(arguments))
+def test_short_command_import_time(arguments):
+   import_times = command_import_times(arguments)
+   imported_heavy_modules = [module for module in import_times if module.split('.')[0] in heavy_modules]
+   assert not imported_heavy_modules
+   assert sum(cumulative for cumulative, top_level in import_times.values() if top_level) < import_time_budget
@@ -0,0 +1,76 @@
+from ardac import _constants
+from ardac import _node_mappings
+from ardac import audit_node_mapper
+from ardac import case_node_mapper
+from ardac import demographic_node_mapper
+from ardac import follow_up_node_mapper
+
+# Releases up to this size are timed over several rounds, larger ones once
+repeated_rounds_subject_count = 10000
+
+
+def run_benchmark(benchmark, release, generate_node, *args):
+   """Time a generate_*_node function on a synthetic release, grouping the results by release size."""
+   benchmark.group = f'{release.subject_count} subjects'
+   rounds = 5 if release.subject_count <= repeated_rounds_subject_count else 1
+   return benchmark.pedantic(generate_node, args=args, rounds=rounds, iterations=1)
+
+
+def test_observational_case_node(benchmark, synthetic_release):
+   df_output = run_benchmark(benchmark, synthetic_release, case_node_mapper.generate_observational_case_node,
+                             synthetic_release.dcc_file('obs', 'SUBJECTS'),
+                             synthetic_release.template_headers(_constants.case_template_file_name))
+   assert len(df_output.data) == synthetic_release.subject_count
+
+
+def test_clinical_case_node(benchmark, synthetic_release):
+   df_output = run_benchmark(benchmark, synthetic_release, case_node_mapper.generate_clinical_case_node,
+                             synthetic_release.dcc_file('rct', 'SUBJECTS'),
+                             synthetic_release.template_headers(_constants.case_template_file_name))
+   assert len(df_output.data) == synthetic_release.subject_count
+
+
+def test_observational_demographic_node(benchmark, synthetic_release):
+   df_output = run_benchmark(benchmark, synthetic_release, demographic_node_mapper.generate_observational_demographic_node,
+                             synthetic_release.dcc_file('obs', 'SUBJECTS'), synthetic_release.case_file('obs'),
+                             synthetic_release.template_headers(_constants.demographic_template_file_name))
+   assert len(df_output.data) == synthetic_release.subject_count
+
+
+def test_clinical_demographic_node(benchmark, synthetic_release):
+   df_output = run_benchmark(benchmark, synthetic_release, demographic_node_mapper.generate_clinical_demographic_node,
+                             synthetic_release.dcc_file('rct', 'SUBJECTS'), synthetic_release.case_file('rct'),
+                             synthetic_release.template_headers(_constants.demographic_template_file_name))
+   assert len(df_output.data) == synthetic_release.subject_count
+
+
+def test_observational_follow_up_node(benchmark, synthetic_release):
+   df_output, df_qc = run_benchmark(benchmark, synthetic_release, follow_up_node_mapper.generate_observational_follow_up_node,
+                                    synthetic_release.dcc_file('obs', 'LIVERSCORES'), synthetic_release.dcc_file('obs', 'MEDINFO'),
+                                    synthetic_release.dcc_file('obs', 'VITALS'), synthetic_release.dcc_file('obs', 'SOC'),
+                                    synthetic_release.case_file('obs'),
+                                    synthetic_release.template_headers(_constants.follow_up_template_file_name))
+   assert len(df_output.data) + len(df_qc) == synthetic_release.subject_count * len(_node_mappings.obs_visit_extensions)
+
+
+def test_clinical_follow_up_node(benchmark, synthetic_release):
+   df_output, df_qc = run_benchmark(benchmark, synthetic_release, follow_up_node_mapper.generate_clinical_follow_up_node,
+                                    synthetic_release.dcc_file('rct', 'LIVERSCORES'), synthetic_release.dcc_file('rct', 'MEDINFO'),
+                                    synthetic_release.dcc_file('rct', 'VITALS'), synthetic_release.dcc_file('rct', 'SOC'),
+                                    synthetic_release.case_file('rct'),
+                                    synthetic_release.template_headers(_constants.follow_up_template_file_name))
+   assert len(df_output.data) + len(df_qc) == synthetic_release.subject_count * len(_node_mappings.rct_visit_extensions)
+
+
+def test_observational_audit_node(benchmark, synthetic_release):
+   df_output, df_unmatched = run_benchmark(benchmark, synthetic_release, audit_node_mapper.generate_observational_audit_node,
+                                           synthetic_release.dcc_file('obs', 'AUDIT'), synthetic_release.case_file('obs'),
+                                           synthetic_release.template_headers(_constants.audit_template_file_name))
+   assert len(df_output.data) + len(df_unmatched) == synthetic_release.subject_count
+
+
+def test_clinical_audit_node(benchmark, synthetic_release):
+   df_output, df_unmatched = run_benchmark(benchmark, synthetic_release, audit_node_mapper.generate_clinical_audit_node,
+                                           synthetic_release.dcc_file('rct', 'AUDIT'), synthetic_release.case_file('rct'),
+                                           synthetic_release.template_headers(_constants.audit_template_file_name))
+   assert len(df_output.data) + len(df_unmatched) == synthetic_release.subject_count
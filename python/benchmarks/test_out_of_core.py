@@ -0,0 +1,90 @@
+import logging
+import shutil
+import pandas as pd
+import pytest
+from pathlib import Path
+import synthetic_dcc
+from ardac import _constants
+from ardac import follow_up_node_mapper
+
+# The visit data files read by the follow-up mapper
+source_file_names = ['LIVERSCORES', 'MEDINFO', 'VITALS', 'SOC']
+
+
+def read_text(file_path: Path, sep: str = ',') -> pd.DataFrame:
+   """Read a DCC or node file with every value as its text."""
+   return pd.read_csv(file_path, sep=sep, dtype=str, keep_default_na=False)
+
+
+def follow_up_release(release, subjects_val: str, release_path: Path, empty_source: str | None = None) -> Path:
+   """
+   This function copies the visit data files of a synthetic release with a few rows without a
+   subject ID added to each, optionally leaving one of them without rows, and writes the case
+   node of the release with its rows shuffled.  It gives the full path to the case node file.
+   """
+   shutil.copytree(Path(release.release_path, synthetic_dcc.node_templates_directory), Path(release_path, synthetic_dcc.node_templates_directory))
+   for file_name in source_file_names:
+      dcc_path = synthetic_dcc.dcc_file_path(release_path, subjects_val, file_name)
+      dcc_path.parent.mkdir(exist_ok=True)
+      df_dcc = read_text(release.dcc_file(subjects_val, file_name))
+      if file_name == empty_source:
+         df_dcc = df_dcc.iloc[:0]
+      else:
+         df_missing = df_dcc.iloc[[0, 3, 6]].assign(usubjid='')
+         df_dcc = pd.concat([df_dcc.iloc[:50], df_missing, df_dcc.iloc[50:]], ignore_index=True)
+      df_dcc.to_csv(dcc_path, index=False)
+
+   case_path = Path(release_path, 'case', release.case_file(subjects_val).name)
+   case_path.parent.mkdir()
+   read_text(release.case_file(subjects_val), '\t').sample(frac=1, random_state=0).to_csv(case_path, sep='\t', index=False)
+   return case_path
+
+
+def map_follow_up(release_path: Path, subjects_val: str, case_path: Path, node_output_path: Path, *options: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+   """Run follow_up_node_mapper.py on a release and give its follow-up node and QC data, with every value as its text."""
+   node_output_path.mkdir()
+   command_line = ['--node_templates_path', str(Path(release_path, synthetic_dcc.node_templates_directory)),
+                   '--subjects_type', 'observational' if subjects_val == 'obs' else 'clinical',
+                   '--node_output_path', str(node_output_path), '--case_node_file', str(case_path), *options]
+   for file_name in source_file_names:
+      command_line += [synthetic_dcc.dcc_file_arguments[file_name], str(synthetic_dcc.dcc_file_path(release_path, subjects_val, file_name))]
+   command_arguments = follow_up_node_mapper.build_parser().parse_args(command_line)
+   assert follow_up_node_mapper.run(command_arguments, logging.getLogger('test_out_of_core')) == 0
+
+   node_file_name, qc_file_name = ((_constants.follow_up_obs_file_name, _constants.follow_up_qc_obs_file_name) if subjects_val == 'obs'
+                                   else (_constants.follow_up_rct_file_name, _constants.follow_up_qc_rct_file_name))
+   qc_path = Path(node_output_path, qc_file_name)
+   df_qc = read_text(qc_path, '\t') if qc_path.stat().st_size > 0 else pd.DataFrame()
+   return read_text(Path(node_output_path, node_file_name), '\t'), df_qc
+
+
+def sorted_rows(df_node: pd.DataFrame, key_columns: list[str]) -> pd.DataFrame:
+   """Give the rows of node or QC data sorted by the key columns, keeping the order of rows with the same keys."""
+   if df_node.empty:
+      return df_node
+   return df_node.sort_values(key_columns, kind='stable').reset_index(drop=True)
+
+
+def in_memory_and_out_of_core_runs(release, subjects_val: str, tmp_path: Path, empty_source: str | None = None) -> None:
+   """Map the follow-up node of a synthetic release in memory and out of core, and check that both runs give the same rows."""
+   release_path = Path(tmp_path, 'release')
+   case_path = follow_up_release(release, subjects_val, release_path, empty_source)
+   # A chunk size giving several sorted runs of each file and several batches of subjects
+   chunk_size = max(1, release.subject_count // 4)
+   df_node, df_qc = map_follow_up(release_path, subjects_val, case_path, Path(tmp_path, 'in_memory_nodes'))
+   df_node_streamed, df_qc_streamed = map_follow_up(release_path, subjects_val, case_path, Path(tmp_path, 'out_of_core_nodes'),
+                                                    '--out_of_core', '--chunk_size', str(chunk_size), '--temp_path', str(tmp_path))
+
+   pd.testing.assert_frame_equal(sorted_rows(df_node_streamed, ["*submitter_id"]), sorted_rows(df_node, ["*submitter_id"]))
+   assert list(df_qc_streamed.columns) == list(df_qc.columns)
+   pd.testing.assert_frame_equal(sorted_rows(df_qc_streamed, list(df_qc.columns)), sorted_rows(df_qc, list(df_qc.columns)))
+
+
+@pytest.mark.parametrize('subjects_val', ['obs', 'rct'])
+def test_out_of_core_gives_the_rows_of_the_in_memory_mapper(synthetic_release, subjects_val, tmp_path):
+   in_memory_and_out_of_core_runs(synthetic_release, subjects_val, tmp_path)
+
+
+@pytest.mark.parametrize('subjects_val', ['obs', 'rct'])
+def test_out_of_core_with_an_empty_source_gives_the_rows_of_the_in_memory_mapper(synthetic_release, subjects_val, tmp_path):
+   in_memory_and_out_of_core_runs(synthetic_release, subjects_val, tmp_path, empty_source='VITALS')
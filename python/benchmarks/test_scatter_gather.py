@@ -0,0 +1,92 @@
+import logging
+import shutil
+import pandas as pd
+import pytest
+from pathlib import Path
+import synthetic_dcc
+from ardac import _constants
+from ardac import all_nodes_mapper
+from ardac import gather_nodes
+from ardac import scatter_dcc
+
+
+def map_dcc_files(release_path: Path, dcc_path: Path, subjects_val: str, node_output_path: Path) -> None:
+   """Run all_nodes_mapper.py on the obs or rct DCC files held in a directory, with the node templates of a synthetic release."""
+   node_output_path.mkdir()
+   command_line = ['--node_templates_path', str(Path(release_path, synthetic_dcc.node_templates_directory)), '--node_output_path', str(node_output_path),
+                   *synthetic_dcc.dcc_arguments(dcc_path, subjects_val)]
+   command_arguments = all_nodes_mapper.build_parser().parse_args(command_line)
+   assert all_nodes_mapper.run(command_arguments, logging.getLogger('test_scatter_gather')) == 0
+
+
+def node_files(node_output_path: Path, subjects_val: str) -> list[Path]:
+   """Give the node and QC files written by all_nodes_mapper.py, leaving out its manifest and the case sidecar file."""
+   other_file_names = ([_constants.all_nodes_obs_manifest_file_name, _constants.case_obs_sidecar_file_name] if subjects_val == 'obs'
+                       else [_constants.all_nodes_rct_manifest_file_name, _constants.case_rct_sidecar_file_name])
+   return [path for path in sorted(node_output_path.iterdir()) if path.name not in other_file_names]
+
+
+def written_files(node_output_path: Path) -> dict[str, bytes]:
+   """Give the content of every file in a node output directory other than the all_nodes_mapper.py manifest."""
+   return {path.name: path.read_bytes() for path in sorted(node_output_path.iterdir()) if not path.name.startswith('all_nodes_')}
+
+
+def scatter_map_gather(release_path: Path, subjects_val: str, shards: int, tmp_path: Path) -> tuple[dict[str, bytes], dict[str, bytes]]:
+   """
+   This function maps the obs or rct DCC files of a release in one run, and in shards split by
+   scatter_dcc.py whose node files are combined by gather_nodes.py, and gives the files written
+   by the unsharded run and by gather_nodes.py.
+   """
+   dcc_path = Path(release_path, synthetic_dcc.subjects_directories[subjects_val])
+   map_dcc_files(release_path, dcc_path, subjects_val, Path(tmp_path, 'full_nodes'))
+
+   shard_output_path = Path(tmp_path, 'shards')
+   shard_output_path.mkdir()
+   scatter_arguments = scatter_dcc.build_parser().parse_args(['--shards', str(shards), '--shard_output_path', str(shard_output_path),
+                                                              *synthetic_dcc.dcc_arguments(dcc_path, subjects_val)])
+   assert scatter_dcc.run(scatter_arguments, logging.getLogger('test_scatter_gather')) == 0
+
+   shard_node_files = []
+   for shard in range(shards):
+      shard_path = Path(shard_output_path, scatter_dcc.shard_directory_name(shard))
+      map_dcc_files(release_path, shard_path, subjects_val, Path(shard_path, 'nodes'))
+      shard_node_files += node_files(Path(shard_path, 'nodes'), subjects_val)
+
+   gather_arguments = gather_nodes.build_parser().parse_args(['--subjects_type', 'observational' if subjects_val == 'obs' else 'clinical',
+                                                              '--dcc_subjects_file', str(synthetic_dcc.dcc_file_path(release_path, subjects_val, 'SUBJECTS')),
+                                                              '--node_output_path', str(Path(tmp_path, 'gathered_nodes')),
+                                                              '--shard_node_files', *map(str, shard_node_files)])
+   Path(tmp_path, 'gathered_nodes').mkdir()
+   assert gather_nodes.run(gather_arguments, logging.getLogger('test_scatter_gather')) == 0
+   return written_files(Path(tmp_path, 'gathered_nodes')), written_files(Path(tmp_path, 'full_nodes'))
+
+
+@pytest.mark.parametrize('subjects_val', ['obs', 'rct'])
+def test_gathered_shards_write_the_files_of_an_unsharded_run(synthetic_release, subjects_val, tmp_path):
+   gathered_files, full_files = scatter_map_gather(synthetic_release.release_path, subjects_val, 4, tmp_path)
+   assert gathered_files == full_files
+
+
+@pytest.mark.parametrize('subjects_val', ['obs', 'rct'])
+def test_more_shards_than_subjects_write_the_files_of_an_unsharded_run(subjects_val, tmp_path):
+   release_path = Path(tmp_path, 'release')
+   synthetic_dcc.generate_release(release_path, 3)
+   gathered_files, full_files = scatter_map_gather(release_path, subjects_val, 8, tmp_path)
+   assert gathered_files == full_files
+
+
+@pytest.mark.parametrize('subjects_val', ['obs', 'rct'])
+def test_repeated_subjects_are_mapped_in_a_single_shard(synthetic_release, subjects_val, tmp_path, caplog):
+   release_path = Path(tmp_path, 'release')
+   shutil.copytree(Path(synthetic_release.release_path, synthetic_dcc.node_templates_directory), Path(release_path, synthetic_dcc.node_templates_directory))
+   shutil.copytree(Path(synthetic_release.release_path, synthetic_dcc.subjects_directories[subjects_val]), Path(release_path, synthetic_dcc.subjects_directories[subjects_val]))
+   subjects_path = synthetic_dcc.dcc_file_path(release_path, subjects_val, 'SUBJECTS')
+   df_subjects = pd.read_csv(subjects_path, dtype=str, keep_default_na=False)
+   pd.concat([df_subjects, df_subjects.iloc[[20]]], ignore_index=True).to_csv(subjects_path, index=False)
+
+   caplog.set_level(logging.INFO)
+   gathered_files, full_files = scatter_map_gather(release_path, subjects_val, 4, tmp_path)
+   assert 'every subject is written to the first shard' in caplog.text
+   assert gathered_files == full_files
+   shard_subjects = [pd.read_csv(Path(tmp_path, 'shards', scatter_dcc.shard_directory_name(shard), subjects_path.name)) for shard in range(4)]
+   assert len(shard_subjects[0]) == len(df_subjects) + 1 and all(df_shard.empty for df_shard in shard_subjects[1:])
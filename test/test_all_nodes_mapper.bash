@@ -0,0 +1,42 @@
+#!/usr/bin/env bash
+
+this_script_name=`basename $0`
+MAPPERS_HOME="$(cd "`dirname "$0"`"/..; pwd)"
+echo "INFO($this_script_name): MAPPERS_HOME=${MAPPERS_HOME}"
+
+source ${MAPPERS_HOME}/test/test_config.bash
+
+DCC_OBS_SUBJECTS_FILE=${DCC_OBS_PATH}/OBS_SUBJECTS.csv
+DCC_RCT_SUBJECTS_FILE=${DCC_RCT_PATH}/RCT_SUBJECTS.csv
+
+DCC_OBS_LIVER_SCORES_FILE=${DCC_OBS_PATH}/OBS_LIVERSCORES.csv
+DCC_RCT_LIVER_SCORES_FILE=${DCC_RCT_PATH}/RCT_LIVERSCORES.csv
+
+DCC_OBS_MED_INFO_FILE=${DCC_OBS_PATH}/OBS_MEDINFO.csv
+
+DCC_OBS_VITALS_FILE=${DCC_OBS_PATH}/OBS_VITALS.csv
+DCC_RCT_VITALS_FILE=${DCC_RCT_PATH}/RCT_VITALS.csv
+
+DCC_OBS_SOC_FILE=${DCC_OBS_PATH}/OBS_SOC.csv
+DCC_RCT_SOC_FILE=${DCC_RCT_PATH}/RCT_SOC.csv
+
+DCC_OBS_AUDIT_FILE=${DCC_OBS_PATH}/OBS_AUDIT.csv
+DCC_RCT_AUDIT_FILE=${DCC_RCT_PATH}/RCT_AUDIT.csv
+
+# The scripts are run as modules of the ardac package in the python directory
+export PYTHONPATH=${MAPPERS_HOME}/python
+mapper_module=ardac.all_nodes_mapper
+echo "INFO($this_script_name): mapper_module=${mapper_module}"
+
+version=$(python -m ${mapper_module} --version)
+echo "INFO($this_script_name): version='${version}'"
+
+dcc_version=$(python -m ${mapper_module} --dcc_version)
+echo "INFO($this_script_name): dcc_version='${dcc_version}'"
+
+mapping_version=$(python -m ${mapper_module} --mapping_version)
+echo "INFO($this_script_name): mapping_version='${mapping_version}'"
+
+python -m ${mapper_module} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type observational --dcc_subjects_file ${DCC_OBS_SUBJECTS_FILE} --dcc_liver_scores_file ${DCC_OBS_LIVER_SCORES_FILE} --dcc_med_info_file ${DCC_OBS_MED_INFO_FILE} --dcc_vitals_file ${DCC_OBS_VITALS_FILE} --dcc_soc_file ${DCC_OBS_SOC_FILE} --dcc_audit_file ${DCC_OBS_AUDIT_FILE} --node_output_path ${NODE_OUTPUT_PATH}
+
+python -m ${mapper_module} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type clinical --dcc_subjects_file ${DCC_RCT_SUBJECTS_FILE} --dcc_liver_scores_file ${DCC_RCT_LIVER_SCORES_FILE} --dcc_med_info_file ${DCC_OBS_MED_INFO_FILE} --dcc_vitals_file ${DCC_RCT_VITALS_FILE} --dcc_soc_file ${DCC_RCT_SOC_FILE} --dcc_audit_file ${DCC_RCT_AUDIT_FILE} --node_output_path ${NODE_OUTPUT_PATH}
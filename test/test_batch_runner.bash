@@ -0,0 +1,54 @@
+#!/usr/bin/env bash
+
+this_script_name=`basename $0`
+MAPPERS_HOME="$(cd "`dirname "$0"`"/..; pwd)"
+echo "INFO($this_script_name): MAPPERS_HOME=${MAPPERS_HOME}"
+
+source ${MAPPERS_HOME}/test/test_config.bash
+
+DCC_OBS_SUBJECTS_FILE=${DCC_OBS_PATH}/OBS_SUBJECTS.csv
+DCC_RCT_SUBJECTS_FILE=${DCC_RCT_PATH}/RCT_SUBJECTS.csv
+
+DCC_OBS_LIVER_SCORES_FILE=${DCC_OBS_PATH}/OBS_LIVERSCORES.csv
+DCC_RCT_LIVER_SCORES_FILE=${DCC_RCT_PATH}/RCT_LIVERSCORES.csv
+
+DCC_OBS_MED_INFO_FILE=${DCC_OBS_PATH}/OBS_MEDINFO.csv
+
+DCC_OBS_VITALS_FILE=${DCC_OBS_PATH}/OBS_VITALS.csv
+DCC_RCT_VITALS_FILE=${DCC_RCT_PATH}/RCT_VITALS.csv
+
+DCC_OBS_SOC_FILE=${DCC_OBS_PATH}/OBS_SOC.csv
+DCC_RCT_SOC_FILE=${DCC_RCT_PATH}/RCT_SOC.csv
+
+DCC_OBS_AUDIT_FILE=${DCC_OBS_PATH}/OBS_AUDIT.csv
+DCC_RCT_AUDIT_FILE=${DCC_RCT_PATH}/RCT_AUDIT.csv
+
+# The scripts are run as modules of the ardac package in the python directory
+export PYTHONPATH=${MAPPERS_HOME}/python
+batch_module=ardac.batch_runner
+echo "INFO($this_script_name): batch_module=${batch_module}"
+
+# The version arguments are answered without importing pandas
+version=$(python -m ${batch_module} --version)
+echo "INFO($this_script_name): version='${version}'"
+
+dcc_version=$(python -m ${batch_module} --dcc_version)
+echo "INFO($this_script_name): dcc_version='${dcc_version}'"
+
+mapping_version=$(python -m ${batch_module} --mapping_version)
+echo "INFO($this_script_name): mapping_version='${mapping_version}'"
+
+# One job per mapper and subjects type, run in manifest order in one Python interpreter
+jobs_file=${NODE_OUTPUT_PATH}/batch_runner_jobs.tsv
+echo "INFO($this_script_name): jobs_file=${jobs_file}"
+printf 'mapper\tsubjects_type\tlog_level\tnode_templates_path\tnode_output_path\tdcc_subjects_file\tdcc_liver_scores_file\tdcc_med_info_file\tdcc_vitals_file\tdcc_soc_file\tdcc_audit_file\n' > ${jobs_file}
+printf 'case\tobservational\tDEBUG\t%s\t%s\t%s\t\t\t\t\t\n' ${NODE_TEMPLATES_PATH} ${NODE_OUTPUT_PATH} ${DCC_OBS_SUBJECTS_FILE} >> ${jobs_file}
+printf 'demographic\tobservational\tDEBUG\t%s\t%s\t%s\t\t\t\t\t\n' ${NODE_TEMPLATES_PATH} ${NODE_OUTPUT_PATH} ${DCC_OBS_SUBJECTS_FILE} >> ${jobs_file}
+printf 'follow-up\tobservational\tDEBUG\t%s\t%s\t\t%s\t%s\t%s\t%s\t\n' ${NODE_TEMPLATES_PATH} ${NODE_OUTPUT_PATH} ${DCC_OBS_LIVER_SCORES_FILE} ${DCC_OBS_MED_INFO_FILE} ${DCC_OBS_VITALS_FILE} ${DCC_OBS_SOC_FILE} >> ${jobs_file}
+printf 'audit\tobservational\tDEBUG\t%s\t%s\t\t\t\t\t\t%s\n' ${NODE_TEMPLATES_PATH} ${NODE_OUTPUT_PATH} ${DCC_OBS_AUDIT_FILE} >> ${jobs_file}
+printf 'case\tclinical\tDEBUG\t%s\t%s\t%s\t\t\t\t\t\n' ${NODE_TEMPLATES_PATH} ${NODE_OUTPUT_PATH} ${DCC_RCT_SUBJECTS_FILE} >> ${jobs_file}
+printf 'demographic\tclinical\tDEBUG\t%s\t%s\t%s\t\t\t\t\t\n' ${NODE_TEMPLATES_PATH} ${NODE_OUTPUT_PATH} ${DCC_RCT_SUBJECTS_FILE} >> ${jobs_file}
+printf 'follow-up\tclinical\tDEBUG\t%s\t%s\t\t%s\t%s\t%s\t%s\t\n' ${NODE_TEMPLATES_PATH} ${NODE_OUTPUT_PATH} ${DCC_RCT_LIVER_SCORES_FILE} ${DCC_OBS_MED_INFO_FILE} ${DCC_RCT_VITALS_FILE} ${DCC_RCT_SOC_FILE} >> ${jobs_file}
+printf 'audit\tclinical\tDEBUG\t%s\t%s\t\t\t\t\t\t%s\n' ${NODE_TEMPLATES_PATH} ${NODE_OUTPUT_PATH} ${DCC_RCT_AUDIT_FILE} >> ${jobs_file}
+
+python -m ${batch_module} --log_level DEBUG --jobs_file ${jobs_file} --status_file ${NODE_OUTPUT_PATH}/batch_runner_status.tsv --stop_on_failure
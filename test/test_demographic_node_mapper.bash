@@ -9,18 +9,20 @@ source ${MAPPERS_HOME}/test/test_config.bash
 DCC_OBS_SUBJECTS_FILE=${DCC_OBS_PATH}/OBS_SUBJECTS.csv
 DCC_RCT_SUBJECTS_FILE=${DCC_RCT_PATH}/RCT_SUBJECTS.csv
 
-mapper_script=${MAPPERS_HOME}/python/ardac/demographic_node_mapper.py
-echo "INFO($this_script_name): mapper_script=${mapper_script}"
+# The scripts are run as modules of the ardac package in the python directory
+export PYTHONPATH=${MAPPERS_HOME}/python
+mapper_module=ardac.demographic_node_mapper
+echo "INFO($this_script_name): mapper_module=${mapper_module}"
 
-version=$(python ${mapper_script} --version)
+version=$(python -m ${mapper_module} --version)
 echo "INFO($this_script_name): version='${version}'"
 
-dcc_version=$(python ${mapper_script} --dcc_version)
+dcc_version=$(python -m ${mapper_module} --dcc_version)
 echo "INFO($this_script_name): dcc_version='${dcc_version}'"
 
-mapping_version=$(python ${mapper_script} --mapping_version)
+mapping_version=$(python -m ${mapper_module} --mapping_version)
 echo "INFO($this_script_name): mapping_version='${mapping_version}'"
 
-python ${mapper_script} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type observational --dcc_subjects_file ${DCC_OBS_SUBJECTS_FILE} --node_output_path ${NODE_OUTPUT_PATH}
+python -m ${mapper_module} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type observational --dcc_subjects_file ${DCC_OBS_SUBJECTS_FILE} --node_output_path ${NODE_OUTPUT_PATH}
 
-python ${mapper_script} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type clinical --dcc_subjects_file ${DCC_RCT_SUBJECTS_FILE} --node_output_path ${NODE_OUTPUT_PATH}
+python -m ${mapper_module} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type clinical --dcc_subjects_file ${DCC_RCT_SUBJECTS_FILE} --node_output_path ${NODE_OUTPUT_PATH}
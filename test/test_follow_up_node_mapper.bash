@@ -20,19 +20,21 @@ DCC_RCT_VITALS_FILE=${DCC_RCT_PATH}/RCT_VITALS.csv
 DCC_OBS_SOC_FILE=${DCC_OBS_PATH}/OBS_SOC.csv
 DCC_RCT_SOC_FILE=${DCC_RCT_PATH}/RCT_SOC.csv
 
-mapper_script=${MAPPERS_HOME}/python/ardac/follow_up_node_mapper.py
-echo "INFO($this_script_name): mapper_script=${mapper_script}"
+# The scripts are run as modules of the ardac package in the python directory
+export PYTHONPATH=${MAPPERS_HOME}/python
+mapper_module=ardac.follow_up_node_mapper
+echo "INFO($this_script_name): mapper_module=${mapper_module}"
 
-version=$(python ${mapper_script} --version)
+version=$(python -m ${mapper_module} --version)
 echo "INFO($this_script_name): version='${version}'"
 
-dcc_version=$(python ${mapper_script} --dcc_version)
+dcc_version=$(python -m ${mapper_module} --dcc_version)
 echo "INFO($this_script_name): dcc_version='${dcc_version}'"
 
-mapping_version=$(python ${mapper_script} --mapping_version)
+mapping_version=$(python -m ${mapper_module} --mapping_version)
 echo "INFO($this_script_name): mapping_version='${mapping_version}'"
 
-python ${mapper_script} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type observational --dcc_liver_scores_file ${DCC_OBS_LIVER_SCORES_FILE} --dcc_med_info_file ${DCC_OBS_MED_INFO_FILE} --dcc_vitals_file ${DCC_OBS_VITALS_FILE} --dcc_soc_file ${DCC_OBS_SOC_FILE} --node_output_path ${NODE_OUTPUT_PATH}
+python -m ${mapper_module} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type observational --dcc_liver_scores_file ${DCC_OBS_LIVER_SCORES_FILE} --dcc_med_info_file ${DCC_OBS_MED_INFO_FILE} --dcc_vitals_file ${DCC_OBS_VITALS_FILE} --dcc_soc_file ${DCC_OBS_SOC_FILE} --node_output_path ${NODE_OUTPUT_PATH}
 
-python ${mapper_script} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type clinical --dcc_liver_scores_file ${DCC_RCT_LIVER_SCORES_FILE} --dcc_med_info_file ${DCC_OBS_MED_INFO_FILE} --dcc_vitals_file ${DCC_RCT_VITALS_FILE} --dcc_soc_file ${DCC_RCT_SOC_FILE} --node_output_path ${NODE_OUTPUT_PATH}
+python -m ${mapper_module} --log_level DEBUG --node_templates_path ${NODE_TEMPLATES_PATH} --subjects_type clinical --dcc_liver_scores_file ${DCC_RCT_LIVER_SCORES_FILE} --dcc_med_info_file ${DCC_OBS_MED_INFO_FILE} --dcc_vitals_file ${DCC_RCT_VITALS_FILE} --dcc_soc_file ${DCC_RCT_SOC_FILE} --node_output_path ${NODE_OUTPUT_PATH}
 